@@ -2,6 +2,14 @@ import os
 import re
 import sys
 import json
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models'))
+from instance_loader import load_instance, content_digest
 
 TIMEOUT = 300
 # OPT[i] = Optimal value for instance i. 
@@ -49,27 +57,8 @@ def main(args):
         inst_number = '0' + inst_number
       inst_path = args[1] + '/inst' + inst_number + '.dat'
       print(f'\tLoading input instance {inst_path}')
-      with open(inst_path) as inst_file:
-        i = 0        
-        for line in inst_file:
-          if i == 0:
-            n_couriers = int(line)
-          elif i == 1:
-            n_items = int(line)
-            dist_matrix = [None] * (n_items + 1)
-          elif i == 2:
-            capacity = [int(x) for x in line.split()]
-            assert len(capacity) == n_couriers
-          elif i == 3:
-            sizes = [int(x) for x in line.split()]
-            assert len(sizes) == n_items
-          else:
-            row = [int(x) for x in line.split()]
-            assert len(row) == n_items + 1
-            dist_matrix[i-4] = [int(x) for x in row]
-          i += 1
-      for i in range(len(dist_matrix)):
-        assert dist_matrix[i][i] == 0
+      n_couriers, n_items, capacity, sizes, dist_matrix = load_instance(inst_path)
+      assert (dist_matrix.diagonal() == 0).all()
       for solver, result in results.items():
         print(f'\t\tChecking solver {solver}')
         header = f'Solver {solver}, instance {inst_number}'
@@ -122,5 +111,163 @@ def main(args):
     print('No errors detected!')
   
   
+############################# FAST MODE #############################
+
+'''
+Same checks and messages as main, for large result folders:
+
+    python checker/check_solution.py checker/InputFolder checker/ResultFolder --fast [--workers N] [--no-cache]
+
+every instance is loaded once per worker process, all the routes of all the solvers of a result file are checked
+together with numpy gathers and sums over the distance matrix and the sizes, the approach folders are spread over
+a process pool, and a result file is skipped when neither its content nor its instance has changed since its last
+check without errors (content hashes in ResultFolder/.check_cache.json, with the warnings to report again).
+'''
+
+CACHE_FILE = ".check_cache.json"
+CACHE_VERSION = 1
+
+@functools.lru_cache(maxsize=None)
+def read_instance(inst_path):
+  with open(inst_path, 'rb') as file:
+    digest = content_digest(file.read())
+  return load_instance(inst_path), digest
+
+def check_results(results, inst_number, instance):
+  '''
+  errors and warnings of the solvers of one result file
+  '''
+  n_couriers, n_items, capacity, sizes, dist_matrix = instance
+  capacity, sizes, dist_matrix = np.asarray(capacity), np.asarray(sizes), np.asarray(dist_matrix)
+  errors, warnings = [], []
+  checked = []
+  for solver, result in results.items():
+    header = f'Solver {solver}, instance {inst_number}'
+    if result['time'] < 0 or result['time'] > TIMEOUT:
+      errors += [f"{header}: runtime unsound ({result['time']} sec.)"]
+    if 'sol' not in result or not result['sol'] or result['sol'] == 'N/A':
+      continue
+    items = np.array([i for path in result['sol'] for i in path])
+    if len(result['sol']) > n_couriers:
+      errors += [f"{header}: solution {result['sol']} has {len(result['sol'])} paths for {n_couriers} couriers"]
+    elif items.size and (items.dtype.kind not in 'iu' or items.min() < 1 or items.max() > n_items):
+      errors += [f"{header}: solution {result['sol']} contains items out of 1..{n_items}"]
+    else:
+      checked.append((solver, header, result))
+  if not checked:
+    return errors, warnings
+
+  # the paths of all the solvers end to end: item i is row i - 1 of the matrices, the origin row n_items
+  paths = [path for _, _, result in checked for path in result['sol']]
+  lengths = np.array([len(path) for path in paths])
+  items = np.array([i for path in paths for i in path], dtype=np.int64) - 1
+  starts = np.cumsum(lengths) - lengths
+  tails = np.insert(items, starts, n_items)
+  heads = np.insert(items, starts + lengths, n_items)
+  dist = np.bincount(np.repeat(np.arange(len(paths)), lengths + 1), weights=dist_matrix[tails, heads], minlength=len(paths))
+  path_size = np.bincount(np.repeat(np.arange(len(paths)), lengths), weights=sizes[items], minlength=len(paths))
+
+  first = 0
+  for solver, header, result in checked:
+    last = first + len(result['sol'])
+    n_collected = int(lengths[first:last].sum())
+    if n_collected != n_items:
+      errors += [f"{header}: solution {result['sol']} collects {n_collected} instead of {n_items} items"]
+    for courier_id in np.flatnonzero(path_size[first:last] > capacity[:last - first]):
+      path = [n_items+1] + result['sol'][courier_id] + [n_items+1]
+      errors += [f"{header}: path {path} of courier {courier_id} has total size {int(path_size[first + courier_id])}, exceeding its capacity {capacity[courier_id]}"]
+    max_cour = int(dist[first:last].argmax())
+    max_dist = int(dist[first + max_cour])
+    if max_dist != result['obj']:
+      max_path = [n_items+1] + result['sol'][max_cour] + [n_items+1]
+      errors += [f"{header}: objective value {result['obj']} inconsistent with max. distance {max_dist} of path {max_path}, courier {max_cour})"]
+    i = int(inst_number)
+    if i < 6:
+      if result['optimal']:
+        if result['obj'] != OPT[i]:
+          errors += [f"{header}: claimed optimal value {result['obj']} inconsistent with actual optimal value {OPT[i]})"]
+      else:
+        warnings += [f"{header}: instance {inst_number} not solved to optimality"]
+    first = last
+  return errors, warnings
+
+def check_folder(input_folder, folder, cache):
+  '''
+  (results file, content key, errors, warnings, from cache) of every result file of an approach folder
+  '''
+  checked = []
+  for results_file in sorted(os.listdir(folder)):
+    if results_file.startswith('.'):
+      continue
+    inst_number = re.search(r'\d+', results_file).group()
+    if len(inst_number) == 1:
+      inst_number = '0' + inst_number
+    instance, inst_digest = read_instance(input_folder + '/inst' + inst_number + '.dat')
+    with open(folder + '/' + results_file, 'rb') as file:
+      content = file.read()
+    key = f'{CACHE_VERSION}:{content_digest(content)}:{inst_digest}'
+    entry = cache.get(results_file)
+    if entry is not None and entry['key'] == key:
+      checked.append((results_file, key, [], entry['warnings'], True))
+      continue
+    try:
+      results = json.loads(content)
+    except json.JSONDecodeError:
+      checked.append((results_file, key, [f"Unable to parse JSON from file '{folder}/{results_file}'"], [], False))
+      continue
+    errors, warnings = check_results(results, inst_number, instance)
+    checked.append((results_file, key, errors, warnings, False))
+  return checked
+
+def main_fast(argv):
+  parser = argparse.ArgumentParser(description="check all the result files, in parallel and incrementally")
+  parser.add_argument("input_folder")
+  parser.add_argument("results_folder")
+  parser.add_argument("--fast", action="store_true")
+  parser.add_argument("--workers", type=int, default=None, help="processes checking the approach folders, default is the number of cores")
+  parser.add_argument("--no-cache", action="store_true", help="check every file again, without reading or writing the cache")
+  args = parser.parse_args(argv)
+
+  cache_path = os.path.join(args.results_folder, CACHE_FILE)
+  cache = {}
+  if not args.no_cache and os.path.exists(cache_path):
+    with open(cache_path) as file:
+      cache = json.load(file)
+  subfolders = sorted(f for f in os.listdir(args.results_folder)
+                      if not f.startswith('.') and os.path.isdir(os.path.join(args.results_folder, f)))
+
+  errors, warnings = [], []
+  with ProcessPoolExecutor(max_workers=args.workers) as pool:
+    futures = [pool.submit(check_folder, args.input_folder, os.path.join(args.results_folder, subfolder), cache.get(subfolder, {}))
+               for subfolder in subfolders]
+    for subfolder, future in zip(subfolders, futures):
+      checked = future.result()
+      cached = sum(from_cache for *_, from_cache in checked)
+      print(f'Checked {len(checked)} result files in {subfolder} ({cached} unchanged since their last clean check)')
+      cache[subfolder] = {}
+      for results_file, key, file_errors, file_warnings, _ in checked:
+        errors += file_errors
+        warnings += file_warnings
+        if not file_errors:
+          cache[subfolder][results_file] = {'key': key, 'warnings': file_warnings}
+  if not args.no_cache:
+    with open(cache_path, 'w') as file:
+      json.dump(cache, file)
+
+  print('\nCheck terminated.')
+  if warnings:
+    print('Warnings:')
+    for w in warnings:
+      print(f'\t{w}')
+  if errors:
+    print('Errors detected:')
+    for e in errors:
+      print(f'\t{e}')
+  else:
+    print('No errors detected!')
+
 if __name__ == "__main__":
-    main(sys.argv)
\ No newline at end of file
+    if "--fast" in sys.argv:
+      main_fast(sys.argv[1:])
+    else:
+      main(sys.argv)
\ No newline at end of file
@@ -1,19 +1,13 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models'))
+from instance_loader import load_instance
+
 
 def convert_dat_to_dzn(dat_file_path, dzn_file_path):
     """Convert a .dat file to a .dzn file."""
-    with open(dat_file_path, 'r') as dat_file:
-        lines = dat_file.readlines()
-
-    # Read values from the .dat file
-    m = int(lines[0])  # number of couriers
-    n = int(lines[1])  # number of items
-    l = [int(x) for x in lines[2].split()]  # maximum load of each courier
-    s = [int(x) for x in lines[3].split()]  # size of each item
-
-    # Read the distance matrix
-    D = []
-    for i in range(4, 4 + n + 1):
-        D.append([int(x) for x in lines[i].strip().split()])
+    m, n, l, s, D = load_instance(dat_file_path).as_lists()
 
     # Write to the .dzn file
     with open(dzn_file_path, 'w') as dzn_file:
@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import minizinc
+from minizinc.result import set_stat
+
+from profiling import phase
+
+'''
+Cache of the FlatZinc compilation of the MiniZinc models.
+
+Flattening a model on an instance (the O(m n^2) subtour constraints of model2/model3 on the largest instances take
+a large share of the time limit) is done once: the .fzn and its .ozn output specification are kept in the cache,
+named after the hash of everything they depend on
+
+    the model file, the instance file and the extra constraints given with them (the static lower bound)
+    the solver (id and version, its library changes the FlatZinc) and the MiniZinc version
+    the compilation flags of COMPILE_FLAGS
+
+and every later run of the same (model, instance, solver) solves the cached FlatZinc directly with the minizinc
+executable, reading its json stream. Hits and misses are printed in the log of the run, the compilation of a miss
+is timed as the flatten phase of the run and bounded by the time limit of the run, as flattening was before.
+
+The upper bounds on the objective (the incumbents of the portfolio) change at every run, they are not compiled:
+the constraint is added to a private copy of the cached FlatZinc, on the objective variable of its solve item.
+
+The cache lives in ./.fzn_cache by default, set CDMO_FZN_CACHE to move it.
+'''
+
+FZN_CACHE_DIR = os.environ.get("CDMO_FZN_CACHE", os.path.join(".", ".fzn_cache"))
+
+# the output specification is compiled for the json output read by compiled_solutions
+COMPILE_FLAGS = {"output-mode": "json", "output-objective": True}
+
+# objective variable of the solve item of a FlatZinc model
+FZN_OBJECTIVE = re.compile(r"^solve\b.*\b(?:minimize|maximize)\s+([A-Za-z_][A-Za-z0-9_]*)\s*;", re.MULTILINE)
+
+
+class FlattenTimeout(Exception):
+    pass
+
+
+def bound_constraints(lower=None, upper=None):
+    # objective bounds given to a model as extra MiniZinc constraints
+    constraints = []
+    if lower is not None:
+        constraints.append(f"constraint max_distance >= {lower};")
+    if upper is not None:
+        constraints.append(f"constraint max_distance < {upper};")
+    return "\n".join(constraints) or None
+
+
+def make_instance(model_path, instance_path, solver, extra=None):
+    model_file = Path(model_path)
+    instance_file = Path(instance_path)
+
+    with open(model_file, 'r') as f:
+        model_content = f.read()
+    with open(instance_file, 'r') as f:
+        instance_content = f.read()
+
+    # Create a MiniZinc model and load the data
+    model = minizinc.Model()
+    model.add_string(model_content)
+    model.add_string(instance_content)
+    if extra:
+        model.add_string(extra)
+
+    # Create an instance of the model for the solver
+    return minizinc.Instance(solver, model)
+
+
+@functools.lru_cache(maxsize=None)
+def minizinc_version():
+    return minizinc.default_driver.minizinc_version.strip()
+
+
+def cache_key(model_path, instance_path, solver, extra=None):
+    digest = hashlib.blake2b(digest_size=16)
+    for path in (model_path, instance_path):
+        with open(path, "rb") as f:
+            digest.update(f.read() + b"\0")
+    for text in (extra or "", solver.id, solver.version, minizinc_version(), json.dumps(COMPILE_FLAGS, sort_keys=True)):
+        digest.update(text.encode() + b"\0")
+    return digest.hexdigest()
+
+
+def compile_cached(model_path, instance_path, solver, extra=None, time_limit=None, cache_dir=FZN_CACHE_DIR):
+    '''
+    paths of the .fzn and .ozn of the model on the instance for solver, compiled on a cache miss within time_limit
+    (FlattenTimeout when it is not enough, nothing is stored then)
+    '''
+    key = cache_key(model_path, instance_path, solver, extra)
+    fzn, ozn = os.path.join(cache_dir, f"{key}.fzn"), os.path.join(cache_dir, f"{key}.ozn")
+    name = f"{os.path.basename(model_path)} on {os.path.basename(instance_path)} for {solver.id}"
+    if os.path.exists(fzn) and os.path.exists(ozn):
+        print(f"FlatZinc cache hit: {name} ({key})")
+        return fzn, ozn
+
+    start_time = time.time()
+    instance = make_instance(model_path, instance_path, solver, extra)
+    os.makedirs(cache_dir, exist_ok=True)
+    def timed_out():
+        return time_limit is not None and time.time() - start_time >= time_limit.total_seconds()
+
+    try:
+        with phase("flatten"), instance.flat(time_limit=time_limit, **COMPILE_FLAGS) as (compiled_fzn, compiled_ozn, _):
+            if timed_out():
+                raise FlattenTimeout(f"{name} not compiled within {time_limit.total_seconds():.0f} s")
+            # private copies renamed into place, so that concurrent runs never read a partial entry
+            for source, target in ((compiled_fzn.name, fzn), (compiled_ozn.name, ozn)):
+                tmp_path = f"{target}.{os.getpid()}.tmp"
+                shutil.copyfile(source, tmp_path)
+                os.replace(tmp_path, target)
+    except minizinc.error.MiniZincError:
+        if timed_out():
+            raise FlattenTimeout(f"{name} not compiled within {time_limit.total_seconds():.0f} s")
+        raise
+    print(f"FlatZinc cache miss: {name} compiled in {time.time() - start_time:.2f} s ({key})")
+    return fzn, ozn
+
+
+def fzn_objective(fzn):
+    # text of the FlatZinc fzn and the match of the objective variable of its solve item (None if not found)
+    with open(fzn) as f:
+        text = f.read()
+    return text, FZN_OBJECTIVE.search(text)
+
+
+def bounded_fzn(fzn, upper):
+    '''
+    path of a temporary copy of the FlatZinc fzn with its objective bounded by objective < upper
+    '''
+    text, found = fzn_objective(fzn)
+    bounded = text[:found.start()] + f"constraint int_lt({found.group(1)}, {int(upper)});\n" + text[found.start():]
+    handle, path = tempfile.mkstemp(prefix="bounded_", suffix=".fzn")
+    with os.fdopen(handle, "w") as f:
+        f.write(bounded)
+    return path
+
+
+async def no_solutions():
+    # the result of a run which had no time left to solve
+    yield minizinc.Result(minizinc.Status.UNKNOWN, None, {})
+
+
+async def compiled_solutions(fzn, ozn, solver, time_limit=None, processes=None, upper_bound=None):
+    '''
+    the same stream of minizinc.Result as Instance.solutions(intermediate_solutions=True), from a compiled model:
+    the solutions are namespaces with the output variables of the model and its objective. With upper_bound only
+    the solutions better than it are searched, on a bounded copy of fzn
+    '''
+    args = ["--json-stream", "--output-mode", "json", "--output-objective", "--statistics",
+            "--intermediate-solutions", "--ozn-file", ozn]
+    if time_limit is not None:
+        args += ["--time-limit", str(int(time_limit.total_seconds() * 1000))]
+    if processes is not None and "-p" in solver.stdFlags:
+        args += ["-p", str(processes)]
+
+    status, statistics = minizinc.Status.UNKNOWN, {}
+    bounded = bounded_fzn(fzn, upper_bound) if upper_bound is not None else None
+    with solver.configuration() as configuration:
+        process = await asyncio.create_subprocess_exec(
+            str(minizinc.default_driver.executable), "--solver", configuration, *args, bounded or fzn,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            async for line in process.stdout:
+                message = json.loads(line) if line.strip() else {}
+                kind = message.get("type")
+                if kind == "solution":
+                    values = dict(message["output"]["json"])
+                    values["objective"] = values.pop("_objective", None)
+                    status = minizinc.Status.SATISFIED
+                    statistics["time"] = timedelta(milliseconds=message.get("time", 0))
+                    yield minizinc.Result(status, SimpleNamespace(**values), dict(statistics))
+                elif kind == "statistics":
+                    for name, value in message["statistics"].items():
+                        set_stat(statistics, name, str(value))
+                elif kind == "status":
+                    status = minizinc.Status.from_str(message["status"])
+                elif kind == "error":
+                    raise minizinc.error.MiniZincError(message=message.get("message", str(message)))
+            await process.wait()
+        finally:
+            # a cancelled run (the portfolio stops its members) must not leave its solver running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if bounded is not None:
+                os.remove(bounded)
+    yield minizinc.Result(status, None, statistics)
+
+
+def model_solutions(model_path, instance_path, solver, extra=None, time_limit=None, processes=None, cache=True,
+                    upper_bound=None):
+    '''
+    stream of intermediate results of the model on the instance, with extra constraints independent of the run
+    (cached with the model) and an optional upper bound on the objective (never cached), through the FlatZinc cache
+    unless cache is False or the compilation fails (then MiniZinc flattens the model itself, as without the cache)
+    '''
+    if cache:
+        try:
+            start_time = time.time()
+            fzn, ozn = compile_cached(model_path, instance_path, solver, extra, time_limit)
+            if upper_bound is not None and fzn_objective(fzn)[1] is None:
+                raise OSError(f"no objective variable found in {fzn}")
+            if time_limit is not None:
+                # the time limit of MiniZinc covers flattening, so does the one of the cached run
+                time_limit = time_limit - timedelta(seconds=time.time() - start_time)
+                if time_limit.total_seconds() < 1:
+                    print("No time left to solve after flattening")
+                    return no_solutions()
+            return compiled_solutions(fzn, ozn, solver, time_limit, processes, upper_bound)
+        except FlattenTimeout as e:
+            print(f"FlatZinc cache miss: {e}")
+            return no_solutions()
+        except (minizinc.error.MiniZincError, OSError) as e:
+            print(f"FlatZinc cache not used: {e}")
+    extra = "\n".join(filter(None, [extra, bound_constraints(upper=upper_bound)]))
+    kwargs = {"time_limit": time_limit}
+    if processes is not None and "-p" in solver.stdFlags:
+        kwargs["processes"] = processes
+    return make_instance(model_path, instance_path, solver, extra).solutions(intermediate_solutions=True, **kwargs)
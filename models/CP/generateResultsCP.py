@@ -1,49 +1,96 @@
 import minizinc
 from pathlib import Path
 from datetime import timedelta
+import asyncio
 import os
+import sys
 import json
 import math
 import time 
 import re 
+import functools
+import numpy as np
 
-def solve_mcp(model_path, instance_path, time_limit=None):
-    try:
-        model_file = Path(model_path)
-        instance_file = Path(instance_path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HEUR'))
+from tracing import Trace, open_trace
+from instance_loader import load_instance
+from bounds import lower_bound
+from solutions import route_distances, validate_result
+from profiling import current, phase, solver_statistics
+from CP_flatzinc import bound_constraints, model_solutions
+from HEUR_model import solve_heuristic
+
+async def solve_traced(solutions, trace):
+    # the final result of a stream of intermediate results, every solution is recorded in the trace as it arrives
+    status = minizinc.Status.UNKNOWN
+    solution = None
+    statistics = {}
+    async for partial in solutions:
+        status = partial.status
+        statistics.update(partial.statistics)
+        if partial.solution is not None:
+            solution = partial.solution
+            trace.incumbent(getattr(solution, "objective", None), statistics.get("objectiveBound"))
+    if status == minizinc.Status.OPTIMAL_SOLUTION:
+        trace.optimal()
+    return minizinc.Result(status, solution, statistics)
 
-        # Read and print model and data files for debugging
-        with open(model_file, 'r') as f:
-            model_content = f.read()
-        #    print("Model Content:")
-        #    print(model_content)
+def decode_successors(succ, n):
+    # routes of the giant tour of the successor model: node n+i is the origin of courier i, followed by its items
+    sol = []
+    for start in range(n + 1, len(succ) + 1):
+        route = []
+        node = succ[start - 1]
+        while node <= n:
+            route.append(node)
+            node = succ[node - 1]
+        sol.append(route)
+    return sol
 
-        with open(instance_file, 'r') as f:
-            instance_content = f.read()
-        #    print("Instance Content:")
-        #    print(instance_content)
+def decode_solution(solution):
+    # objective and routes in the json format, None if the expected variables are missing
+    if hasattr(solution, "objective") and hasattr(solution, "succ") and hasattr(solution, "courier"):
+        return solution.objective, decode_successors(solution.succ, len(solution.courier))
+    if not (hasattr(solution, "objective") and hasattr(solution, "x") and hasattr(solution, "y")):
+        return None
+    tour = solution.y
 
-        # Create a MiniZinc model and load the data
-        model = minizinc.Model()
-        model.add_string(model_content)
-        model.add_string(instance_content)
+    # write sol in the correct format for the result 
+    sol = [[] for _ in range(len(tour))]
+    origin = tour[0][0]
+    for i, path in enumerate(tour):
+        for node in path:
+            if node != origin:  # Exclude origin node
+                sol[i].append(node)
+    return solution.objective, sol
 
+def solve_mcp(model_path, instance_path, time_limit=None, threads=1, trace=None, lower_bound=None):
+    try:
         # Create a MiniZinc solver instance (using Gecode)
         solver = minizinc.Solver.lookup("gecode")
 
-        # Create an instance of the model for the solver
-        instance = minizinc.Instance(solver, model)
-
         # Convert time_limit to timedelta if it's not None
         timeout = timedelta(seconds=time_limit) if time_limit is not None else None
 
-        # Solve the instance
+        # the compiled model comes from the FlatZinc cache (compiled and stored on a miss), the time of the
+        # compilation is part of the solve time as before
         start_time = time.time()
+        with phase("build"):
+            solutions = model_solutions(model_path, instance_path, solver, bound_constraints(lower=lower_bound),
+                                        time_limit=timeout, processes=threads)
+
+        # Solve the instance
         try:
             print("Starting to solve...")
-            result = instance.solve(timeout=timeout)
+            with phase("search"):
+                result = asyncio.run(solve_traced(solutions, trace or Trace()))
             print("Solve completed")
             solve_time = time.time() - start_time
+            # without the cache the wall time of the call includes flattening, in any case solver initialization
+            current().move("search", "flatten", result.statistics.get("flatTime"))
+            current().move("search", "presolve", result.statistics.get("initTime"))
+            solver_statistics("minizinc", result.statistics)
             print("Solver status:", result.status)
             print("Solver statistics:", result.statistics)
         except minizinc.error.MiniZincError as e:
@@ -65,23 +112,10 @@ def solve_mcp(model_path, instance_path, time_limit=None):
                     attr_value = getattr(solution, attr_name)
                     print(f"{attr_name}: {attr_value}")
 
-            if hasattr(solution, "objective") and hasattr(solution, "x") and hasattr(solution, "y"):
-                # read attributes from the solution
-                obj = result["objective"]
-                assignments = result["x"]
-                tour = result["y"]
-                
-                print(f'assignments: {assignments}')
-                print(f'tour: {tour}')
-                
-                # write sol in the correct format for the result 
-                sol = [[] for _ in range(len(tour))]
-                origin = tour[0][0]
-                for i, path in enumerate(tour):
-                    for node in path:
-                        if node != origin:  # Exclude origin node
-                            sol[i].append(node)
-                
+            with phase("decode"):
+                decoded = decode_solution(solution)
+            if decoded:
+                obj, sol = decoded
                 print(f'sol: {sol}')
                 
                 time_taken = math.floor(solve_time)
@@ -100,9 +134,326 @@ def solve_mcp(model_path, instance_path, time_limit=None):
         traceback.print_exc()
         return 300, False, None, None
 
+# MiniZinc backends raced by the portfolio, the ones which are not installed are skipped
+PORTFOLIO_SOLVERS = ["gecode", "chuffed", "cp-sat"]
+
+def available_solvers(tags=PORTFOLIO_SOLVERS):
+    solvers = []
+    for tag in tags:
+        try:
+            solvers.append(minizinc.Solver.lookup(tag))
+        except LookupError:
+            print(f"Solver {tag} not available, skipped")
+    return solvers
+
+async def race_portfolio(members, instance_path, time_limit, workers, trace, lower_bound=None):
+    # members run concurrently, at most `workers` at a time. Members starting late are given the best objective
+    # found so far as an upper bound, and the first member proving optimality cancels all the others
+    deadline = time.time() + time_limit
+    slots = asyncio.Semaphore(workers)
+    best = {"obj": None, "sol": None, "optimal": False, "member": None}
+
+    async def run_member(solver, model_path):
+        async with slots:
+            remaining = deadline - time.time()
+            if remaining < 1 or best["optimal"]:
+                return
+            bound = best["obj"]
+            with phase("build"):
+                # only the static lower bound is compiled (and cached), the incumbent bound is not
+                solutions = model_solutions(model_path, instance_path, solver, bound_constraints(lower=lower_bound),
+                                            time_limit=timedelta(seconds=deadline - time.time()), processes=1,
+                                            upper_bound=bound)
+            name = f"{solver.id}:{os.path.basename(model_path)}"
+            print(f"Starting {name}" + (f" with bound {bound}" if bound is not None else ""))
+            statistics = {}
+            try:
+                async for partial in solutions:
+                    statistics.update(partial.statistics)
+                    decoded = decode_solution(partial.solution) if partial.solution is not None else None
+                    if decoded and (best["obj"] is None or decoded[0] < best["obj"]):
+                        best.update(obj=decoded[0], sol=decoded[1], member=name)
+                        trace.incumbent(decoded[0])
+                        print(f"{name} improved the incumbent to {decoded[0]}")
+                    # a member bounded by the incumbent which finds nothing better proves the incumbent optimal,
+                    # as does an incumbent reaching the lower bound
+                    if partial.status == minizinc.Status.OPTIMAL_SOLUTION or \
+                            (partial.status == minizinc.Status.UNSATISFIABLE and bound is not None) or \
+                            (lower_bound is not None and best["obj"] is not None and best["obj"] <= lower_bound):
+                        best["optimal"] = True
+                        print(f"{name} proved optimality")
+                        return
+            except minizinc.error.MiniZincError as e:
+                print(f"MiniZinc Error in {name}: {e}")
+            finally:
+                # the counters of all the members are summed
+                solver_statistics("minizinc", statistics, accumulate=True)
+
+    pending = {asyncio.create_task(run_member(solver, model_path)) for solver, model_path in members}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if best["optimal"]:
+            # cancelling a task terminates its solver process
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            break
+    if best["optimal"]:
+        trace.optimal()
+    return best
+
+def solve_portfolio(model_paths, instance_path, time_limit=300, workers=None, trace=None, lower_bound=None):
+    members = [(solver, model_path) for model_path in model_paths for solver in available_solvers()]
+    workers = workers or os.cpu_count()
+    print(f"Racing {len(members)} solver/model pairs on {workers} workers")
+    start_time = time.time()
+    with phase("search"):
+        best = asyncio.run(race_portfolio(members, instance_path, time_limit, workers, trace or Trace(), lower_bound))
+    solve_time = time.time() - start_time
+    if best["sol"] is None:
+        return None
+    print(f"Best solution {best['obj']} found by {best['member']}")
+    return min(math.floor(solve_time), time_limit), best["optimal"], best["obj"], best["sol"]
+
+# LNS: the incumbent is kept here, every step fixes most of it with extra constraints on the variables of the model
+# and lets MiniZinc re-solve the rest for a short slice under the bound max_distance < incumbent
+LNS_START = 0.2 # share of the time limit given to the model alone for the first incumbent
+LNS_SLICE = 10  # seconds of every neighbourhood
+LNS_SEED = 0
+LNS_SIZES = {"longest": (2, 1.0), "cluster": (None, 2.0)} # neighbourhood -> initial size (None is n // 10), minimum
+LNS_GROW, LNS_SHRINK = 1.5, 0.75
+
+def successor_model(model_path):
+    # routes of the successor model are fixed on succ/courier, the ones of the other models on y/x
+    with open(model_path) as f:
+        return "circuit(succ)" in f.read()
+
+def model_orderings(model_path):
+    # ordering constraints of a model on its couriers: first items of equal capacity couriers (successor model),
+    # loads ordered as the capacities (all the others) and lexicographic assignments of equal capacity couriers
+    with open(model_path) as f:
+        text = f.read()
+    successor = "circuit(succ)" in text
+    return {"first_item": successor, "loads": not successor,
+            "lex": re.search(r"^\s*lex_greatereq", text, re.MULTILINE) is not None}
+
+def lex_greater(a, b):
+    # the 0/1 assignment of route a is lexicographically >= the one of route b: the smallest item in only one is in a
+    only = set(a) ^ set(b)
+    return not only or min(only) in a
+
+def ordering_violations(routes, l, s, orderings):
+    # pairs of couriers (k1 < k2) violating the ordering constraints of a model, empty for its solutions
+    load = [sum(s[j - 1] for j in route) for route in routes]
+    violations = []
+    for k1 in range(len(l)):
+        for k2 in range(k1 + 1, len(l)):
+            if orderings["loads"] and ((l[k1] <= l[k2] and load[k1] > load[k2]) or
+                                       (l[k1] > l[k2] and load[k1] < load[k2])):
+                violations.append((k1, k2))
+            elif l[k1] == l[k2] and ((orderings["first_item"] and routes[k1][0] > routes[k2][0]) or
+                                     (orderings["lex"] and not lex_greater(routes[k1], routes[k2]))):
+                violations.append((k1, k2))
+    return violations
+
+def start_routes(routes, l, s, orderings):
+    '''
+    the routes of a solution (of the heuristic) given to the couriers as the ordering constraints of the model want,
+    None if no assignment within the capacities satisfies them
+    '''
+    routes = [[int(j) for j in route] for route in routes]
+    load = lambda route: sum(s[j - 1] for j in route)
+    if orderings["loads"]:
+        # the loads must grow with the capacities (by index among equal ones): the k-th smallest load goes to the
+        # k-th smallest capacity, which is also the assignment most likely to fit, equal loads lexicographically
+        by_load = lambda a, b: (load(a) > load(b)) - (load(a) < load(b)) or (0 if a == b else -1 if lex_greater(a, b) else 1)
+        couriers = sorted(range(len(l)), key=lambda i: (l[i], i))
+        assigned = [None] * len(l)
+        for i, route in zip(couriers, sorted(routes, key=functools.cmp_to_key(by_load))):
+            assigned[i] = route
+        routes = assigned
+    elif orderings["first_item"]:
+        # equal capacity couriers ordered by their first item
+        for capacity in set(l):
+            couriers = [i for i in range(len(l)) if l[i] == capacity]
+            for i, route in zip(couriers, sorted((routes[i] for i in couriers), key=lambda route: route[0])):
+                routes[i] = route
+    if any(load(route) > l[i] for i, route in enumerate(routes)) or ordering_violations(routes, l, s, orderings):
+        return None
+    return routes
+
+def fixing_constraints(routes, fixed_couriers, fixed_items, n, successor):
+    # the whole route of every fixed courier and the courier of every fixed item, as MiniZinc constraints
+    m, o = len(routes), n + 1
+    constraints = []
+    for i in sorted(fixed_couriers):
+        route = routes[i]
+        if successor:
+            chain = [n + i + 1] + route + [n + (i + 1) % m + 1]
+            constraints.append(f"constraint [succ[a] | a in {chain[:-1]}] = {chain[1:]};")
+        else:
+            constraints.append(f"constraint [y[{i + 1},t] | t in 1..{n + 2}] = {[o] + route + [o] * (n + 1 - len(route))};")
+    for i, route in enumerate(routes):
+        items = sorted(j for j in route if j in fixed_items and i not in fixed_couriers)
+        if items:
+            constraints.append(f"constraint forall(j in {items})(courier[j] = {i + 1});" if successor else
+                               f"constraint forall(j in {items})(x[{i + 1},j] = 1);")
+    return "\n".join(constraints)
+
+def neighbourhood(kind, size, routes, D, rng):
+    # (fixed couriers, fixed items) of a neighbourhood: the longest route and some other long ones freed, or the
+    # items closest to a random one freed with all the couriers they belong to
+    m = len(routes)
+    n = sum(len(route) for route in routes)
+    items = set(range(1, n + 1))
+    if kind == "longest":
+        order = [int(i) for i in np.argsort(-route_distances(routes, D), kind="stable")]
+        k = min(m, max(1, round(size)))
+        others = order[1:min(m, 2 * k)]
+        freed = {order[0]} | set(rng.permutation(others)[:k - 1].tolist())
+        return set(range(m)) - freed, {j for i in range(m) if i not in freed for j in routes[i]}
+    centre = int(rng.integers(1, n + 1))
+    k = min(n, max(2, round(size)))
+    freed_items = {int(j) + 1 for j in np.argsort(np.asarray(D)[centre - 1, :n], kind="stable")[:k]} | {centre}
+    couriers = {i for i, route in enumerate(routes) if freed_items & set(route)}
+    return set(range(m)) - couriers, items - freed_items
+
+async def lns_slice(model_path, instance_path, solver, extra, seconds, threads):
+    # best (obj, sol) found by one short MiniZinc run and its final status, never through the FlatZinc cache:
+    # the fixing constraints change at every step
+    best, status, statistics = None, minizinc.Status.UNKNOWN, {}
+    try:
+        solutions = model_solutions(model_path, instance_path, solver, extra, time_limit=timedelta(seconds=seconds),
+                                    processes=threads, cache=False)
+        async for partial in solutions:
+            status = partial.status
+            statistics.update(partial.statistics)
+            decoded = decode_solution(partial.solution) if partial.solution is not None else None
+            if decoded and (best is None or decoded[0] < best[0]):
+                best = decoded
+    except minizinc.error.MiniZincError as e:
+        print(f"MiniZinc Error: {e}")
+    finally:
+        solver_statistics("minizinc", statistics, accumulate=True)
+    return best, status
+
+def solve_lns(model_path, instance_path, instance_data, time_limit=300, threads=1, trace=None, lower_bound=None,
+              seed=LNS_SEED):
+    m, n, l, s, D = instance_data
+    trace = trace or Trace()
+    rng = np.random.default_rng(seed)
+    successor = successor_model(model_path)
+    orderings = model_orderings(model_path)
+    solver = minizinc.Solver.lookup("gecode")
+    start_time = time.time()
+    deadline = start_time + time_limit
+
+    # first incumbent from the model alone, from the heuristic if the model finds none and its routes can be given
+    # to the couriers as the model wants, otherwise the fixed parts of the neighbourhoods could be inconsistent
+    with phase("search"):
+        best, status = asyncio.run(lns_slice(model_path, instance_path, solver, bound_constraints(lower=lower_bound),
+                                             max(1, LNS_START * time_limit), threads))
+    if best is not None and status == minizinc.Status.OPTIMAL_SOLUTION:
+        trace.incumbent(best[0])
+        trace.optimal()
+        return math.floor(time.time() - start_time), True, best[0], best[1]
+    if best is None:
+        with phase("presolve"):
+            heuristic = solve_heuristic(m, n, l, s, D, lower_bound=lower_bound or 0)
+        routes = start_routes(heuristic["sol"], l, s, orderings) if heuristic is not None and all(heuristic["sol"]) else None
+        if routes is None:
+            # no incumbent to fix, the model alone keeps the rest of the time
+            print("No LNS start: the model found no solution and the heuristic one violates its ordering constraints")
+            with phase("search"):
+                best, status = asyncio.run(lns_slice(model_path, instance_path, solver,
+                                                     bound_constraints(lower=lower_bound),
+                                                     max(1, deadline - time.time()), threads))
+            if best is None:
+                return None
+            trace.incumbent(best[0])
+            optimal = status == minizinc.Status.OPTIMAL_SOLUTION or (lower_bound is not None and best[0] <= lower_bound)
+            if optimal:
+                trace.optimal()
+            return (math.floor(time.time() - start_time) if optimal else time_limit), optimal, best[0], best[1]
+        best = heuristic["obj"], routes
+        print(f"LNS starts from the heuristic solution {best[0]}")
+    trace.incumbent(best[0])
+
+    sizes = {kind: (size if size is not None else max(2, n // 10)) for kind, (size, _) in LNS_SIZES.items()}
+    optimal = lower_bound is not None and best[0] <= lower_bound
+    step = 0
+    while not optimal and deadline - time.time() >= 1:
+        kind = list(LNS_SIZES)[step % len(LNS_SIZES)]
+        step += 1
+        fixed_couriers, fixed_items = neighbourhood(kind, sizes[kind], best[1], D, rng)
+        extra = "\n".join(filter(None, [bound_constraints(lower_bound, best[0]),
+                                        fixing_constraints(best[1], fixed_couriers, fixed_items, n, successor)]))
+        with phase("search"):
+            found, status = asyncio.run(lns_slice(model_path, instance_path, solver, extra,
+                                                  min(LNS_SLICE, deadline - time.time()), threads))
+        # an unsatisfiable neighbourhood only means that nothing is better when the incumbent, which completes its
+        # fixed part, satisfies the model: otherwise the fixing itself may be inconsistent and says nothing
+        consistent = not ordering_violations(best[1], l, s, orderings)
+        complete = status == minizinc.Status.OPTIMAL_SOLUTION or (status == minizinc.Status.UNSATISFIABLE and consistent)
+        if found is not None and found[0] < best[0]:
+            best = found
+            trace.incumbent(best[0])
+        elif complete:
+            # nothing better in the whole neighbourhood: with nothing fixed the incumbent is optimal
+            optimal = not fixed_couriers and not fixed_items
+        # neighbourhoods searched completely grow, the ones the slice could not finish shrink, the inconclusive
+        # ones keep their size
+        minimum = LNS_SIZES[kind][1]
+        if complete:
+            sizes[kind] *= LNS_GROW
+        elif status != minizinc.Status.UNSATISFIABLE:
+            sizes[kind] = max(minimum, sizes[kind] * LNS_SHRINK)
+        print(f"LNS step {step}: {kind} freeing {m - len(fixed_couriers)} couriers and {n - len(fixed_items)} items, "
+              f"{status}, incumbent {best[0]}")
+        optimal = optimal or (lower_bound is not None and best[0] <= lower_bound)
+    if optimal:
+        trace.optimal()
+    solve_time = math.floor(time.time() - start_time) if optimal else time_limit
+    return solve_time, optimal, best[0], best[1]
+
+def solve_instance(approach, instance_path, time_limit=300, threads=1, trace=None):
+    # run a single approach on a single instance and build its json entry, for the portfolio threads is the
+    # number of solver/model pairs running at the same time
+    trace = trace or Trace()
+    with phase("parse"):
+        m, n, l, s, D = load_instance(instance_path)
+    with phase("presolve"):
+        bound = lower_bound(m, n, l, s, D)
+    trace.bound(bound)
+    if isinstance(approaches[approach], dict):
+        result = solve_lns(approaches[approach]["lns"], instance_path, (m, n, l, s, D), time_limit=time_limit,
+                           threads=threads, trace=trace, lower_bound=bound)
+    elif isinstance(approaches[approach], list):
+        result = solve_portfolio(approaches[approach], instance_path, time_limit=time_limit, workers=threads, trace=trace,
+                                 lower_bound=bound)
+    else:
+        result = solve_mcp(approaches[approach], instance_path, time_limit=time_limit, threads=threads, trace=trace,
+                           lower_bound=bound)
+    if result: # solution found 
+        time_taken, optimal, obj, sol = result
+        with phase("decode"):
+            return validate_result({
+                "time": time_taken,
+                "optimal": optimal,
+                "obj": obj,
+                "sol": sol
+            }, l, s, D)
+    # no solution found 
+    return {
+        "time": time_limit,
+        "optimal": False,
+        "obj": None,
+        "sol": None
+    }
+
 def run_mcp_solver(input_folder, output_folder, approaches):
     # be sure that the output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(os.path.join(output_folder, "CP"), exist_ok=True)
     
     # loop over the files in the input folder
     for instance_file in sorted(os.listdir(input_folder)):
@@ -114,28 +465,14 @@ def run_mcp_solver(input_folder, output_folder, approaches):
         instance_path = os.path.join(input_folder, instance_file)
         results = {}
         
-        for approach, model_path in approaches.items():
+        for approach in approaches:
             print('-' * 50)
             print(f"run {approach} on instance {instance_num}")
             print('-' * 50)
-            result = solve_mcp(model_path, instance_path, time_limit=300)
-            
-            # build json files 
-            if result: # solution found 
-                time_taken, optimal, obj, sol = result
-                results[approach] = {
-                    "time": time_taken,
-                    "optimal": optimal,
-                    "obj": obj,
-                    "sol": sol
-                }
-            else: # no solution found 
-                results[approach] = {
-                    "time": 300,
-                    "optimal": False,
-                    "obj": None,
-                    "sol": None
-                }
+            trace = open_trace("CP", f"{int(instance_num):02d}", approach)
+            threads = os.cpu_count() if isinstance(approaches[approach], list) else 1
+            results[approach] = solve_instance(approach, instance_path, time_limit=300, threads=threads, trace=trace)
+            trace.close()
         
         # complete outpute file for each instance
         file_path = os.path.join(output_folder, "CP")
@@ -148,10 +485,19 @@ approaches = {
     "sym": r"./models/CP/CP_models/model1.mzn", # with simmetry breacking
     "sym_subtour_elim": r"./models/CP/CP_models/model2.mzn", # simmetry breacking + subtour elimination
     "sym_subtour_elim_heur": r"./models/CP/CP_models/model3.mzn", # simmetry breacking + subtour elimination + search heuristic
+    "successor": r"./models/CP/CP_models/model4.mzn", # successors with circuit + bin packing + element distances
 }
+# race of every available backend on every model above, stops as soon as one of them proves optimality
+approaches["portfolio"] = list(approaches.values())
+# variants whose threads are the solver/model pairs raced at the same time (run_all gives them their own width)
+portfolio_variants = ["portfolio"]
+# LNS around a model: {"lns": model}
+approaches["lns_sym_subtour_elim_heur"] = {"lns": approaches["sym_subtour_elim_heur"]}
+approaches["lns_successor"] = {"lns": approaches["successor"]}
 
 input_folder = r"./models/CP/InstancesDZN"
 output_folder = r"./res"
 
-# generate results 
-run_mcp_solver(input_folder, output_folder, approaches)
\ No newline at end of file
+if __name__ == "__main__":
+    # generate results 
+    run_mcp_solver(input_folder, output_folder, approaches)
@@ -0,0 +1,292 @@
+import time
+from typing import List, Optional
+
+import numpy as np
+
+'''
+Primal heuristic for the MCP: regret insertion construction followed by a local search which works on the
+courier with the longest route, the only one which determines the objective.
+
+Routes are lists of 0-based items, the depot is node n and is implicit at both ends of every route.
+All the move evaluations are vectorized with numpy over every position/item pair of the routes involved.
+
+    construction    regret-2 insertion: at every step the item with the largest difference between its best and
+                    second best insertion (measured as the length of the resulting route) is inserted in its
+                    best courier/position, among those with enough residual capacity
+    intra route     2-opt (segment reversal, exact for asymmetric D) and Or-opt (move a segment of 1-3 items)
+    inter route     relocate an item of the longest route into another route, or swap it with an item of
+                    another route, whenever the longer of the two resulting routes is shorter than the current max
+    ils             optional ruin and recreate perturbations of the local optimum, accepted when they improve it
+'''
+
+INF = np.iinfo(np.int64).max // 4
+
+
+def nodes_of(route: List[int], depot: int) -> np.ndarray:
+    return np.array([depot] + route + [depot], dtype=np.int64)
+
+
+def route_length(D: np.ndarray, route: List[int], depot: int) -> int:
+    nodes = nodes_of(route, depot)
+    return int(D[nodes[:-1], nodes[1:]].sum())
+
+
+def insertion_costs(D: np.ndarray, route: List[int], depot: int, items: np.ndarray):
+    '''
+    cheapest insertion of every item in the route: (delta, position in the route) of each item
+    '''
+    nodes = nodes_of(route, depot)
+    a, b = nodes[:-1], nodes[1:]
+    delta = D[np.ix_(a, items)] + D[np.ix_(items, b)].T - D[a, b][:, None]
+    position = delta.argmin(axis=0)
+    return delta[position, np.arange(len(items))], position
+
+
+############################# CONSTRUCTION #############################
+
+def regret_insertion(D, l, s, depot, routes=None, items=None):
+    '''
+    insert `items` (all of them by default) into `routes` (empty by default), None if some item does not fit
+    '''
+    m, n = len(l), len(s)
+    routes = [list(r) for r in routes] if routes is not None else [[] for _ in range(m)]
+    items = np.arange(n) if items is None else np.asarray(items, dtype=np.int64)
+    loads = np.array([s[r].sum() if r else 0 for r in routes], dtype=np.int64)
+    lengths = np.array([route_length(D, r, depot) for r in routes], dtype=np.int64)
+
+    cost = np.empty((m, len(items)), dtype=np.int64) # length of route k after the insertion of each item
+    position = np.empty((m, len(items)), dtype=np.int64)
+
+    def update(k):
+        delta, position[k] = insertion_costs(D, routes[k], depot, items)
+        cost[k] = np.where(loads[k] + s[items] <= l[k], lengths[k] + delta, INF)
+
+    for k in range(m):
+        update(k)
+    open_items = np.ones(len(items), dtype=bool)
+    for _ in range(len(items)):
+        candidates = np.flatnonzero(open_items)
+        c = cost[:, candidates]
+        if m > 1:
+            two_best = np.partition(c, 1, axis=0)[:2]
+        else:
+            two_best = np.vstack([c[0], np.full(len(candidates), INF)])
+        if (two_best[0] >= INF).any():
+            return None
+        regret = two_best[1] - two_best[0]
+        # largest regret first, ties broken by the most expensive item
+        chosen = candidates[np.lexsort((-two_best[0], -regret))[0]]
+        k = int(cost[:, chosen].argmin())
+        routes[k].insert(int(position[k, chosen]), int(items[chosen]))
+        loads[k] += s[items[chosen]]
+        lengths[k] = cost[k, chosen]
+        open_items[chosen] = False
+        update(k)
+    return routes
+
+
+def first_fit_decreasing(D, l, s, depot):
+    '''
+    fallback construction for tight capacities: bin packing of the items, then nearest neighbour order in every route
+    '''
+    m = len(l)
+    routes = [[] for _ in range(m)]
+    residual = np.array(l, dtype=np.int64)
+    couriers = np.argsort(-residual, kind="stable")
+    for item in np.argsort(-s, kind="stable"):
+        fitting = [k for k in couriers if residual[k] >= s[item]]
+        if not fitting:
+            return None
+        routes[fitting[0]].append(int(item))
+        residual[fitting[0]] -= s[item]
+    for k in range(m):
+        remaining, ordered, current = list(routes[k]), [], depot
+        while remaining:
+            current = min(remaining, key=lambda j: D[current, j])
+            remaining.remove(current)
+            ordered.append(current)
+        routes[k] = ordered
+    return routes
+
+
+############################# INTRA ROUTE #############################
+
+def two_opt(D, route, depot):
+    nodes = nodes_of(route, depot)
+    improved = False
+    while len(nodes) >= 4:
+        forward = D[nodes[:-1], nodes[1:]]
+        backward = D[nodes[1:], nodes[:-1]]
+        cum_f = np.concatenate([[0], np.cumsum(forward)])
+        cum_b = np.concatenate([[0], np.cumsum(backward)])
+        i = np.arange(len(nodes) - 1)[:, None]
+        j = np.arange(len(nodes) - 1)[None, :]
+        # reverse nodes[i+1..j]: edges (i, i+1) and (j, j+1) are replaced and the inner edges change direction
+        delta = (D[nodes[i], nodes[j]] + D[nodes[i + 1], nodes[j + 1]] + (cum_b[j] - cum_b[i + 1])
+                 - forward[i] - forward[j] - (cum_f[j] - cum_f[i + 1]))
+        delta = np.where(j >= i + 2, delta, 0)
+        best = np.unravel_index(delta.argmin(), delta.shape)
+        if delta[best] >= 0:
+            break
+        a, b = best
+        nodes[a + 1:b + 1] = nodes[a + 1:b + 1][::-1].copy()
+        improved = True
+    return nodes[1:-1].tolist(), improved
+
+
+def or_opt(D, route, depot, max_segment=3):
+    nodes = nodes_of(route, depot)
+    improved = False
+    while True:
+        best_delta, best_move = 0, None
+        edges_from, edges_to = nodes[:-1], nodes[1:]
+        insert_base = D[edges_from, edges_to]
+        for length in range(1, min(max_segment, len(nodes) - 2) + 1):
+            for start in range(1, len(nodes) - length):
+                end = start + length - 1
+                prev, nxt = nodes[start - 1], nodes[end + 1]
+                gain = D[prev, nodes[start]] + D[nodes[end], nxt] - D[prev, nxt]
+                # insert between edges_from[t] and edges_to[t], excluding the edges touching the segment
+                insert = D[edges_from, nodes[start]] + D[nodes[end], edges_to] - insert_base
+                t = np.arange(len(insert))
+                insert = np.where((t < start - 1) | (t > end), insert, INF)
+                position = int(insert.argmin())
+                delta = insert[position] - gain
+                if delta < best_delta:
+                    best_delta, best_move = delta, (start, end, position)
+        if best_move is None:
+            break
+        start, end, position = best_move
+        segment = nodes[start:end + 1]
+        rest = np.concatenate([nodes[:start], nodes[end + 1:]])
+        at = position + 1 if position < start else position + 1 - len(segment)
+        nodes = np.concatenate([rest[:at], segment, rest[at:]])
+        improved = True
+    return nodes[1:-1].tolist(), improved
+
+
+def optimize_route(D, route, depot):
+    while True:
+        route, improved_2opt = two_opt(D, route, depot)
+        route, improved_oropt = or_opt(D, route, depot)
+        if not (improved_2opt or improved_oropt):
+            return route
+
+
+############################# INTER ROUTE #############################
+
+def best_inter_move(D, l, s, depot, routes, lengths, loads):
+    '''
+    best relocate or swap involving the longest route: (max length after the move, move) or None
+    '''
+    k_max = int(lengths.argmax())
+    if not routes[k_max]:
+        return None
+    nodes = nodes_of(routes[k_max], depot)
+    items, prev, nxt = nodes[1:-1], nodes[:-2], nodes[2:]
+    removal = D[prev, items] + D[items, nxt] - D[prev, nxt]
+    best = (lengths[k_max], None)
+    for k in range(len(routes)):
+        if k == k_max:
+            continue
+        # relocate an item of k_max into k
+        delta, position = insertion_costs(D, routes[k], depot, items)
+        value = np.maximum(lengths[k_max] - removal, lengths[k] + delta)
+        value = np.where(loads[k] + s[items] <= l[k], value, INF)
+        i = int(value.argmin())
+        if value[i] < best[0]:
+            best = (value[i], ("relocate", k_max, i, k, int(position[i])))
+
+        # swap an item of k_max with an item of k, each taking the place of the other
+        if not routes[k]:
+            continue
+        other = nodes_of(routes[k], depot)
+        items_k, prev_k, nxt_k = other[1:-1], other[:-2], other[2:]
+        new_max = (lengths[k_max] + D[np.ix_(prev, items_k)] + D[np.ix_(items_k, nxt)].T
+                   - (D[prev, items] + D[items, nxt])[:, None])
+        new_k = (lengths[k] + D[np.ix_(prev_k, items)].T + D[np.ix_(items, nxt_k)]
+                 - (D[prev_k, items_k] + D[items_k, nxt_k])[None, :])
+        fits = ((loads[k_max] - s[items][:, None] + s[items_k][None, :] <= l[k_max]) &
+                (loads[k] - s[items_k][None, :] + s[items][:, None] <= l[k]))
+        value = np.where(fits, np.maximum(new_max, new_k), INF)
+        i, j = np.unravel_index(value.argmin(), value.shape)
+        if value[i, j] < best[0]:
+            best = (value[i, j], ("swap", k_max, int(i), k, int(j)))
+    return best if best[1] is not None else None
+
+
+def apply_move(routes, move):
+    kind, k_max, i, k, j = move
+    if kind == "relocate":
+        item = routes[k_max].pop(i)
+        routes[k].insert(j, item)
+    else:
+        routes[k_max][i], routes[k][j] = routes[k][j], routes[k_max][i]
+    return k_max, k
+
+
+def local_search(D, l, s, depot, routes, deadline=None):
+    routes = [optimize_route(D, r, depot) for r in routes]
+    lengths = np.array([route_length(D, r, depot) for r in routes], dtype=np.int64)
+    loads = np.array([s[r].sum() if r else 0 for r in routes], dtype=np.int64)
+    while deadline is None or time.time() < deadline:
+        move = best_inter_move(D, l, s, depot, routes, lengths, loads)
+        if move is None:
+            break
+        for k in apply_move(routes, move[1]):
+            routes[k] = optimize_route(D, routes[k], depot)
+            lengths[k] = route_length(D, routes[k], depot)
+            loads[k] = s[routes[k]].sum() if routes[k] else 0
+    return routes, int(lengths.max())
+
+
+############################# DRIVER #############################
+
+def ruin_and_recreate(D, l, s, depot, routes, rng, fraction=0.15):
+    '''
+    remove a random subset of items, half of them from the longest route, and reinsert them by regret
+    '''
+    lengths = [route_length(D, r, depot) for r in routes]
+    n = len(s)
+    k_max = int(np.argmax(lengths))
+    n_remove = max(2, int(fraction * n))
+    from_max = rng.permutation(routes[k_max])[:n_remove // 2].tolist()
+    others = [i for r in routes for i in r if i not in from_max]
+    removed = set(from_max) | set(rng.permutation(others)[:n_remove - len(from_max)].tolist())
+    partial = [[i for i in r if i not in removed] for r in routes]
+    return regret_insertion(D, l, s, depot, partial, sorted(removed))
+
+
+def solve_heuristic(m: int, n: int, l, s, D, ils_time: float = 0, seed: int = 0, lower_bound: int = 0,
+                    trace=None) -> Optional[dict]:
+    '''
+    returns {"obj", "sol"} with 1-based items per courier, None if no capacity feasible solution has been found.
+    The search stops as soon as the objective reaches lower_bound.
+    '''
+    D = np.asarray(D, dtype=np.int64)
+    l = np.asarray(l, dtype=np.int64)
+    s = np.asarray(s, dtype=np.int64)
+    depot = n
+
+    routes = regret_insertion(D, l, s, depot)
+    if routes is None:
+        routes = first_fit_decreasing(D, l, s, depot)
+    if routes is None:
+        return None
+    best_routes, best_obj = local_search(D, l, s, depot, routes)
+    if trace is not None:
+        trace.incumbent(best_obj)
+
+    rng = np.random.default_rng(seed)
+    deadline = time.time() + ils_time
+    while time.time() < deadline and best_obj > lower_bound:
+        candidate = ruin_and_recreate(D, l, s, depot, best_routes, rng)
+        if candidate is None:
+            continue
+        candidate, obj = local_search(D, l, s, depot, candidate, deadline)
+        if obj < best_obj:
+            best_routes, best_obj = candidate, obj
+            if trace is not None:
+                trace.incumbent(best_obj)
+
+    return {"obj": best_obj, "sol": [[i + 1 for i in r] for r in best_routes]}
@@ -0,0 +1,69 @@
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instance_loader import load_instance, instance_number
+from tracing import Trace, open_trace
+from bounds import lower_bound
+from HEUR_model import solve_heuristic
+from solutions import validate_result
+from profiling import phase
+
+def solve_instance(approach_name, instance_path, time_limit=300, threads=1, trace=None):
+    # run a single approach on a single instance and build its json entry (the heuristic is single threaded)
+    with phase("parse"):
+        m, n, l, s, D = load_instance(instance_path)
+    config = approaches[approach_name]
+    trace = trace or Trace()
+    start_time = time.time()
+    with phase("presolve"):
+        bound = lower_bound(m, n, l, s, D)
+    trace.bound(bound)
+    with phase("search"):
+        result = solve_heuristic(m, n, l, s, D, ils_time=min(config['ils_time'], time_limit), seed=config['seed'],
+                                 lower_bound=bound, trace=trace)
+    elapsed_time = time.time() - start_time
+    if result is None:
+        return {"time": time_limit, "optimal": False, "obj": None, "sol": None}
+    # the heuristic can only prove optimality by reaching the lower bound
+    optimal = result["obj"] <= bound
+    with phase("decode"):
+        return validate_result({"time": min(math.floor(elapsed_time), time_limit), "optimal": optimal,
+                                "obj": result["obj"], "sol": result["sol"]}, l, s, D)
+
+def main(input_folder: str, output_folder: str, approaches: dict, folder = "HEUR"):
+    output_approach_folder = os.path.join(output_folder, folder)
+    os.makedirs(output_approach_folder, exist_ok=True)
+
+    for file_name in sorted(os.listdir(input_folder)):
+        if file_name.endswith(".dat"):
+            file_path = os.path.join(input_folder, file_name)
+            number = instance_number(file_name)
+
+            results = {}
+            for approach_name in approaches:
+                trace = open_trace(folder, number, approach_name)
+                results[approach_name] = solve_instance(approach_name, file_path, trace=trace)
+                trace.close()
+
+            output_file_path = os.path.join(output_approach_folder, f"{number}.json")
+            with open(output_file_path, 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            print(f"Results saved to {output_file_path}")
+
+# Set input and output folders
+input_folder = r"./Instances"
+output_folder = r"./res"
+
+# set parameters for the heuristic: seconds of iterated local search after the first local optimum
+approaches = {
+    "regret_ls": {'ils_time': 0, 'seed': 0},
+    "regret_ils": {'ils_time': 10, 'seed': 0},
+}
+
+if __name__ == "__main__":
+    # Run the main function
+    main(input_folder, output_folder, approaches=approaches, folder = "HEUR")
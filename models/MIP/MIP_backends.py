@@ -0,0 +1,339 @@
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from solutions import check_solution, route_distances, routes_from_arcs
+from profiling import phase, solver_statistics
+
+'''
+Solver independent form of the MIP model of MIP_model.create_model: the variables are columns (x, y, u,
+max_distance in this order) with their bounds and integrality, the constraints groups of rows of sparse matrices,
+and every backend turns them into its own model:
+
+    gurobi      MVars and one addMConstr per group (MIP_model.create_model_matrix), needs a Gurobi license
+    highs       one HighsLp passed to highspy, license free
+    cbc         free MPS file solved by the cbc executable on PATH (or the one bundled with PuLP), license free
+
+Only gurobi supports the lazy subtour elimination, which needs a solver callback adding constraints.
+'''
+
+LESS_EQUAL, EQUAL, GREATER_EQUAL = "<", "=", ">" # the Gurobi sense characters
+
+
+class Formulation(NamedTuple):
+    m: int
+    n: int
+    X: np.ndarray           # column of x[i,j,k], shape (n+1, n+1, m), node 0 is the depot
+    Y: np.ndarray           # column of y[i,k], shape (n+1, m)
+    U: np.ndarray           # column of u[i,k] of the customer i+1, shape (n, m) or (0, m) without MTZ
+    Z: int                  # column of max_distance, the objective
+    lower: np.ndarray       # column bounds
+    upper: np.ndarray
+    integer: np.ndarray     # column integrality
+    blocks: List[tuple]     # groups of rows (A, sense, rhs)
+
+    @property
+    def num_cols(self):
+        return self.Z + 1
+
+    def matrix(self):
+        # all the rows as one csr matrix with their lower and upper bounds
+        A = sp.vstack([block[0] for block in self.blocks], format="csr")
+        rhs = np.concatenate([block[2] for block in self.blocks])
+        sense = np.concatenate([np.full(len(block[2]), block[1]) for block in self.blocks])
+        row_lower = np.where(sense == LESS_EQUAL, -np.inf, rhs)
+        row_upper = np.where(sense == GREATER_EQUAL, np.inf, rhs)
+        return A, row_lower, row_upper
+
+
+def build_formulation(instance_data, lower_bound=0, subtour_elimination="mtz") -> Formulation:
+    m, n, l, si, D = instance_data
+    N = n + 1 # node 0 is the depot, nodes 1..n the customers
+    order = np.r_[n, np.arange(n)] # node i is row/column order[i] of D
+    dist = np.asarray(D, dtype=np.float64)[np.ix_(order, order)]
+    si = np.asarray(si, dtype=np.float64)
+
+    # column of every variable in the model
+    X = np.arange(N * N * m, dtype=np.int32).reshape(N, N, m)
+    Y = X.size + np.arange(N * m, dtype=np.int32).reshape(N, m)
+    U = X.size + Y.size + np.arange(n * m if subtour_elimination == "mtz" else 0, dtype=np.int32).reshape(-1, m)
+    Z = X.size + Y.size + U.size
+    lower = np.zeros(Z + 1)
+    lower[Z] = lower_bound # a valid bound lets the solver close the gap early
+    upper = np.full(Z + 1, np.inf)
+    upper[:X.size + Y.size] = 1
+    integer = np.zeros(Z + 1, dtype=bool)
+    integer[:X.size + Y.size] = True
+
+    I, J, K = np.indices((N, N, m), dtype=np.int32)
+    customer_k = np.indices((n, m), dtype=np.int32) # (customer - 1, k)
+    blocks = []
+
+    def add_rows(r, c, v, sense, b):
+        # one group of rows: r numbers them from 0, c and v are the columns and coefficients of their terms,
+        # b holds their right hand sides
+        b = np.atleast_1d(np.asarray(b, dtype=np.float64))
+        v = np.broadcast_to(np.asarray(v, dtype=np.float64), np.shape(c)).ravel()
+        A = sp.csr_matrix((v, (np.ravel(r), np.ravel(c))), shape=(len(b), Z + 1))
+        A.eliminate_zeros() # the self loop x[i,i,k] enters and leaves the flow rows with opposite signs
+        blocks.append((A, sense, b))
+
+    # route length of every courier <= max_distance
+    add_rows(np.r_[K.ravel(), np.arange(m)], np.r_[X.ravel(), np.full(m, Z)], np.r_[dist[I, J].ravel(), -np.ones(m)],
+             LESS_EQUAL, np.zeros(m))
+    # every customer is assigned to one courier, left once and entered once
+    add_rows(customer_k[0], Y[1:], 1, EQUAL, np.ones(n))
+    add_rows(I[1:] - 1, X[1:], 1, EQUAL, np.ones(n))
+    add_rows(J[:, 1:] - 1, X[:, 1:], 1, EQUAL, np.ones(n))
+    # every courier leaves the depot
+    add_rows(np.zeros(m, dtype=int), Y[0], 1, EQUAL, m)
+    # capacity, no self loops, every courier goes back to the depot once
+    add_rows(np.broadcast_to(np.arange(m), (n, m)), Y[1:], si[:, None], LESS_EQUAL, l)
+    add_rows(np.broadcast_to(np.arange(m), (N, m)), X[np.arange(N), np.arange(N)], 1, EQUAL, np.zeros(m))
+    add_rows(np.broadcast_to(np.arange(m), (N, m)), X[:, 0], 1, EQUAL, np.ones(m))
+    # flow conservation at the customers and link to the assignment, one row per (customer, courier)
+    flow_row = np.arange(n * m).reshape(n, m)
+    add_rows(np.r_[np.broadcast_to(flow_row[:, None, :], (n, N, m)).ravel(), np.broadcast_to(flow_row[None], (N, n, m)).ravel()],
+             np.r_[X[1:].ravel(), X[:, 1:].ravel()], np.r_[np.ones(n * N * m), -np.ones(N * n * m)], EQUAL, np.zeros(n * m))
+    add_rows(np.r_[np.broadcast_to(flow_row[None], (N, n, m)).ravel(), flow_row.ravel()],
+             np.r_[X[:, 1:].ravel(), Y[1:].ravel()], np.r_[np.ones(N * n * m), -np.ones(n * m)], EQUAL, np.zeros(n * m))
+    # MTZ subtour elimination: u[i,k] - u[j,k] + n x[i,j,k] <= n - 1 for all the customers i != j
+    if subtour_elimination == "mtz":
+        i, j, k = np.nonzero(np.broadcast_to(~np.eye(n, dtype=bool)[:, :, None], (n, n, m)))
+        mtz_row = np.arange(len(i))
+        add_rows(np.r_[mtz_row, mtz_row, mtz_row], np.r_[U[i, k], U[j, k], X[i + 1, j + 1, k]],
+                 np.r_[np.ones(len(i)), -np.ones(len(i)), np.full(len(i), n)], LESS_EQUAL, np.full(len(i), n - 1))
+
+    return Formulation(m, n, X, Y, U, Z, lower, upper, integer, blocks)
+
+
+def routes_from_x(x) -> Optional[List[List[int]]]:
+    # 1-based items of every courier from the values of x[i,j,k], None if they are not routes. Node 0 of the
+    # model is the depot, node n of D and of solutions.routes_from_arcs
+    arcs = np.asarray(x).transpose(2, 0, 1) > 0.5
+    return routes_from_arcs(np.roll(arcs, -1, axis=(1, 2)))
+
+def routes_from_values(formulation: Formulation, values) -> Optional[List[List[int]]]:
+    return routes_from_x(np.asarray(values)[formulation.X])
+
+############################# WARM START #############################
+
+def routes_objective(instance_data, routes) -> Optional[int]:
+    # max route length of a solution given as 1-based items per courier, None if it is not feasible
+    m, n, l, si, D = instance_data
+    if check_solution(routes, l, si, D):
+        return None
+    return int(route_distances(routes, D).max())
+
+def start_values(formulation: Formulation, routes, obj) -> Optional[np.ndarray]:
+    # column values of a feasible solution: arcs and assignments of every route, u the position in the route.
+    # None if a courier stays at the depot, which the model does not allow
+    if not all(routes):
+        return None
+    values = np.zeros(formulation.num_cols)
+    for k, route in enumerate(routes):
+        nodes = [0] + route + [0]
+        values[formulation.X[nodes[:-1], nodes[1:], k]] = 1
+        values[formulation.Y[nodes[:-1], k]] = 1
+        if formulation.U.size:
+            values[formulation.U[np.array(route, dtype=int) - 1, k]] = np.arange(1, len(route) + 1)
+    values[formulation.Z] = obj
+    return values
+
+
+class Result(NamedTuple):
+    status: str             # optimal, infeasible, cutoff (none better than the cutoff), time_limit, unknown
+    obj: float              # None without a solution
+    bound: float            # best lower bound, None if unknown
+    values: np.ndarray      # column values of the best solution, None without a solution
+
+    @property
+    def gap(self):
+        if self.obj is None or self.bound is None:
+            return None
+        return abs(self.obj - self.bound) / max(abs(self.obj), 1e-10)
+
+############################# HiGHS #############################
+
+# fields of the HighsInfo of a run reported in its profile
+HIGHS_STATISTICS = ["mip_node_count", "simplex_iteration_count", "mip_gap", "mip_dual_bound"]
+
+def solve_highs(formulation: Formulation, time_limit=300, threads=1, trace=None, start=None, cutoff=None) -> Result:
+    # start: column values of a feasible solution, cutoff: only solutions with a smaller objective are searched
+    import highspy
+
+    with phase("flatten"):
+        A, row_lower, row_upper = formulation.matrix()
+        A = A.tocsc()
+        lp = highspy.HighsLp()
+        lp.num_col_ = formulation.num_cols
+        lp.num_row_ = A.shape[0]
+        lp.col_cost_ = np.eye(1, formulation.num_cols, formulation.Z).ravel()
+        lp.col_lower_ = formulation.lower
+        lp.col_upper_ = formulation.upper
+        lp.row_lower_ = row_lower
+        lp.row_upper_ = row_upper
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = A.indptr
+        lp.a_matrix_.index_ = A.indices
+        lp.a_matrix_.value_ = A.data
+        lp.integrality_ = np.where(formulation.integer, highspy.HighsVarType.kInteger, highspy.HighsVarType.kContinuous).tolist()
+
+        h = highspy.Highs()
+        h.setOptionValue("output_flag", False)
+        h.setOptionValue("time_limit", float(time_limit))
+        h.setOptionValue("threads", int(threads) if threads else 0)
+        h.passModel(lp)
+        if cutoff is not None:
+            h.setOptionValue("objective_bound", float(cutoff))
+        if start is not None:
+            solution = highspy.HighsSolution()
+            solution.col_value = start.tolist()
+            solution.value_valid = True
+            h.setSolution(solution)
+    if trace is not None:
+        def on_solution(event):
+            bound = event.data_out.mip_dual_bound
+            trace.incumbent(event.data_out.objective_function_value, bound if math.isfinite(bound) else None)
+        h.cbMipImprovingSolution.subscribe(on_solution)
+    with phase("search"):
+        h.run()
+
+    status = h.getModelStatus()
+    info = h.getInfo()
+    solver_statistics("highs", {name: getattr(info, name) for name in HIGHS_STATISTICS})
+    has_solution = info.primal_solution_status == 2 # kSolutionStatusFeasible
+    values = np.array(h.getSolution().col_value) if has_solution else None
+    bound = info.mip_dual_bound if math.isfinite(info.mip_dual_bound) else None
+    name = {highspy.HighsModelStatus.kOptimal: "optimal", highspy.HighsModelStatus.kInfeasible: "infeasible",
+            highspy.HighsModelStatus.kObjectiveBound: "cutoff",
+            highspy.HighsModelStatus.kTimeLimit: "time_limit"}.get(status, "unknown")
+    return Result(name, info.objective_function_value if has_solution else None, bound, values)
+
+############################# CBC #############################
+
+def cbc_executable():
+    # the cbc on PATH, else the one bundled with PuLP (not for every platform), None if there is neither
+    path = shutil.which("cbc")
+    if path is None:
+        try:
+            import pulp
+            path = pulp.apis.PULP_CBC_CMD().path
+        except ImportError:
+            return None
+    return path if path and os.path.exists(path) else None
+
+def mps_line(code="", name1="", name2="", value=""):
+    # fixed MPS fields: code in columns 2-3, names in 5-12 and 15-22, value in 25-36
+    return f" {code:<2} {name1:<8}  {name2:<8}  {value}".rstrip() + "\n"
+
+def write_mps(formulation: Formulation, path: str):
+    # fixed MPS: rows R<i>, columns C<j>, integer columns between MARKER lines and bounded explicitly
+    A, row_lower, row_upper = formulation.matrix()
+    sense = np.where(np.isinf(row_lower), "L", np.where(np.isinf(row_upper), "G", "E"))
+    rhs = np.where(np.isinf(row_lower), row_upper, row_lower)
+    A = A.tocsc()
+    Z = formulation.Z
+    with open(path, "w") as f:
+        f.write("NAME          VRP\nROWS\n" + mps_line("N", "OBJ"))
+        f.write("".join(mps_line(s, f"R{i}") for i, s in enumerate(sense)))
+        f.write("COLUMNS\n")
+        marker = False
+        for j in range(formulation.num_cols):
+            if formulation.integer[j] != marker:
+                marker = formulation.integer[j]
+                f.write(mps_line("", "MARKER", "'MARKER'", "'INTORG'" if marker else "'INTEND'"))
+            start, end = A.indptr[j], A.indptr[j + 1]
+            lines = [mps_line("", f"C{j}", f"R{i}", f"{v:.12g}") for i, v in zip(A.indices[start:end], A.data[start:end])]
+            if j == Z:
+                lines.append(mps_line("", f"C{j}", "OBJ", "1"))
+            f.write("".join(lines) if lines else mps_line("", f"C{j}", "OBJ", "0"))
+        if marker:
+            f.write(mps_line("", "MARKER", "'MARKER'", "'INTEND'"))
+        f.write("RHS\n")
+        f.write("".join(mps_line("", "RHS", f"R{i}", f"{b:.12g}") for i, b in enumerate(rhs) if b != 0))
+        f.write("BOUNDS\n")
+        for j in range(formulation.num_cols):
+            if formulation.integer[j] and formulation.upper[j] == 1 and formulation.lower[j] == 0:
+                f.write(mps_line("BV", "BND", f"C{j}"))
+                continue
+            if formulation.lower[j] != 0:
+                f.write(mps_line("LO", "BND", f"C{j}", f"{formulation.lower[j]:.12g}"))
+            if np.isfinite(formulation.upper[j]):
+                f.write(mps_line("UP", "BND", f"C{j}", f"{formulation.upper[j]:.12g}"))
+        f.write("ENDATA\n")
+
+def write_mipstart(formulation: Formulation, values, path: str):
+    # same format as the solution files of cbc, only the nonzero columns
+    with open(path, "w") as f:
+        f.write(f"Feasible - objective value {values[formulation.Z]:.12g}\n")
+        f.write("".join(f"{j} C{j} {values[j]:.12g} 0\n" for j in np.flatnonzero(values)))
+
+# counters of the summary printed by cbc at the end of a run, reported in its profile
+CBC_STATISTICS = re.compile(r"^(Enumerated nodes|Total iterations):\s+(\d+)", re.MULTILINE)
+
+def solve_cbc(formulation: Formulation, time_limit=300, threads=1, trace=None, start=None, cutoff=None) -> Result:
+    executable = cbc_executable()
+    if executable is None:
+        raise RuntimeError("the CBC approach needs a cbc executable: put cbc on PATH or install PuLP "
+                           "(pip install pulp, in requirements.txt), which bundles it")
+    start_time = time.time()
+    with tempfile.TemporaryDirectory() as folder:
+        model_path = os.path.join(folder, "model.mps")
+        solution_path = os.path.join(folder, "solution.txt")
+        with phase("flatten"):
+            write_mps(formulation, model_path)
+            command = [executable, model_path, "-sec", str(max(1, int(time_limit - (time.time() - start_time)))),
+                       "-threads", str(threads or 1)]
+            if start is not None:
+                start_path = os.path.join(folder, "start.txt")
+                write_mipstart(formulation, start, start_path)
+                command += ["-mips", start_path]
+            if cutoff is not None:
+                command += ["-cutoff", f"{cutoff:.12g}"]
+            command += ["-solve", "-solution", solution_path]
+        with phase("search"):
+            output = subprocess.run(command, capture_output=True, text=True).stdout
+        values = None
+        if os.path.exists(solution_path):
+            with open(solution_path) as f:
+                header = f.readline()
+                # an infeasible or stopped search without integer solutions writes the continuous relaxation
+                if "objective value" in header and "infeasible" not in header.lower() and "no integer" not in header:
+                    values = np.zeros(formulation.num_cols)
+                    for line in f:
+                        fields = line.split()
+                        if len(fields) >= 3 and fields[1].startswith("C"):
+                            values[int(fields[1][1:])] = float(fields[2])
+
+    status = "unknown"
+    if "Result - Optimal solution found" in output:
+        status = "optimal"
+    elif "Result - Problem proven infeasible" in output:
+        status = "infeasible"
+    elif "Result - Stopped on time limit" in output:
+        status = "time_limit"
+    solver_statistics("cbc", {name: value for name, value in CBC_STATISTICS.findall(output)})
+    bound = re.search(r"Lower bound:\s+(-?[\d.e+]+)", output)
+    obj = float(values[formulation.Z]) if values is not None else None
+    bound = float(bound.group(1)) if bound else (obj if status == "optimal" else None)
+    if trace is not None and obj is not None:
+        trace.incumbent(obj, bound)
+    return Result(status, obj, bound, values)
+
+
+# license free backends, the gurobi one is MIP_model.create_model_matrix driven by generateResultsMIP
+BACKENDS = {
+    "highs": solve_highs,
+    "cbc": solve_cbc,
+}
@@ -1,56 +1,12 @@
 import gurobipy as gp
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import breadth_first_order, connected_components, maximum_flow
 from gurobipy import GRB, quicksum
+from MIP_backends import build_formulation
 
-def retrieve_elements(middle, first):
-    for i in middle:
-        if i[0] == first:
-            return i
-
-def compute_routes(x):
-    routes = {}
-    for (i, j, k), var in x.items():
-        if var.x == 1:
-            if k not in routes:
-                routes[k] = [(i, j)]
-            else:
-                routes[k].append((i, j))
-    for k in routes:
-        start = next((t for t in routes[k] if t[0] == 0), None)
-        end = next((t for t in routes[k] if t[1] == 0), None)
-        if start and end:
-            routes[k].remove(start)
-            routes[k].remove(end)
-            middle = [t for t in routes[k] if t != start and t != end]
-            sorted_route = []
-            token = start[1]
-            for _ in routes[k]:
-                element = retrieve_elements(middle, token)
-                sorted_route.append(element)
-                token = element[1]
-            routes[k] = [start] + sorted_route + [end]
-    return routes
-
-def compute_items_carried(x, n):
-    items_carried = {}
-    for (i, j, k), var in x.items():
-        if var.x == 1:
-            if k not in items_carried:
-                items_carried[k] = [i]
-            elif i != n+1:
-                items_carried[k].append(i)
-    return items_carried
-
-def compute_total_distance(x, D):
-    total_distance = {}
-    for (i, j, k), var in x.items():
-        if var.X == 1:
-            if k not in total_distance:
-                total_distance[k] = D[i-1][j-1]
-            else:
-                total_distance[k] += D[i-1][j-1]
-    return total_distance
-
-def create_model(instance_data, env):
+def create_model(instance_data, env, lower_bound=0, subtour_elimination="mtz"):
+    # subtour_elimination: "mtz" adds the MTZ constraints, "lazy" leaves them to subtour_callback (u is None)
     m, n, l, si, D = instance_data
 
     ListCustomers = list(range(1, n+1))
@@ -60,8 +16,8 @@ def create_model(instance_data, env):
     model = gp.Model("VRP", env=env)
     x = model.addVars(Deposit, Deposit, ListCouriers, vtype=GRB.BINARY, name="x_ijk")
     y = model.addVars(Deposit, ListCouriers, vtype=GRB.BINARY, name="y_ik")
-    u = model.addVars(ListCustomers, ListCouriers, vtype=GRB.CONTINUOUS, name="u_ik")
-    max_distance = model.addVar(name='max_distance')
+    u = model.addVars(ListCustomers, ListCouriers, vtype=GRB.CONTINUOUS, name="u_ik") if subtour_elimination == "mtz" else None
+    max_distance = model.addVar(lb=lower_bound, name='max_distance') # a valid bound lets Gurobi close the gap early
 
     model.setObjective(max_distance, sense=GRB.MINIMIZE)
 
@@ -92,10 +48,107 @@ def create_model(instance_data, env):
         for j in Deposit:
             model.addConstr(quicksum(x[i, j, k] for i in Deposit) == quicksum(x[i, j, k] for i in Deposit))
 
-    for k in ListCouriers:
-        for i in ListCustomers:
-            for j in ListCustomers:
-                if i != j:
-                    model.addConstr(u[i, k] - u[j, k] + n * x[i, j, k] <= n - 1)
+    if subtour_elimination == "mtz":
+        for k in ListCouriers:
+            for i in ListCustomers:
+                for j in ListCustomers:
+                    if i != j:
+                        model.addConstr(u[i, k] - u[j, k] + n * x[i, j, k] <= n - 1)
 
     return model, x, u
+
+def create_model_matrix(instance_data, env, lower_bound=0, subtour_elimination="mtz"):
+    '''
+    same model as create_model, built with the matrix API from the solver independent formulation of
+    MIP_backends: the variables are added as MVars in the order of its columns (x, y, u, max_distance) and every
+    group of constraints as rows of one sparse coefficient matrix. Returns x as the same dict of Vars keyed by
+    (i, j, k), couriers from 1.
+    '''
+    formulation = build_formulation(instance_data, lower_bound, subtour_elimination)
+
+    model = gp.Model("VRP", env=env)
+    xv = model.addMVar(formulation.X.shape, vtype=GRB.BINARY, name="x_ijk")
+    yv = model.addMVar(formulation.Y.shape, vtype=GRB.BINARY, name="y_ik")
+    uv = model.addMVar(formulation.U.shape, vtype=GRB.CONTINUOUS, name="u_ik")
+    max_distance = model.addVar(lb=lower_bound, name='max_distance') # a valid bound lets Gurobi close the gap early
+    model.setObjective(max_distance, sense=GRB.MINIMIZE)
+    model.update()
+    for A, sense, b in formulation.blocks:
+        model.addMConstr(A, None, sense, b)
+
+    x = {(i, j, k + 1): var for i, row in enumerate(xv.tolist()) for j, column in enumerate(row) for k, var in enumerate(column)}
+    return model, x, uv if subtour_elimination == "mtz" else None
+
+############################# LAZY SUBTOUR ELIMINATION #############################
+
+'''
+Without MTZ every customer still has one courier, one predecessor and one successor (of that courier), so an
+integer solution is a set of routes from the depot plus, possibly, cycles among the customers. Any set S of
+customers satisfies the subtour elimination constraint, summed over the couriers since all the arcs of a customer
+belong to its courier:
+
+    sum_k sum_{i, j in S, i != j} x[i,j,k] <= |S| - 1
+
+Integer solutions are separated exactly: every weakly connected component of the support graph which does not
+contain the depot is a violated S. Fractional ones optionally at the root node: every customer t whose max flow
+from the depot (arc capacities sum_k x[i,j,k]) is below 1 gives the violated S on the sink side of the min cut,
+since the in-degree constraint makes the SEC of S equivalent to the cut constraint of its incoming arcs.
+'''
+
+FLOW_SCALE = 10000 # scipy max flow works on integer capacities
+CUT_TOLERANCE = 1e-4
+
+def subtour_cut(x, S, m):
+    return quicksum(x[i, j, k] for i in S for j in S if i != j for k in range(1, m + 1)) <= len(S) - 1
+
+def integer_subtours(values):
+    # values: aggregated arc matrix of an integer solution, node 0 is the depot
+    _, labels = connected_components(sp.csr_matrix(values > 0.5), directed=True, connection="weak")
+    return [np.flatnonzero(labels == c).tolist() for c in np.unique(labels) if c != labels[0]]
+
+def fractional_subtours(values):
+    # one min cut separation per customer, the cuts found are deduplicated
+    capacity = sp.csr_matrix(np.rint(values * FLOW_SCALE).astype(np.int32))
+    subtours = set()
+    for t in range(1, len(values)):
+        flow = maximum_flow(capacity, 0, t)
+        if flow.flow_value >= (1 - CUT_TOLERANCE) * FLOW_SCALE:
+            continue
+        residual = (capacity - flow.flow).tocsr()
+        residual.data[residual.data < 0] = 0
+        residual.eliminate_zeros()
+        source_side = breadth_first_order(residual, 0, directed=True, return_predecessors=False)
+        S = np.setdiff1d(np.arange(len(values)), source_side)
+        subtours.add(tuple(S.tolist()))
+    return [list(S) for S in subtours]
+
+def subtour_callback(x, n, m, fractional=False):
+    '''
+    Gurobi callback adding the violated subtour elimination constraints as lazy constraints, the model needs
+    the LazyConstraints parameter. Returns the callback and the counters of the cuts added.
+    '''
+    N = n + 1
+    variables = [x[i, j, k] for i in range(N) for j in range(N) for k in range(1, m + 1)]
+    stats = {"integer": 0, "fractional": 0}
+
+    def callback(model, where):
+        if where == GRB.Callback.MIPSOL:
+            values = np.array(model.cbGetSolution(variables)).reshape(N, N, m).sum(axis=2)
+            for S in integer_subtours(values):
+                model.cbLazy(subtour_cut(x, S, m))
+                stats["integer"] += 1
+        elif fractional and where == GRB.Callback.MIPNODE and \
+                model.cbGet(GRB.Callback.MIPNODE_STATUS) == GRB.OPTIMAL and model.cbGet(GRB.Callback.MIPNODE_NODCNT) == 0:
+            values = np.array(model.cbGetNodeRel(variables)).reshape(N, N, m).sum(axis=2)
+            np.fill_diagonal(values, 0)
+            for S in fractional_subtours(values):
+                if values[np.ix_(S, S)].sum() > len(S) - 1 + CUT_TOLERANCE:
+                    model.cbLazy(subtour_cut(x, S, m))
+                    stats["fractional"] += 1
+    return callback, stats
+
+# model builders selectable by the approaches of generateResultsMIP
+BUILDERS = {
+    "loops": create_model,
+    "matrix": create_model_matrix,
+}
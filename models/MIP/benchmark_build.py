@@ -0,0 +1,65 @@
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from run_all import parse_instances
+
+'''
+Build time and peak memory of the MIP model builders: every (instance, builder) pair is built in a fresh process,
+whose peak resident memory growth during the build (ru_maxrss after minus before, so including the memory of
+Gurobi itself) is reported next to the wall clock time of the build, model.update() included.
+'''
+
+def measure(builder, instance_path):
+    import gurobipy as gp
+    from instance_loader import load_instance
+    from MIP_model import BUILDERS
+
+    data = load_instance(instance_path).as_lists()
+    env = gp.Env(params={"OutputFlag": 0})
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+    model, _, _ = BUILDERS[builder](data, env)
+    model.update()
+    build_time = time.time() - start_time
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return build_time, peak / 1024, model.NumVars, model.NumConstrs # ru_maxrss is in KiB on Linux
+
+
+def main(argv=None):
+    from MIP_model import BUILDERS
+
+    parser = argparse.ArgumentParser(description="compare build time and peak memory of the MIP model builders")
+    parser.add_argument("--instances", default=None, help="instance numbers to build, e.g. 1-10,13")
+    parser.add_argument("--builders", nargs="*", default=list(BUILDERS), help="builders to compare")
+    parser.add_argument("--input-folder", default="./Instances")
+    args = parser.parse_args(argv)
+
+    instances = parse_instances(args.instances)
+    ctx = mp.get_context("spawn")
+    print(f"{'inst':<6}{'builder':<10}{'vars':>10}{'constrs':>10}{'time (s)':>10}{'peak (MiB)':>12}")
+    for file_name in sorted(os.listdir(args.input_folder)):
+        number = int(file_name.split("inst")[-1].split(".")[0])
+        if instances is not None and number not in instances:
+            continue
+        for builder in args.builders:
+            with ctx.Pool(1) as pool:
+                build_time, peak, num_vars, num_constrs = pool.apply(measure, (builder, os.path.join(args.input_folder, file_name)))
+            print(f"{number:<6}{builder:<10}{num_vars:>10}{num_constrs:>10}{build_time:>10.2f}{peak:>12.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
+
+'''
+
+from the repository root:
+
+    python models/MIP/benchmark_build.py --instances 1-21
+
+'''
@@ -1,17 +1,27 @@
-import json, os, time, math
-from MIP_model import create_model, compute_routes, compute_items_carried, compute_total_distance
-import gurobipy as gp
-from gurobipy import GRB, quicksum
+import glob, json, os, sys, time, math
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HEUR'))
+from instance_loader import load_instance, instance_number
+from tracing import Trace, open_trace
+from bounds import lower_bound
+from HEUR_model import solve_heuristic
+from solutions import route_distances, validate_result
+from profiling import phase, solver_statistics
+from MIP_backends import BACKENDS, build_formulation, routes_from_values, routes_from_x, routes_objective, start_values
 
-def make_json(filename, solvers, times, objs, solutions, is_optimal_vec):
+def make_json(filename, solvers, times, objs, solutions, is_optimal_vec, gaps=None):
     solv = {}
-    for solver, time, obj, solution, is_optimal in zip(solvers, times, objs, solutions, is_optimal_vec):
+    gaps = gaps or [None] * len(solvers)
+    for solver, time, obj, solution, is_optimal, gap in zip(solvers, times, objs, solutions, is_optimal_vec, gaps):
         data = {
             'time': int(time),
             'optimal': is_optimal,
             'obj': obj,
             'sol': solution
         }
+        if gap is not None:
+            data['gap'] = gap
         solv[solver] = data
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     with open(filename, 'w') as outfile:
@@ -23,41 +33,214 @@ params = {
     "WLSSECRET": '6bba51b0-93a7-4823-9d8f-f1dbafea48a2',
     "LICENSEID": 2532591,
 }
-env = gp.Env(params=params)
 
-for i in range(1, 22):
-    instance = f"{i:02d}"
-    file_name = f"Instances/inst{instance}.dat"
+# name of the json entry -> options of the model: backend is "gurobi" (default) or a key of MIP_backends.BACKENDS,
+# which need neither gurobipy nor a license. For gurobi, builder is a key of MIP_model.BUILDERS, matrix by default,
+# subtour is "mtz" (static MTZ constraints, default) or "lazy" (subtour cuts separated in a callback on the
+# integer solutions, and with mincut also on the fractional ones of the root node), warm_start False skips the
+# start solution and cutoff (see WARM START)
+approaches = {
+    "Gurobi": {},
+    "Gurobi_cold": {"warm_start": False},
+    "Gurobi_lazy": {"subtour": "lazy"},
+    "Gurobi_lazy_mincut": {"subtour": "lazy", "mincut": True},
+    "HiGHS": {"backend": "highs"},
+    "CBC": {"backend": "cbc"},
+}
+
+_env = None
+
+def get_env():
+    # the license environment is created once per process, on first use
+    global _env
+    import gurobipy as gp
+    if _env is None:
+        _env = gp.Env(params=params)
+    return _env
+
+def trace_callback(trace):
+    # Gurobi callback recording every new incumbent and every improvement of the best bound
+    from gurobipy import GRB
+    def callback(model, where):
+        if where == GRB.Callback.MIPSOL:
+            trace.incumbent(model.cbGet(GRB.Callback.MIPSOL_OBJ), model.cbGet(GRB.Callback.MIPSOL_OBJBND))
+        elif where == GRB.Callback.MIP:
+            trace.bound(model.cbGet(GRB.Callback.MIP_OBJBND))
+    return callback
+
+def lazy_callback(trace, x, n, m, fractional):
+    # subtour separation first: a solution cut off by a lazy constraint is not an incumbent
+    from gurobipy import GRB
+    from MIP_model import subtour_callback
+    separate, stats = subtour_callback(x, n, m, fractional)
+    record = trace_callback(trace)
+    def callback(model, where):
+        cuts = stats["integer"]
+        separate(model, where)
+        if where != GRB.Callback.MIPSOL or stats["integer"] == cuts:
+            record(model, where)
+    return callback, stats
 
-    with open(file_name, "r") as f:
-        m = int(f.readline())
-        n = int(f.readline())
-        l = [int(x) for x in f.readline().split()]
-        si = [int(x) for x in f.readline().split()]
-        D = [[int(x) for x in f.readline().split()] for _ in range(n+1)]
+# model attributes reported in the profile of a run
+GUROBI_STATISTICS = ["NodeCount", "IterCount", "BarIterCount", "SolCount", "Runtime", "NumVars", "NumConstrs", "NumNZs"]
 
-    instance_data = (m, n, l, si, D)
-    model, x, u = create_model(instance_data, env)
+def solve_gurobi(config, instance_data, bound, time_limit, threads, trace, start=None):
+    # (optimal, obj, sol, best bound) of the Gurobi model, obj and sol are None without an incumbent
+    from gurobipy import GRB
+    from MIP_model import BUILDERS
 
-    model.setParam(GRB.Param.TimeLimit, 300)
+    m, n, l, si, D = instance_data
+    build = BUILDERS[config.get("builder", "matrix")]
+    subtour = config.get("subtour", "mtz")
+    env = get_env()
+    with phase("build"):
+        model, x, u = build(instance_data, env, lower_bound=bound, subtour_elimination=subtour)
+        model.update()
 
+    model.setParam(GRB.Param.TimeLimit, time_limit)
+    model.setParam(GRB.Param.Threads, threads)
+    if start is not None:
+        # x and max_distance only, Gurobi completes the partial start (y and u follow from x)
+        with phase("presolve"):
+            obj, routes = start
+            formulation = build_formulation(instance_data, bound, subtour)
+            values = start_values(formulation, routes, obj)
+            model.setAttr("Start", list(x.values()), [values[formulation.X[i, j, k - 1]] for (i, j, k) in x])
+            model.getVarByName("max_distance").Start = obj
+            model.setParam(GRB.Param.Cutoff, obj + CUTOFF_MARGIN)
+    if subtour == "lazy":
+        model.setParam(GRB.Param.LazyConstraints, 1)
+        callback, stats = lazy_callback(trace, x, n, m, config.get("mincut", False))
+    else:
+        callback = trace_callback(trace)
+
+    with phase("search"):
+        model.optimize(callback)
+    if subtour == "lazy":
+        print(f"Subtour cuts: {stats['integer']} from integer solutions, {stats['fractional']} from fractional ones")
+    solver_statistics("gurobi", {name: model.getAttr(name) for name in GUROBI_STATISTICS})
+
+    # with a start, no solution within the cutoff proves the start optimal (it is the one reported then)
+    opt = model.status == GRB.OPTIMAL or (start is not None and model.status == GRB.CUTOFF)
+    if model.SolCount == 0:
+        return opt, None, None, model.ObjBound
+    with phase("decode"):
+        values = np.array(model.getAttr(GRB.Attr.X, list(x.values()))).reshape(n + 1, n + 1, m) # x keys are i, j, k
+        return opt, round(model.objVal), routes_from_x(values), model.ObjBound
+
+def solve_backend(config, instance_data, bound, time_limit, threads, trace, start=None):
+    # license free backends, on the same formulation as the matrix builder of Gurobi
+    if config.get("subtour", "mtz") != "mtz":
+        raise ValueError("lazy subtour elimination needs a solver callback, only the gurobi backend has it")
     start_time = time.time()
-    model.optimize()
-    elapsed_time = time.time() - start_time
+    with phase("build"):
+        formulation = build_formulation(instance_data, bound)
+    values, cutoff = None, None
+    if start is not None:
+        with phase("presolve"):
+            values, cutoff = start_values(formulation, start[1], start[0]), start[0] + CUTOFF_MARGIN
+    result = BACKENDS[config["backend"]](formulation, time_limit - (time.time() - start_time), threads, trace,
+                                        values, cutoff)
+    print(f"{config['backend']}: {result.status}, obj = {result.obj}, bound = {result.bound}")
+    # with a cutoff the model is infeasible when no solution beats the start, which proves the start optimal
+    opt = result.status == "optimal" or (cutoff is not None and result.status in ("infeasible", "cutoff"))
+    if result.obj is None:
+        return opt, None, None, result.bound
+    with phase("decode"):
+        return opt, round(result.obj), routes_from_values(formulation, result.values), result.bound
 
-    json_file_path = f"res/MIP/{instance}.json"
-    opt = model.status == GRB.OPTIMAL
+############################# WARM START #############################
 
-    if opt:
-        routes = compute_routes(x)
-        sol = [[routes[k][i][0] for i in range(1, len(routes[k]))] for k in sorted(routes.keys())]
+'''
+Every approach but the cold one starts from the best feasible solution among the one of the heuristic (regret
+insertion and local search, no ILS) and those already in the result jsons of any approach for the instance. Its
+value is also a cutoff: the solver only searches for solutions which are not worse, and when it finds none the start
+solution is reported as optimal, with the time of the run. Starts in which a courier stays at the depot are skipped,
+the MIP model does not allow them. The result jsons are not read when CDMO_PRIOR_RESULTS is empty (run_all sets it for the jobs it records in its
+results store, whose keys do not cover them).
+'''
+
+CUTOFF_MARGIN = 0.5 # the distances are integer, a cutoff just above the start value keeps the solutions not worse
+results_folder = os.environ.get("CDMO_PRIOR_RESULTS", "res")
+
+def prior_solutions(instance_path):
+    # solutions of the instance in the result jsons of all the approaches
+    if not results_folder:
+        return
+    number = instance_number(instance_path)
+    for path in sorted(glob.glob(os.path.join(results_folder, "*", f"{number}.json"))):
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for entry in entries.values():
+            if isinstance(entry, dict):
+                yield entry.get("sol")
 
-        items_carried = compute_items_carried(x, n)
-        for k, items in items_carried.items():
-            items.remove(0)
+def warm_start(instance_data, instance_path, bound):
+    # (obj, sol) of the best start solution, None if there is none
+    m, n, l, si, D = instance_data
+    heuristic = solve_heuristic(m, n, l, si, D, lower_bound=bound)
+    candidates = [heuristic["sol"]] if heuristic is not None else []
+    candidates += list(prior_solutions(instance_path))
+    starts = [(routes_objective(instance_data, routes), routes) for routes in candidates]
+    starts = [(obj, routes) for obj, routes in starts if obj is not None and all(routes)]
+    return min(starts, key=lambda start: start[0], default=None)
 
-        total_distance = compute_total_distance(x, D)
+def solve_instance(approach, instance_path, time_limit=300, threads=0, trace=None):
+    # run a single approach on a single instance and build its json entry (threads=0 lets the solver decide).
+    # On timeout the entry holds the best solution found, the warm start at worst, and its relative gap
+    start_time = time.time()
+    trace = trace or Trace()
+    with phase("parse"):
+        instance_data = load_instance(instance_path).as_lists()
+    with phase("presolve"):
+        bound = lower_bound(*instance_data)
+        trace.bound(bound)
+        config = approaches[approach]
+        start = warm_start(instance_data, instance_path, bound) if config.get("warm_start", True) else None
+    if start is not None:
+        print(f"Warm start of value {start[0]}")
+        trace.incumbent(start[0])
+    solve = solve_gurobi if config.get("backend", "gurobi") == "gurobi" else solve_backend
+    opt, obj, sol, solver_bound = solve(config, instance_data, bound, time_limit - (time.time() - start_time),
+                                        threads, trace, start)
+    elapsed_time = time.time() - start_time
 
-        make_json(json_file_path, ["Gurobi"], [elapsed_time], [model.objVal], [sol], [opt])
+    if sol is not None:
+        # the objective of the routes themselves, the max_distance of an incumbent can lie above its longest route
+        with phase("decode"):
+            obj = int(route_distances(sol, instance_data[4]).max())
+    if start is not None and (obj is None or start[0] < obj):
+        obj, sol = start
+    if opt:
+        trace.optimal()
+        result = {'time': int(elapsed_time), 'optimal': True, 'obj': obj, 'sol': sol}
     else:
-        make_json(json_file_path, ["Gurobi"], [300], [math.inf], [], [opt])
+        if solver_bound is not None and math.isfinite(solver_bound):
+            bound = max(bound, math.ceil(solver_bound - 1e-6))
+        gap = (obj - bound) / obj if obj else None
+        result = {'time': time_limit, 'optimal': False, 'obj': obj, 'sol': sol, 'gap': gap}
+    m, n, l, si, D = instance_data
+    with phase("decode"):
+        return validate_result(result, l, si, D)
+
+input_folder = "Instances"
+
+def main():
+    for i in range(1, 22):
+        instance = f"{i:02d}"
+        file_name = f"{input_folder}/inst{instance}.dat"
+        json_file_path = f"res/MIP/{instance}.json"
+
+        results = []
+        for approach in approaches:
+            trace = open_trace("MIP", instance, approach)
+            results.append(solve_instance(approach, file_name, trace=trace))
+            trace.close()
+        make_json(json_file_path, list(approaches), [r['time'] for r in results], [r['obj'] for r in results],
+                  [r['sol'] for r in results], [r['optimal'] for r in results], [r.get('gap') for r in results])
+
+if __name__ == "__main__":
+    main()
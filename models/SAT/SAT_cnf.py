@@ -0,0 +1,367 @@
+import math
+import threading
+import time
+from array import array
+from itertools import combinations
+
+import numpy as np
+from pysat.solvers import Solver as CNFSolver
+
+from tracing import Trace
+from solutions import route_distances, routes_from_arcs
+from profiling import phase, solver_statistics
+from SAT_utils import objective_search
+
+'''
+Direct CNF backend of the SAT model: the same formulation of SAT_model.solve_mcp (y[k][i][j] iff courier k
+travels from node i to node j), written as integer clauses into a flat array('i') buffer, DIMACS style
+(the literals of every clause followed by 0), and given to the solver in bulk.
+
+Every encoding works on a whole batch of constraints at once: `groups` is a 2D array of literals with one
+constraint per row, so the clauses of all the rows are generated by a few numpy operations instead of one
+z3 expression per literal. The at most one encodings are the naive, sequential, heule and bitwise ones of
+SAT_utils.py, the other constraints are:
+
+    flow            a[k][i] iff item i is delivered by courier k, y[k][i][j] -> a[k][i], a[k][j] and
+                    a[k][i] -> some y[k][i][j], some y[k][j][i]
+    capacity        sequential weighted counter on sum_i s[i] * a[k][i] <= l[k]
+    subtours        y[k][i][j] -> x[i][j] -> u[i] < u[j] between items, with x the arcs used by any courier and u
+                    the position of every item in its route (shared by the couriers) on enough bits to count n items
+    distances       the length of every route as a binary number: the arc leaving each item sets the bits of its
+                    length (x[i][j] -> bits of D[i][j]), kept by the courier of the item, and the bits of the
+                    n+1 arcs of a courier are added by a tree of ripple carry adders. Only the direction
+                    arcs -> bits is encoded, so the sum is an upper bound on the route length, which is all that
+                    "max distance <= bound" needs
+
+The objective is minimized by binary (or linear) search on the bound: every bound B gets its own literal
+which activates "each route length <= B" as a few comparator clauses, and is passed to the solver as an
+assumption, so the solver keeps its learned clauses from one call to the next. Each improving solution also
+adds its bound minus one as a permanent unit, and the incumbent is optimal only when the bound below it is
+proven unsatisfiable.
+'''
+
+class CNF:
+    '''
+    clause buffer with its variable counter, variables are numbered from 1 as in DIMACS
+    '''
+    def __init__(self):
+        self.num_vars = 0
+        self.num_clauses = 0
+        self.buffer = array('i')
+
+    def new_vars(self, *shape) -> np.ndarray:
+        count = math.prod(shape)
+        ids = np.arange(self.num_vars + 1, self.num_vars + count + 1, dtype=np.int32).reshape(shape)
+        self.num_vars += count
+        return ids
+
+    def add(self, *clauses):
+        # one row of literals per clause, given as columns: add(-x, y) adds the clauses (-x[r] or y[r])
+        columns = np.broadcast_arrays(*[np.asarray(c, dtype=np.int32) for c in clauses])
+        block = np.stack([c.ravel() for c in columns] + [np.zeros(columns[0].size, dtype=np.int32)], axis=1)
+        self.buffer.frombytes(block.tobytes())
+        self.num_clauses += len(block)
+
+    def add_rows(self, rows):
+        # one clause per row of a 2D array
+        self.add(*np.asarray(rows, dtype=np.int32).T)
+
+    def clauses(self, start=0):
+        '''
+        the clauses (from position start of the buffer) as lists of literals, grouped by length to split the
+        buffer with numpy
+        '''
+        literals = np.frombuffer(self.buffer, dtype=np.int32)[start:]
+        ends = np.flatnonzero(literals == 0)
+        starts = np.concatenate([[0], ends[:-1] + 1])
+        lengths = ends - starts
+        for length in np.unique(lengths):
+            rows = starts[lengths == length]
+            yield from literals[rows[:, None] + np.arange(length)].tolist()
+
+################ ENCODINGS #################
+
+# every function adds its constraint on each row of groups, a 2D array of literals
+
+def at_least_one(cnf, groups):
+    cnf.add_rows(groups)
+
+# naive encoding
+def at_most_one_np(cnf, groups):
+    for i, j in combinations(range(groups.shape[1]), 2):
+        cnf.add(-groups[:, i], -groups[:, j])
+
+# sequential encoding
+def at_most_one_seq(cnf, groups):
+    rows, n = groups.shape
+    if n <= 1:
+        return
+    s = cnf.new_vars(rows, n - 1)
+    cnf.add(-groups[:, 0], s[:, 0])
+    cnf.add(-groups[:, n-1], -s[:, n-2])
+    if n > 2:
+        x, s_prev, s_next = groups[:, 1:n-1], s[:, :n-2], s[:, 1:n-1]
+        cnf.add(-x, s_next)
+        cnf.add(-x, -s_prev)
+        cnf.add(-s_prev, s_next)
+
+# bitwise encoding
+def at_most_one_bw(cnf, groups):
+    rows, n = groups.shape
+    if n <= 1:
+        return
+    m = math.ceil(math.log2(n))
+    r = cnf.new_vars(rows, m)
+    for i in range(n):
+        for j in range(m):
+            # bit j (most significant first) of the binary representation of i
+            bit = (i >> (m - 1 - j)) & 1
+            cnf.add(-groups[:, i], r[:, j] if bit else -r[:, j])
+
+# heule encoding
+def at_most_one_he(cnf, groups):
+    while groups.shape[1] > 4:
+        y = cnf.new_vars(groups.shape[0], 1)
+        at_most_one_np(cnf, np.concatenate([groups[:, :3], y], axis=1))
+        groups = np.concatenate([groups[:, 3:], -y], axis=1)
+    at_most_one_np(cnf, groups)
+
+AT_MOST_ONE = {
+    "naive": at_most_one_np,
+    "sequential": at_most_one_seq,
+    "heule": at_most_one_he,
+    "bitwise": at_most_one_bw,
+}
+
+def exactly_one(cnf, groups, enc):
+    at_least_one(cnf, groups)
+    AT_MOST_ONE[enc](cnf, groups)
+
+def at_most_k_weighted(cnf, literals, weights, k):
+    '''
+    sequential weighted counter for sum_i weights[i] * literals[i] <= k:
+    r[i][j] is true if the sum of the first i+1 terms is at least j+1
+    '''
+    literals = np.asarray(literals, dtype=np.int32)
+    weights = np.asarray(weights, dtype=np.int64)
+    too_heavy = weights > k
+    if too_heavy.any():
+        cnf.add(-literals[too_heavy])
+    # weightless terms never change the sum
+    kept = ~too_heavy & (weights > 0)
+    literals, weights = literals[kept], weights[kept]
+    if weights.sum() <= k:
+        return
+    r = cnf.new_vars(len(literals), k)
+    for i, (x, w) in enumerate(zip(literals, weights)):
+        cnf.add(-x, r[i, :w])
+        if i == 0:
+            cnf.add(-r[0, w:])
+            continue
+        cnf.add(-r[i-1], r[i])
+        cnf.add(-x, -r[i-1, :k-w], r[i, w:])
+        # overflow: the first i terms reach k - w + 1
+        cnf.add(-x, -r[i-1, k-w])
+
+def full_adder(cnf, a, b, c):
+    '''
+    sum and carry bits of a + b + c, element wise on arrays of literals
+    '''
+    total, carry = cnf.new_vars(*a.shape), cnf.new_vars(*a.shape)
+    for values in np.ndindex(2, 2, 2):
+        # this assignment of (a, b, c) implies the sum bit of its parity
+        excluded = [-x if value else x for x, value in zip((a, b, c), values)]
+        cnf.add(*excluded, total if sum(values) % 2 == 1 else -total)
+    for x, z in ((a, b), (a, c), (b, c)):
+        cnf.add(-x, -z, carry)
+        cnf.add(x, z, -carry)
+    return total, carry
+
+def add_binary(cnf, a, b, false):
+    '''
+    a + b on arrays of binary numbers (least significant bit last axis first) of the same width
+    '''
+    carry = np.full(a.shape[:-1], false, dtype=np.int32)
+    bits = []
+    for t in range(a.shape[-1]):
+        total, carry = full_adder(cnf, a[..., t], b[..., t], carry)
+        bits.append(total)
+    return np.stack(bits + [carry], axis=-1)
+
+def sum_binary(cnf, numbers, false):
+    '''
+    sum along axis 1 of numbers, an array (rows, terms, bits) of binary numbers, by a tree of adders
+    '''
+    while numbers.shape[1] > 1:
+        if numbers.shape[1] % 2 == 1:
+            numbers = np.concatenate([numbers, np.full_like(numbers[:, :1], false)], axis=1)
+        numbers = add_binary(cnf, numbers[:, 0::2], numbers[:, 1::2], false)
+    return numbers[:, 0]
+
+def at_most_constant(cnf, guard, numbers, bound):
+    '''
+    guard -> number <= bound for every row of numbers, binary with the least significant bit first
+    '''
+    if bound < 0:
+        cnf.add([-guard])
+        return
+    width = numbers.shape[1]
+    if bound >= 2 ** width - 1:
+        return
+    ones = [] # more significant bits where the bound has a 1
+    for t in reversed(range(width)):
+        if (bound >> t) & 1:
+            ones.append(numbers[:, t])
+        else:
+            # bit t set over a bound bit 0, while equal on every more significant 1 of the bound
+            cnf.add(-guard, -numbers[:, t], *[-x for x in ones])
+
+def less_than(cnf, guard, a, b):
+    '''
+    guard -> a < b for every row, with a and b 2D arrays of bits (most significant first)
+    '''
+    rows, bits = a.shape
+    q = np.concatenate([guard[:, None], cnf.new_vars(rows, bits - 1)], axis=1) # still equal on the first t bits
+    cnf.add(-q, -a, b)
+    cnf.add(-q[:, :-1], -a[:, :-1], q[:, 1:])
+    cnf.add(-q[:, :-1], b[:, :-1], q[:, 1:])
+    # equal on every bit is not allowed
+    cnf.add(-q[:, -1], -a[:, -1])
+    cnf.add(-q[:, -1], b[:, -1])
+
+###########################################
+
+def build_cnf(m, n, l, s, D, enc):
+    '''
+    returns the cnf, the variables y of the routes and the binary lengths of the routes
+    '''
+    cnf = CNF()
+    depot = n
+    items = np.arange(n)
+    D = np.asarray(D, dtype=np.int64)
+    y = cnf.new_vars(m, n+1, n+1)
+    a = cnf.new_vars(m, n)
+    x = cnf.new_vars(n, n+1)
+    false = cnf.new_vars(1)[0]
+    cnf.add([-false])
+
+    # can't stay in the same node
+    cnf.add(-y[:, np.arange(n+1), np.arange(n+1)].ravel())
+    off_diagonal = ~np.eye(n+1, dtype=bool)
+
+    # each item must be delivered exactly once: one arc into it and one arc out of it over all the couriers
+    into = np.stack([y[:, off_diagonal[:, i], i].ravel() for i in items])
+    out_of = np.stack([y[:, i, off_diagonal[i]].ravel() for i in items])
+    exactly_one(cnf, into, enc)
+    exactly_one(cnf, out_of, enc)
+
+    # start and end at depot
+    exactly_one(cnf, y[:, depot, :n], enc)
+    exactly_one(cnf, y[:, :n, depot], enc)
+
+    # flow conservation: courier k enters item i iff it leaves it
+    for k in range(m):
+        cnf.add(-y[k, :n, :], a[k][:, None])
+        cnf.add(-y[k, :, :n], a[k][None, :])
+        at_least_one(cnf, np.concatenate([-a[k][:, None], y[k, :n, :]], axis=1))
+        at_least_one(cnf, np.concatenate([-a[k][:, None], y[k, :, :n].T], axis=1))
+
+    # load within the capacity
+    for k in range(m):
+        at_most_k_weighted(cnf, a[k], s, l[k])
+
+    # arcs leaving the items, whatever the courier
+    cnf.add(-y[:, :n, :], x[None])
+
+    # sub-tour elimination: positions increase along every arc between items
+    bits = max(1, (n - 1).bit_length())
+    u = cnf.new_vars(n, bits)
+    i, j = np.nonzero(~np.eye(n, dtype=bool))
+    less_than(cnf, x[i, j], u[i], u[j])
+
+    # length of the arc leaving every node of each courier, then of its route
+    width = max(1, int(D.max()).bit_length())
+    weight = cnf.new_vars(n, width)
+    arc = cnf.new_vars(m, n+1, width)
+    for b in range(width):
+        i, j = np.nonzero((D[:n] >> b) & 1)
+        cnf.add(-x[i, j], weight[i, b])
+        j = np.flatnonzero((D[depot, :n] >> b) & 1)
+        cnf.add(-y[:, depot, j], arc[:, depot, b][:, None])
+    cnf.add(-weight[None], -a[:, :, None], arc[:, :n])
+    lengths = sum_binary(cnf, arc, false)
+    return cnf, y, lengths
+
+def assignment_of(model):
+    # truth value of every variable, indexed by variable id
+    model = np.asarray(model)
+    assignment = np.zeros(len(model) + 1, dtype=bool)
+    assignment[np.abs(model)] = model > 0
+    return assignment
+
+def solve_mcp_cnf(m, n, l, s, D, enc, solver, time_limit=300, trace=None, lower_bound=0, search="binary"):
+
+    trace = trace or Trace()
+    print("trying cnf encoding:", enc, "with solver:", solver, "and", search, "search")
+
+    ''' GENERATE AND LOAD THE CNF '''
+    start_time = time.time()
+    with phase("build"):
+        cnf, y, lengths = build_cnf(m, n, l, s, D, enc)
+    S = CNFSolver(name=solver)
+    loaded = 0
+
+    def load():
+        # give the solver the clauses added to the buffer since the last call
+        nonlocal loaded
+        add_clause = S.add_clause
+        for clause in cnf.clauses(loaded):
+            add_clause(clause)
+        loaded = len(cnf.buffer)
+
+    with phase("flatten"):
+        load()
+    print("Total number of clauses in the model: ", cnf.num_clauses, "on", cnf.num_vars, "variables")
+    print("Time to generate constraints: %.4f" % (time.time() - start_time))
+    print("-"*30, "\n")
+
+    ''' SOLVE '''
+    bound_literals = {}
+
+    def bound_literal(bound):
+        # literal activating "every route length <= bound"
+        if bound not in bound_literals:
+            bound_literals[bound] = cnf.new_vars(1)[0]
+            at_most_constant(cnf, bound_literals[bound], lengths, bound)
+            load()
+        return int(bound_literals[bound])
+
+    def solve(bound):
+        assumptions = [] if bound is None else [bound_literal(bound)]
+        with phase("search"):
+            status = S.solve_limited(assumptions, expect_interrupt=True)
+        if not status:
+            return status, None, None
+        with phase("decode"):
+            routes = routes_from_arcs(assignment_of(S.get_model())[y])
+            obj = int(route_distances(routes, D).max())
+        # later solutions must improve on this one
+        S.add_clause([bound_literal(obj - 1)])
+        return True, obj, routes
+
+    # the solver is interrupted from a timer thread at the time limit (glucose and minisat release the GIL while
+    # solving, the pysat build of cadical does not and would ignore the timer)
+    timer = threading.Timer(max(0, time_limit - (time.time() - trace.start)), S.interrupt)
+    timer.start()
+    best_sol, opt_sol_vect, is_optimal = objective_search(solve, lower_bound, trace, linear=(search == "linear"))
+    timer.cancel()
+    solver_statistics("pysat", S.accum_stats())
+    S.delete()
+
+    elapsed_time = time.time() - trace.start
+    return {
+        "time": min(math.ceil(elapsed_time), time_limit),
+        "optimal": is_optimal,
+        "obj": best_sol,
+        "sol": opt_sol_vect
+    }
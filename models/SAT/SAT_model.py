@@ -1,8 +1,81 @@
 from SAT_utils import *
+from tracing import Trace
+from solutions import check_solution, route_distances, routes_from_arcs, z3_names, z3_values
+from profiling import phase, solver_statistics
+import numpy as np
 import time
 import sys
 
-def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
+def extract_solution(model, y_names, m, n, l, s, D):
+    '''
+    routes (1-based items) and distances of the couriers in the y of a model, whether they are not valid routes and
+    the values of y. y_names are the names of y (solutions.z3_names), read in one pass over the model
+    '''
+    arcs = z3_values(model, y_names, default=False).astype(bool)
+    solution = routes_from_arcs(arcs)
+    errors = ["some route does not close at the depot"] if solution is None else check_solution(solution, l, s, D)
+    for error in errors:
+        print("y is wrong!!!", error)
+    if errors:
+        return solution, [0] * m, True, arcs
+
+    distances = route_distances(solution, D).tolist()
+    print("distances: ", distances)
+    print("solution: ", solution)
+    return solution, distances, False, arcs
+
+def solve_by_bounds(S, y, m, n, l, s, D, time_limit, trace, lower_bound, linear=False):
+    '''
+    minimize the max distance by bounded calls to S with an assumption per bound, instead of blocking solutions
+    '''
+    bound_literals = {}
+    y_names = z3_names(y)
+
+    def bound_literal(bound):
+        # literal activating "every route length <= bound"
+        if bound not in bound_literals:
+            bound_literals[bound] = Bool(f"max_distance_le_{bound}")
+            arcs = [(i, j) for i in range(n+1) for j in range(n+1) if i != j and D[i][j] > 0]
+            S.add(Implies(bound_literals[bound],
+                          And([PbLe([(y[k][i][j], int(D[i][j])) for i, j in arcs], bound) for k in range(m)])))
+        return bound_literals[bound]
+
+    def solve(bound):
+        assumptions = [] if bound is None else [bound_literal(bound)]
+        while True:
+            remaining_time = time_limit - (time.time() - trace.start)
+            if remaining_time <= 0:
+                return None, None, None
+            S.set("timeout", int(remaining_time * 1000))
+            with phase("search"):
+                result = S.check(*assumptions)
+            if result != sat:
+                return (False if result == unsat else None), None, None
+            with phase("decode"):
+                model = S.model()
+                solution, distances, y_is_wrong, arcs = extract_solution(model, y_names, m, n, l, s, D)
+            if not y_is_wrong:
+                break
+            # not a set of routes: exclude its arcs and look again
+            S.add(Or([Not(y[k][i][j]) for k, i, j in zip(*np.nonzero(arcs))]))
+        obj = int(max(distances))
+        # later solutions must improve on this one
+        S.add(bound_literal(obj - 1))
+        return True, obj, solution
+
+    best_sol, opt_sol_vect, is_optimal = objective_search(solve, lower_bound, trace, linear)
+    solver_statistics("z3", S.statistics())
+    return {
+        "time": min(math.ceil(time.time() - trace.start), time_limit),
+        "optimal": is_optimal,
+        "obj": best_sol,
+        "sol": opt_sol_vect
+    }
+
+def solve_mcp(m, n, l, s, D, num_bits, enc, solver, time_limit=300, threads=12, trace=None, lower_bound=0,
+              search="block"):
+    
+    trace = trace or Trace()
     
     print("trying encoding:", enc, "with solver:", solver)
     
@@ -27,63 +100,58 @@ def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
     S=Solver()
     start_time = time.time()
         
-    ''' DECISION VARIABLES '''
-    # Decision variables
-    y = [[[Bool(f'y_{k}_{i}_{j}') for j in range(n+1)] for i in range(n+1)] for k in range(m)] # y[k][i][j] = 1 iff courier k travel from node i to node j
-    u = [[Bool(f'u_{i}_{b}') for b in range(num_bits)] for i in range(n+1)] # subtour elimination variable
+    with phase("build"):
+        ''' DECISION VARIABLES '''
+        # Decision variables
+        y = [[[Bool(f'y_{k}_{i}_{j}') for j in range(n+1)] for i in range(n+1)] for k in range(m)] # y[k][i][j] = 1 iff courier k travel from node i to node j
+        x = [[Bool(f'x_{i}_{j}') for j in range(n)] for i in range(n)] # x[i][j] = 1 iff some courier travels from item i to item j
+        u = [[Bool(f'u_{i}_{b}') for b in range(num_bits)] for i in range(n)] # subtour elimination variable, position of item i (most significant bit first)
     
-    ''' ADD CONSTRAINTS on y '''
-    for k in range(m):
-        pseudo_bool_vars = [If(y[k][i][j], s[j], 0) for i in range(n+1) for j in range(n)]
-        S.add(Sum(pseudo_bool_vars) <= l[k])
-
-    # Each item must be delivered exactly once
-    for i in range(n):
-        S.add(And(
-            exactly_one([y[k][j][i] for k in range(m) for j in range(n+1)], name = f"delivery_to_{i}"),
-            exactly_one([y[k][i][j] for k in range(m) for j in range(n+1)], name = f"delivery_from_{i}")
-        ))
-
-    # Start and end at depot
-    depot = n
-    for k in range(m):
-        S.add(
-            exactly_one([y[k][depot][i] for i in range(n)], name = f"from_depot_{k}")
-        )
-        S.add(
-            exactly_one([y[k][i][depot] for i in range(n)], name = f"to_depot_{k}")
-        )
-
-    # Can't stay in the same node
-    for k in range(m):
-        for i in range(n+1):
-            S.add(Not(y[k][i][i]))
-
-    # Flow conservation
-    for k in range(m):
-        for i in range(n):
-            bool_vars_from = [y[k][j][i] for j in range(n+1)]
-            bool_vars_to = [y[k][i][j] for j in range(n+1)]
-            S.add(Implies(exactly_one(bool_vars_from, name = f"flow_from_{k}_{i}"), exactly_one(bool_vars_to, name = f"flow_to_{k}_{i}")))
-            
-    ''' ADD SUB-TOUR ELIMINATION CONSTRAINT with boolean encoding '''
-    # MTZ constraints with boolean encoding
-    for k in range(m):
-        # Constraint for the depot (node 0)
-        for b in range(num_bits):
-            S.add(u[depot][b] == False)  # Set depot position to 1
+        ''' ADD CONSTRAINTS on y '''
+        for k in range(m):
+            # pseudo boolean, kept in the sat core instead of an arithmetic sum
+            S.add(PbLe([(y[k][i][j], s[j]) for i in range(n+1) for j in range(n) if s[j] > 0], l[k]))
 
+        # Each item must be delivered exactly once
         for i in range(n):
-            # Ensure position is between 2 and n+1 for non-depot nodes
-            S.add(Sum([If(u[i][b], 1, 0) * 2**b for b in range(num_bits)]) >= 1)
-            S.add(Sum([If(u[i][b], 1, 0) * 2**b for b in range(num_bits)]) <= n)
+            S.add(And(
+                exactly_one([y[k][j][i] for k in range(m) for j in range(n+1)], name = f"delivery_to_{i}"),
+                exactly_one([y[k][i][j] for k in range(m) for j in range(n+1)], name = f"delivery_from_{i}")
+            ))
+
+        # Start and end at depot
+        depot = n
+        for k in range(m):
+            S.add(
+                exactly_one([y[k][depot][i] for i in range(n)], name = f"from_depot_{k}")
+            )
+            S.add(
+                exactly_one([y[k][i][depot] for i in range(n)], name = f"to_depot_{k}")
+            )
+
+        # Can't stay in the same node
+        for k in range(m):
+            for i in range(n+1):
+                S.add(Not(y[k][i][i]))
+
+        # Flow conservation
+        for k in range(m):
+            for i in range(n):
+                bool_vars_from = [y[k][j][i] for j in range(n+1)]
+                bool_vars_to = [y[k][i][j] for j in range(n+1)]
+                # the arcs into and out of the item are unique, so it is enough that the same courier owns both (an
+                # encoding under an implication would not do: its auxiliary variables can falsify the premise)
+                S.add(Or(bool_vars_from) == Or(bool_vars_to))
             
+        ''' ADD SUB-TOUR ELIMINATION CONSTRAINT with boolean encoding '''
+        # MTZ constraints with boolean encoding: the position strictly increases along every arc between items.
+        # The arcs are shared by the couriers, every item being in a single route, and the positions are compared
+        # bit by bit, so that the model stays propositional
+        for i in range(n):
             for j in range(n):
                 if i != j:
-                    #S.add(Implies(y[k][i][j], lex_lesseq([u[k][i][b] for b in range(num_bits)], [u[k][j][b] for b in range(num_bits)])))
-                    bool_vars_i = [If(u[i][b], 2**b, 0) for b in range(num_bits)]
-                    bool_vars_j = [If(u[j][b], 2**b, 0) for b in range(num_bits)]
-                    S.add(Implies(y[k][i][j], Sum(bool_vars_i) <= Sum(bool_vars_j)))
+                    S.add([Implies(y[k][i][j], x[i][j]) for k in range(m)])
+                    S.add(Implies(x[i][j], lex_less(u[i], u[j], name = f"u_{i}_{j}")))
     
     print("Total umber of assertions in the model: ", len(S.assertions()))
     end_time = time.time()
@@ -92,14 +160,16 @@ def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
     print("-"*30, "\n")
         
     ''' SOLVE AND PRINT SOLUTION '''
-    timeout=300000 #timeout of 5 minutes = 300 seconds = 300000 milliseconds
+    timeout=time_limit*1000 #timeout in milliseconds, 5 minutes by default
     remaining_time=timeout
 
     print("\nSOLVING WITH", str.upper(solver), "SOLVER,", "using", enc, "encoding\n")
     if solver!="cdcl":
-        S.set(local_search=True, local_search_mode=solver, local_search_threads=12) # wsat and qsat are both variants of local search
+        S.set(local_search=True, local_search_mode=solver, local_search_threads=threads) # wsat and qsat are both variants of local search
     else:
-        S.set(threads=12)
+        S.set(threads=threads)
+    if search != "block":
+        return solve_by_bounds(S, y, m, n, l, s, D, time_limit, trace, lower_bound, linear=(search == "linear"))
     #initialization
     total_tries = 0
     start_time = time.time()
@@ -107,19 +177,23 @@ def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
     num_bad_tries = 0
     elapsed_time = 0
     best_sol = sys.maxsize
+    opt_sol_vect = None
     is_timeout = False
     is_sat = False
     is_optimal = False
     full_exploration = False
     S.push()
+    y_names = z3_names(y)
     # run untill we reach time limit  
-    while elapsed_time<300:
+    while elapsed_time<time_limit:
         remaining_time=(timeout/1000)-elapsed_time 
         S.set("timeout", int(remaining_time)*1000)
             
         ''' CHECK SOLVER '''
         print("we are checking the solver...")
-        if S.check() == sat:
+        with phase("search"):
+            result = S.check()
+        if result == sat:
             print('sat')
             end_time = time.time()
             is_sat = True # if any solution has been found
@@ -132,62 +206,8 @@ def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
             model = S.model()
             total_tries += 1
             
-            ''' EXTRACT SOLUTION '''
-                        
-            # Initialize the y_matrix
-            y_matrix = [[[False for _ in range(n+1)] for _ in range(n+1)] for _ in range(m)]
-
-            # Extract y values from the model
-            for k in range(m):
-                for i in range(n+1):
-                    for j in range(n+1):
-                        if model[y[k][i][j]]:
-                            y_matrix[k][i][j] = True
-            
-            input("press enter to continue")  
-            print("y: ", y_matrix)
-            input("press enter to continue")
-            
-            y_is_wrong = False
-
-            # convert y_matrix to a list of routes for each courier, compute distances in the meantime
-            routes = []
-            distances = []
-            for k in range(m):
-                route = []
-                distance = 0
-                current = depot
-                max_iterations = n + 1  # Maximum possible number of nodes to visit
-                for _ in range(max_iterations):
-                    next_node = next((j for j in range(n+1) if y_matrix[k][current][j]), None)
-                    if next_node is None:
-                        print("y is wrong!!!")
-                        y_is_wrong = True
-                        break
-                    if next_node == depot:
-                        distance += D[current][depot]
-                        break
-                    else:
-                        distance += D[current][next_node]
-                        route.append(next_node)  # Keep 0-indexing, adjust later if needed
-                        current = next_node
-                
-                routes.append(route)
-                distances.append(distance)
-            
-            ''' CHECK THE CORRECTNESS OF THE SOLUTION '''
-            # check the length of the total route
-            tot_length = sum([len(route) for route in routes])
-            if tot_length < n:
-                print("y is wrong!!!")
-                y_is_wrong = True
-
-            # Adjust node indexing
-            routes = [[node + 1 for node in route] for route in routes]
-
-            solution = routes                
-            print("distances: ", distances)
-            print("solution: ", solution)
+            with phase("decode"):
+                solution, distances, y_is_wrong, arcs = extract_solution(model, y_names, m, n, l, s, D)
 
             ''' CHECK OPTIMAL SOLUTION '''
             max_distance = max(distances)
@@ -197,28 +217,41 @@ def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
                 best_sol = max_distance
                 opt_sol_vect = solution
                 num_bad_tries = 0
+                trace.incumbent(best_sol)
+                if best_sol <= lower_bound:
+                    print("ending search: the lower bound", lower_bound, "has been reached. total tries = ", total_tries)
+                    is_optimal = True
+                    trace.optimal()
+                    break
             else: #"bad try" case
                 num_bad_tries += 1
                 
             if num_bad_tries >= max_bad_tries:
                 print("ending search: no improvement in", max_bad_tries, "tries. total tries = ", total_tries, " best = ", best_sol)
-                is_optimal = True # assuming this means it's optimal
+                is_optimal = False # no improvement is not a proof, only reaching the lower bound is
                 break
 
             # Add constraint to avoid the current solution --> if all the assignment are the same, then the order of deliveries must change 
-            block_solution = Or([y[k][i][j] != model[y[k][i][j]] for i in range(n+1) for j in range(n+1) for k in range(m)])
+            block_solution = Or([y[k][i][j] != bool(arcs[k, i, j]) for i in range(n+1) for j in range(n+1) for k in range(m)])
 
             S.add(block_solution)
         
             print(f"tries: {num_bad_tries}/{max_bad_tries}. best = {best_sol}", end = "")
             print("\r", end = "")
                 
+        elif result == unknown: # the time limit has been reached: the incumbent (if any) is kept, not proven
+            print("timeout. total tries = ", total_tries, "best = ", best_sol)
+            elapsed_time = time.time() - start_time
+            is_timeout = True
+            is_optimal = False
+            break
         else:
             print('unsat')
             if is_sat: # if all solutions have been explored, the best one is surely optimal
                 print("premature exit (all solutions explored). total tries = ", total_tries, "best = ", best_sol)
                 full_exploration=True
                 is_optimal=True
+                trace.optimal()
                 break
             if not is_sat: # if no solution has been found in the time limit, the output is empty
                 print("timeout")
@@ -230,6 +263,10 @@ def solve_mcp(m, n, l, s, D, num_bits, enc, solver):
                 is_optimal = False
                 break
     
+    solver_statistics("z3", S.statistics())
+    if opt_sol_vect is None: # no valid solution has been found
+        best_sol = None
+        is_optimal = False
     result = {
         "time": math.ceil(elapsed_time),
         "optimal": is_optimal,
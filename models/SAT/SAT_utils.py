@@ -1,7 +1,11 @@
 from itertools import combinations
 import json 
 from z3 import *
-import re 
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instance_loader import load_instance
 
 ################ ENCODINGS #################
 
@@ -97,29 +101,56 @@ def at_most_one_he(bool_vars, name = ""):
 def exactly_one_he(bool_vars, name = ""):
     return And(at_most_one_he(bool_vars, name), at_least_one_he(bool_vars))
 
+
+# lexicographic order on lists of bits, most significant first
+def lex_less(a, b, name):
+    constraints = []
+    q = [True] + [Bool(f"q_{name}_{t}") for t in range(1, len(a))] # q[t] iff the first t bits of a and b are equal
+    for t in range(len(a)):
+        constraints.append(Or(Not(q[t]), Not(a[t]), b[t]))
+        if t < len(a) - 1:
+            constraints.append(Or(Not(q[t]), Not(a[t]), q[t+1]))
+            constraints.append(Or(Not(q[t]), b[t], q[t+1]))
+    # a and b can't be equal on all the bits
+    constraints.append(Or(Not(q[-1]), Not(a[-1])))
+    constraints.append(Or(Not(q[-1]), b[-1]))
+    return And(constraints)
+
+################ OBJECTIVE SEARCH #################
+
+def objective_search(solve, lower_bound, trace, linear=False):
+    '''
+    minimize the objective through a sequence of bounded calls on the same incremental solver:
+    solve(bound) looks for a solution of objective <= bound (any solution if bound is None) and returns
+    (status, obj, sol), with status True if found, False if proven infeasible, None at the time limit.
+    The bound of the next call is the middle of [lower bound, incumbent - 1] (binary search) or the top of
+    it (linear search), the incumbent is optimal once that interval is empty.
+    returns (obj, sol, optimal) of the best solution found
+    '''
+    best_obj, best_sol = None, None
+    low, high = lower_bound, None
+    while high is None or low <= high:
+        bound = None if high is None else (high if linear else (low + high) // 2)
+        status, obj, sol = solve(bound)
+        if status is None:
+            return best_obj, best_sol, False
+        if status:
+            best_obj, best_sol, high = obj, sol, obj - 1
+            trace.incumbent(obj)
+            print("solution of max distance", obj, "searching in [", low, ",", high, "]")
+        elif bound is None:
+            return None, None, False # infeasible instance
+        else:
+            low = bound + 1
+            trace.bound(low)
+            print("no solution within", bound, "searching in [", low, ",", high, "]")
+    trace.optimal()
+    return best_obj, best_sol, True
+
 ###########################################
 
 # read instance files 
 def parse_dzn_file(filename):
-    with open(filename, 'r') as file:
-        content = file.read()
-    
-    # Extracting m and n
-    m = int(re.search(r'm = (\d+);', content).group(1))
-    n = int(re.search(r'n = (\d+);', content).group(1))
-    num_bits = math.floor(math.log2(n)) # for bitwise encoding only
-    
-    # Extracting l
-    l = list(map(int, re.search(r'l = \[(.+?)\];', content).group(1).split(',')))
-    
-    # Extracting s
-    s = list(map(int, re.search(r's = \[(.+?)\];', content).group(1).split(',')))
-    
-    # Extracting D
-    D_match = re.search(r'D = \[\|(.+?)\|\];', content, re.DOTALL).group(1)
-    D_lines = D_match.strip().split('\n')
-    D = [list(map(int, re.split(r'\s*,\s*', line.strip().strip('|').strip()))) for line in D_lines]
-    
+    m, n, l, s, D = load_instance(filename).as_lists()
+    num_bits = max(1, (n - 1).bit_length()) # bits of the position of an item in its route, enough to count n items
     return m, n, l, s, D, num_bits 
-
-         
\ No newline at end of file
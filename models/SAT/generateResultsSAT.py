@@ -1,7 +1,32 @@
 from SAT_utils import *
 from SAT_model import *
+from SAT_cnf import solve_mcp_cnf
+from tracing import Trace, open_trace
+from bounds import lower_bound
+from solutions import validate_result
+from profiling import phase
 import os
 
+def solve_instance(approach_name, instance_path, time_limit=300, threads=12, trace=None):
+    # run a single approach on a single instance and build its json entry
+    with phase("parse"):
+        m, n, l, s, D, num_bits = parse_dzn_file(instance_path)
+    approach_config = approaches[approach_name]
+    trace = trace or Trace()
+    with phase("presolve"):
+        bound = lower_bound(m, n, l, s, D)
+    trace.bound(bound)
+    if approach_config.get('backend') == 'cnf':
+        result = solve_mcp_cnf(m, n, l, s, D, approach_config['encoding'], approach_config['solver'],
+                               time_limit=time_limit, trace=trace, lower_bound=bound,
+                               search=approach_config.get('search', 'binary'))
+    else:
+        result = solve_mcp(m, n, l, s, D, num_bits, approach_config['encoding'], approach_config['solver'],
+                           time_limit=time_limit, threads=threads, trace=trace, lower_bound=bound,
+                           search=approach_config.get('search', 'block'))
+    with phase("decode"):
+        return validate_result(result, l, s, D)
+
 def main(input_folder: str, output_folder: str, approaches: dict, folder = "SAT"):
     output_approach_folder = os.path.join(output_folder, folder)
     os.makedirs(output_approach_folder, exist_ok=True)
@@ -9,20 +34,18 @@ def main(input_folder: str, output_folder: str, approaches: dict, folder = "SAT"
     for file_name in os.listdir(input_folder):
         if file_name.endswith(".dzn"):
             file_path = os.path.join(input_folder, file_name)
-            m, n, l, s, D, num_bits = parse_dzn_file(file_path)
+            instance_number = os.path.splitext(file_name)[0].split("inst")[-1]
 
             results = {}
             
-            for approach_name, approach_config in approaches.items():
-                encoding = approach_config['encoding']
-                solver = approach_config['solver']
-                
+            for approach_name in approaches:
                 # Solve using solve_mcp
-                result_mcp = solve_mcp(m, n, l, s, D, num_bits, encoding, solver)
+                trace = open_trace(folder, instance_number, approach_name)
+                result_mcp = solve_instance(approach_name, file_path, trace=trace)
+                trace.close()
                 if result_mcp:
                     results[approach_name] = result_mcp
             
-            instance_number = os.path.splitext(file_name)[0].split("inst")[-1]
             output_file_name = f"{instance_number}.json"
             output_file_path = os.path.join(output_approach_folder, output_file_name)
             
@@ -34,17 +57,24 @@ def main(input_folder: str, output_folder: str, approaches: dict, folder = "SAT"
 input_folder = r"./models/CP/InstancesDZN"  # Replace with the path to your input folder containing .dzn files
 output_folder = r"./res"  # Replace with the path to your output folder for saving .json files
 
-# set parameters for the model  
+# set parameters for the model: the search is "block" (exclude every solution found, the only option of local
+# search, which cannot prove a bound infeasible), "binary" or "linear" (bounded calls on the max distance)
 encodings = ["sequential" ,"heule", "bitwise"]
 solvers = [ "cdcl", "wsat"] 
 approaches = {
-    "cdcl_seq":{'encoding': 'sequential', 'solver': 'cdcl'},
-    "cdcl_he":{'encoding':'heule', 'solver':'cdcl'},
-    "cdcl_bin":{'encoding':'bitwise', 'solver':'cdcl'}, 
+    "cdcl_seq":{'encoding': 'sequential', 'solver': 'cdcl', 'search': 'binary'},
+    "cdcl_he":{'encoding':'heule', 'solver':'cdcl', 'search': 'binary'},
+    "cdcl_bin":{'encoding':'bitwise', 'solver':'cdcl', 'search': 'binary'}, 
     "wsat_seq":{'encoding': 'sequential', 'solver': 'wsat'},
     "wsat_he":{'encoding':'heule', 'solver':'wsta'}, 
-    "wsat_bin":{'encoding':'bitwise', 'solver':'wsat'}
+    "wsat_bin":{'encoding':'bitwise', 'solver':'wsat'},
+    # direct cnf generation, solved by a pysat solver
+    "cnf_seq":{'encoding': 'sequential', 'solver': 'glucose42', 'backend': 'cnf', 'search': 'binary'},
+    "cnf_he":{'encoding':'heule', 'solver':'glucose42', 'backend': 'cnf', 'search': 'binary'},
+    "cnf_bin":{'encoding':'bitwise', 'solver':'glucose42', 'backend': 'cnf', 'search': 'binary'},
+    "cnf_seq_linear":{'encoding': 'sequential', 'solver': 'glucose42', 'backend': 'cnf', 'search': 'linear'}
     }
     
-# Run the main function
-main(input_folder, output_folder, approaches=approaches, folder = "SAT")
\ No newline at end of file
+if __name__ == "__main__":
+    # Run the main function
+    main(input_folder, output_folder, approaches=approaches, folder = "SAT")
\ No newline at end of file
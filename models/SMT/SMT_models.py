@@ -5,101 +5,107 @@ import os
 import time
 from typing import List, Dict, Any
 import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tracing import Trace
+from solutions import follow, route_distances, z3_array_values, z3_names, z3_values
+from profiling import phase, solver_statistics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def solve_mcp_sym_subtour_elim(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000) -> Dict[str, Any]:
-    optimizer = Optimize()
-    optimizer.set("timeout", timeout)
-
-    x, y, u, distances, max_distance = define_variables(m, n)
-    D_func = define_distance_function(optimizer, n, D)
-
-    add_x_constraints(optimizer, m, n, x, l, s)
-    add_y_constraints(optimizer, m, n, x, y)
-    add_distance_constraints(optimizer, m, n, y, distances, max_distance, D_func)
-    add_symmetry_breaking_constraints(optimizer, m, n, l, x)
-    add_subtour_elimination_constraints(optimizer, m, n, x, y, u)
-
-    optimizer.minimize(Select(max_distance, 0))
-
-    start_time = time.time()
-    if optimizer.check() == sat:
-        end_time = time.time()
-        runtime = int(end_time - start_time)
-        runtime = min(runtime, 300)  # Ensure runtime does not exceed 300
-        optimal = runtime < 300  # If runtime is less than 300, it's optimal
-        solution = extract_solution(optimizer.model(), m, n, x, y, distances, max_distance)
-        solution.update({"time": runtime, "optimal": optimal})
-        return solution
-    else:
-        end_time = time.time()
-        runtime = int(end_time - start_time)
-        runtime = min(runtime, 300)  # Ensure runtime does not exceed 300
-        return {"time": 300, "optimal": False, "obj": False, "sol": False}
-    
-def solve_mcp_no_sym(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000) -> Dict[str, Any]:
-    optimizer = Optimize()
-    optimizer.set("timeout", timeout)
-
-    x, y, u, distances, max_distance = define_variables(m, n)
-    D_func = define_distance_function(optimizer, n, D)
+def solve_mcp_sym_subtour_elim(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return ArrayModel(m, n, l, s, D, lower_bound).solve(timeout, trace, symmetry_breaking=True, subtour_elimination=True)
+
+def solve_mcp_no_sym(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return ArrayModel(m, n, l, s, D, lower_bound).solve(timeout, trace)
+
+def solve_mcp_sym(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return ArrayModel(m, n, l, s, D, lower_bound).solve(timeout, trace, symmetry_breaking=True)
+
+class ArrayModel:
+    '''
+    Shared core of the array variants (variables, D_func, x/y/distance constraints and the lower bound), built once
+    per instance. Every call to solve layers the optional constraint groups of a variant in its own push/pop scope,
+    so that several variants can be solved in sequence on the same optimizer, each one starting from the best
+    objective found so far as a strict upper bound. A variant which finds nothing better reports the inherited
+    solution, with the variant which found it (found_by) and when (found_time, seconds since the build started).
+    '''
+    def __init__(self, m: int, n: int, l: List[int], s: List[int], D: List[List[int]], lower_bound: int = 0):
+        start_time = time.time()
+        self.m, self.n, self.l = m, n, l
+        with phase("build"):
+            self.optimizer = Optimize()
+            self.x, self.y, self.u, self.distances, self.max_distance = define_variables(m, n)
+            D_func = define_distance_function(self.optimizer, n, D)
+
+            add_x_constraints(self.optimizer, m, n, self.x, l, s)
+            add_y_constraints(self.optimizer, m, n, self.x, self.y)
+            add_distance_constraints(self.optimizer, m, n, self.y, self.distances, self.max_distance, D_func)
+            self.optimizer.add(Select(self.max_distance, 0) >= lower_bound) # valid lower bound, the search stops when reaching it
+        self.lower_bound = lower_bound
+        self.best = None # best solution of the variants solved so far
+        self.best_by, self.best_time = None, None # variant which found it and when
+        self.build_time = time.time() - start_time
+        self.elapsed = self.build_time # build and solve time of the variants so far
+        logger.info(f"array model built in {self.build_time:.2f} s")
+
+    def solve(self, timeout: int = 300000, trace: Trace = None, symmetry_breaking: bool = False,
+              subtour_elimination: bool = False, name: str = None) -> Dict[str, Any]:
+        trace = trace or Trace()
+        optimizer, m, n, x, y = self.optimizer, self.m, self.n, self.x, self.y
+        start_time = time.time()
+        optimizer.push()
+        optimizer.set("timeout", timeout)
+        with phase("build"):
+            if symmetry_breaking:
+                add_symmetry_breaking_constraints(optimizer, m, n, self.l, x)
+            if subtour_elimination:
+                add_subtour_elimination_constraints(optimizer, m, n, x, y, self.u)
+        if self.best is not None:
+            trace.incumbent(self.best["obj"])
+            optimizer.add(Select(self.max_distance, 0) < self.best["obj"])
+
+        objective = Select(self.max_distance, 0)
+        optimizer.minimize(objective)
+        # keep the last improving model, the only one available when the time limit interrupts the search
+        incumbent = {}
+        def on_model(model):
+            incumbent["model"], incumbent["time"] = model, time.time()
+            trace.incumbent(model.eval(objective, model_completion=True).as_long())
+        optimizer.set_on_model(on_model)
+
+        with phase("search"):
+            result = optimizer.check()
+        solver_statistics("z3", optimizer.statistics())
+        if result == sat:
+            incumbent["model"], incumbent["time"] = optimizer.model(), incumbent.get("time", time.time())
+        solution = None
+        if "model" in incumbent:
+            with phase("decode"):
+                solution = extract_solution(incumbent["model"], m, n, x, y, self.distances, self.max_distance)
+            self.best = solution
+            self.best_by, self.best_time = name, self.elapsed + incumbent["time"] - start_time
+        optimizer.pop()
+
+        self.solve_time = time.time() - start_time
+        self.elapsed += self.solve_time
+        logger.info(f"solved in {self.solve_time:.2f} s after a build of {self.build_time:.2f} s")
+        # sat is the proven optimum, unsat proves the upper bound carried over from the previous variants
+        optimal = result != unknown
+        runtime = min(int(self.solve_time + self.build_time), timeout // 1000) if optimal else timeout // 1000
+        if self.best is None:
+            return {"time": runtime, "optimal": optimal, "obj": None, "sol": None}
+        if optimal:
+            trace.optimal()
+        if solution is None:
+            logger.info(f"no better solution, reporting the one found by {self.best_by} at {self.best_time:.2f} s")
+            return {**self.best, "time": runtime, "optimal": optimal, "found_by": self.best_by,
+                    "found_time": int(self.best_time)}
+        return {**self.best, "time": runtime, "optimal": optimal}
 
-    add_x_constraints(optimizer, m, n, x, l, s)
-    add_y_constraints(optimizer, m, n, x, y)
-    add_distance_constraints(optimizer, m, n, y, distances, max_distance, D_func)
-    # add_symmetry_breaking_constraints(optimizer, m, n, l, x)
-    # add_subtour_elimination_constraints(optimizer, m, n, x, y, u)
-
-    optimizer.minimize(Select(max_distance, 0))
-
-    start_time = time.time()
-    if optimizer.check() == sat:
-        end_time = time.time()
-        runtime = int(end_time - start_time)
-        runtime = min(runtime, 300)  # Ensure runtime does not exceed 300
-        optimal = runtime < 300  # If runtime is less than 300, it's optimal
-        solution = extract_solution(optimizer.model(), m, n, x, y, distances, max_distance)
-        solution.update({"time": runtime, "optimal": optimal})
-        return solution
-    else:
-        end_time = time.time()
-        runtime = int(end_time - start_time)
-        runtime = min(runtime, 300)  # Ensure runtime does not exceed 300
-        return {"time": 300, "optimal": False, "obj": False, "sol": False}
-        
-def solve_mcp_sym(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000) -> Dict[str, Any]:
-    optimizer = Optimize()
-    optimizer.set("timeout", timeout)
-
-    x, y, u, distances, max_distance = define_variables(m, n)
-    D_func = define_distance_function(optimizer, n, D)
-
-    add_x_constraints(optimizer, m, n, x, l, s)
-    add_y_constraints(optimizer, m, n, x, y)
-    add_distance_constraints(optimizer, m, n, y, distances, max_distance, D_func)
-    add_symmetry_breaking_constraints(optimizer, m, n, l, x)
-    # add_subtour_elimination_constraints(optimizer, m, n, x, y, u)
-
-    optimizer.minimize(Select(max_distance, 0))
-
-    start_time = time.time()
-    if optimizer.check() == sat:
-        end_time = time.time()
-        runtime = int(end_time - start_time)
-        runtime = min(runtime, 300)  # Ensure runtime does not exceed 300
-        optimal = runtime < 300  # If runtime is less than 300, it's optimal
-        solution = extract_solution(optimizer.model(), m, n, x, y, distances, max_distance)
-        solution.update({"time": runtime, "optimal": optimal})
-        return solution
-    else:
-        end_time = time.time()
-        runtime = int(end_time - start_time)
-        runtime = min(runtime, 300)  # Ensure runtime does not exceed 300
-        return {"time": 300, "optimal": False, "obj": False, "sol": False}
-        
 '''
 def solve_mcp_dfs(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000) -> Dict[str, Any]:
     optimizer = Optimize()
@@ -220,6 +226,300 @@ def solve_mcp_bfs(m: int, n: int, l: List[int], s: List[int], D: List[List[int]]
     return {"time": runtime, "optimal": False, "obj": -1, "sol": [[] for _ in range(m)]}
 '''
 
+def solve_mcp_flat(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return solve_flat(m, n, l, s, D, timeout, trace, lower_bound, symmetry_breaking=False)
+
+def solve_mcp_flat_sym(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return solve_flat(m, n, l, s, D, timeout, trace, lower_bound, symmetry_breaking=True)
+
+def solve_mcp_bv(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return solve_flat(m, n, l, s, D, timeout, trace, lower_bound, symmetry_breaking=False, bitvector=True)
+
+def solve_mcp_bv_sym(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    return solve_flat(m, n, l, s, D, timeout, trace, lower_bound, symmetry_breaking=True, bitvector=True)
+
+'''
+Flat formulation: only Int and Bool variables with explicit domains, no arrays and no uninterpreted function.
+
+The routes form a single circuit (giant tour) over the items 0..n-1 and one depot node n+k per courier k: succ[v]
+is the node following v, courier k starts at n+k and its route ends where the circuit reaches n+k+1 (mod m).
+The length of the arc leaving every node is an Int cost[v], tied to succ[v] by an If chain over the row of D of
+v, so that the distance lookup costs (n+m)^2 terms overall instead of a congruence over the (n+1)^2 axioms of
+D_func. Subtours are eliminated by the position pos[v] of every node along the circuit.
+'''
+
+def define_flat_variables(m: int, n: int) -> tuple:
+    nodes = n + m
+    succ = [Int(f'succ_{v}') for v in range(nodes)]
+    courier = [Int(f'courier_{v}') for v in range(nodes)]
+    pos = [Int(f'pos_{v}') for v in range(nodes)]
+    cost = [Int(f'cost_{v}') for v in range(nodes)]
+    distances = [Int(f'distance_{k}') for k in range(m)]
+    max_distance = Int('max_distance')
+    return succ, courier, pos, cost, distances, max_distance
+
+def add_flat_constraints(solver: Solver, m: int, n: int, l: List[int], s: List[int], D: List[List[int]], succ: List[ArithRef],
+                         courier: List[ArithRef], pos: List[ArithRef], cost: List[ArithRef], distances: List[ArithRef], max_distance: ArithRef):
+    nodes = n + m
+    location = lambda v: min(v, n) # row/column of D of a node, all the depot nodes are the origin
+
+    for v in range(nodes):
+        solver.add(And(succ[v] >= 0, succ[v] < nodes, succ[v] != v)) # domains
+        solver.add(And(pos[v] >= 0, pos[v] < nodes))
+    for k in range(m):
+        solver.add(courier[n+k] == k)
+        solver.add(succ[n+k] < n) # min delivery: every courier leaves the depot towards an item
+    for i in range(n):
+        solver.add(And(courier[i] >= 0, courier[i] < m))
+    solver.add(Distinct(succ))
+
+    # circuit: positions follow the successors from the depot node of courier 0
+    solver.add(pos[n] == 0)
+    for v in range(nodes):
+        for w in range(nodes):
+            if v != w and w != n:
+                solver.add(Implies(succ[v] == w, pos[w] == pos[v] + 1))
+            # an item keeps the courier of its predecessor, the route of courier k ends at the depot node n+k+1
+            if v != w and w < n:
+                solver.add(Implies(succ[v] == w, courier[w] == courier[v]))
+            if v < n and w >= n:
+                solver.add(Implies(succ[v] == w, courier[v] == (w - n - 1) % m))
+
+    # cost of the arc leaving every node, one If per column of its row of D
+    for v in range(nodes):
+        row = D[location(v)]
+        lookup = row[location(nodes - 1)]
+        for w in reversed(range(nodes - 1)):
+            lookup = If(succ[v] == w, row[location(w)], lookup)
+        solver.add(cost[v] == lookup)
+
+    for k in range(m):
+        solver.add(Sum([If(courier[i] == k, s[i], 0) for i in range(n)]) <= l[k]) # capacity
+        solver.add(distances[k] == cost[n+k] + Sum([If(courier[i] == k, cost[i], 0) for i in range(n)]))
+        solver.add(max_distance >= distances[k])
+
+def add_flat_symmetry_breaking_constraints(solver: Solver, m: int, n: int, l: List[int], succ: List[ArithRef]):
+    # couriers with the same capacity are interchangeable: order them by their first item
+    for k1 in range(m-1):
+        for k2 in range(k1 + 1, m):
+            if l[k1] == l[k2]:
+                solver.add(succ[n+k1] < succ[n+k2])
+
+'''
+Bit-vector (QF_BV) version of the flat formulation, same variables and constraints with unsigned bit-vectors whose
+widths are derived from the instance, so that z3 bit-blasts the whole model to its SAT core:
+
+    nodes       succ, pos       n+m nodes and positions, pos[v] + 1 <= n+m never wraps around
+    couriers    courier         0..m-1
+    loads       capacity sums   the total size of the items and the largest capacity
+    lengths     cost, distance  the sum over the rows of D of their maximum, an upper bound on any route
+'''
+
+def width(value: int) -> int:
+    return max(1, int(value).bit_length())
+
+def define_bv_variables(m: int, n: int, l: List[int], s: List[int], D: List[List[int]]) -> tuple:
+    nodes = n + m
+    node_bits, courier_bits = width(nodes), width(m)
+    length_bits = width(sum(max(row) for row in D))
+    succ = [BitVec(f'succ_{v}', node_bits) for v in range(nodes)]
+    courier = [BitVec(f'courier_{v}', courier_bits) for v in range(nodes)]
+    pos = [BitVec(f'pos_{v}', node_bits) for v in range(nodes)]
+    cost = [BitVec(f'cost_{v}', length_bits) for v in range(nodes)]
+    distances = [BitVec(f'distance_{k}', length_bits) for k in range(m)]
+    max_distance = BitVec('max_distance', length_bits)
+    return succ, courier, pos, cost, distances, max_distance
+
+def add_bv_constraints(solver: Solver, m: int, n: int, l: List[int], s: List[int], D: List[List[int]], succ: List[BitVecRef],
+                       courier: List[BitVecRef], pos: List[BitVecRef], cost: List[BitVecRef], distances: List[BitVecRef], max_distance: BitVecRef):
+    nodes = n + m
+    location = lambda v: min(v, n) # row/column of D of a node, all the depot nodes are the origin
+    length_bits = max_distance.size()
+    load_bits = width(max(sum(s), max(l)))
+
+    for v in range(nodes):
+        solver.add(And(ULT(succ[v], nodes), succ[v] != v)) # domains
+        solver.add(ULT(pos[v], nodes))
+    for k in range(m):
+        solver.add(courier[n+k] == k)
+        solver.add(ULT(succ[n+k], n)) # min delivery: every courier leaves the depot towards an item
+    for i in range(n):
+        solver.add(ULT(courier[i], m))
+    solver.add(Distinct(succ))
+
+    # circuit: positions follow the successors from the depot node of courier 0
+    solver.add(pos[n] == 0)
+    for v in range(nodes):
+        for w in range(nodes):
+            if v != w and w != n:
+                solver.add(Implies(succ[v] == w, pos[w] == pos[v] + 1))
+            # an item keeps the courier of its predecessor, the route of courier k ends at the depot node n+k+1
+            if v != w and w < n:
+                solver.add(Implies(succ[v] == w, courier[w] == courier[v]))
+            if v < n and w >= n:
+                solver.add(Implies(succ[v] == w, courier[v] == (w - n - 1) % m))
+
+    # cost of the arc leaving every node, one If per column of its row of D
+    for v in range(nodes):
+        row = D[location(v)]
+        lookup = BitVecVal(row[location(nodes - 1)], length_bits)
+        for w in reversed(range(nodes - 1)):
+            lookup = If(succ[v] == w, BitVecVal(row[location(w)], length_bits), lookup)
+        solver.add(cost[v] == lookup)
+
+    zero_load, zero_length = BitVecVal(0, load_bits), BitVecVal(0, length_bits)
+    for k in range(m):
+        load = Sum([If(courier[i] == k, BitVecVal(s[i], load_bits), zero_load) for i in range(n)])
+        solver.add(ULE(load, l[k])) # capacity
+        solver.add(distances[k] == cost[n+k] + Sum([If(courier[i] == k, cost[i], zero_length) for i in range(n)]))
+        solver.add(UGE(max_distance, distances[k]))
+
+def add_bv_symmetry_breaking_constraints(solver: Solver, m: int, n: int, l: List[int], succ: List[BitVecRef]):
+    # couriers with the same capacity are interchangeable: order them by their first item
+    for k1 in range(m-1):
+        for k2 in range(k1 + 1, m):
+            if l[k1] == l[k2]:
+                solver.add(ULT(succ[n+k1], succ[n+k2]))
+
+def extract_flat_solution(model: ModelRef, m: int, n: int, succ: List[ArithRef], max_distance: ArithRef) -> Dict[str, Any]:
+    following = z3_values(model, z3_names(succ))
+    sol = [[i + 1 for i in follow(following, n+k, n)] for k in range(m)]  # 1-based items
+    return {"time": -1, "optimal": True, "obj": model.evaluate(max_distance).as_long(), "sol": sol}
+
+def solve_flat(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], timeout: int = 300000, trace: Trace = None,
+               lower_bound: int = 0, symmetry_breaking: bool = False, bitvector: bool = False) -> Dict[str, Any]:
+    trace = trace or Trace()
+    start_time = time.time()
+    with phase("build"):
+        if bitvector:
+            solver = SolverFor("QF_BV")
+            succ, courier, pos, cost, distances, max_distance = define_bv_variables(m, n, l, s, D)
+            add_bv_constraints(solver, m, n, l, s, D, succ, courier, pos, cost, distances, max_distance)
+            if symmetry_breaking:
+                add_bv_symmetry_breaking_constraints(solver, m, n, l, succ)
+            solver.add(UGE(max_distance, lower_bound)) # valid lower bound, the search stops when reaching it
+            below = lambda obj: ULT(max_distance, obj)
+        else:
+            solver = Solver()
+            succ, courier, pos, cost, distances, max_distance = define_flat_variables(m, n)
+            add_flat_constraints(solver, m, n, l, s, D, succ, courier, pos, cost, distances, max_distance)
+            if symmetry_breaking:
+                add_flat_symmetry_breaking_constraints(solver, m, n, l, succ)
+            solver.add(max_distance >= lower_bound) # valid lower bound, the search stops when reaching it
+            below = lambda obj: max_distance < obj
+    logger.info(f"flat model built in {time.time() - start_time:.2f} s")
+
+    # descending search on the objective: z3 Optimize stalls on this model before its first model, while every
+    # bound is a plain incremental check which keeps the lemmas learnt so far
+    solution = None
+    result = sat
+    while result == sat:
+        remaining = timeout - int((time.time() - start_time) * 1000)
+        if remaining <= 0:
+            result = unknown
+            break
+        solver.set("timeout", remaining)
+        with phase("search"):
+            result = solver.check()
+        if result == sat:
+            with phase("decode"):
+                solution = extract_flat_solution(solver.model(), m, n, succ, max_distance)
+                # max_distance is only an upper bound on the routes, the longest one gives the next bound
+                solution["obj"] = int(route_distances(solution["sol"], D).max())
+            trace.incumbent(solution["obj"])
+            if solution["obj"] <= lower_bound: # reached the lower bound, nothing better exists
+                break
+            solver.add(below(solution["obj"]))
+
+    solver_statistics("z3", solver.statistics())
+    runtime = min(int(time.time() - start_time), timeout // 1000)
+    optimal = result != unknown
+    if optimal and solution is not None:
+        trace.optimal()
+    if solution is None:
+        return {"time": timeout // 1000 if not optimal else runtime, "optimal": optimal, "obj": None, "sol": None}
+    solution.update({"time": runtime if optimal else timeout // 1000, "optimal": optimal})
+    return solution
+
+'''
+SMT-LIB2 export: every variant is stated on a plain Solver and printed with its declarations and assertions, the
+bounds on the objective as extra assertions, and a get-value of the objective and of the terms which decode the
+routes (the positions y of the array model, the successors of the flat ones), so that any SMT-LIB2 solver can
+solve the file and report a solution.
+'''
+
+# exportable variants: name -> (formulation, symmetry breaking, subtour elimination)
+FORMULATIONS = {
+    "no_ysm": ("array", False, False),
+    "sym": ("array", True, False),
+    "sym_subtour_elim": ("array", True, True),
+    "flat": ("flat", False, False),
+    "flat_sym": ("flat", True, False),
+    "bv": ("bv", False, False),
+    "bv_sym": ("bv", True, False),
+}
+LOGICS = {"array": "QF_AUFLIA", "flat": "QF_LIA", "bv": "QF_BV"}
+
+def build_variant(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], variant: str) -> tuple:
+    '''
+    (solver, objective, terms, decode) of a variant: decode maps the values of terms to the 1-based routes
+    '''
+    formulation, symmetry_breaking, subtour_elimination = FORMULATIONS[variant]
+    solver = Solver()
+    if formulation == "array":
+        x, y, u, distances, max_distance = define_variables(m, n)
+        D_func = define_distance_function(solver, n, D)
+        add_x_constraints(solver, m, n, x, l, s)
+        add_y_constraints(solver, m, n, x, y)
+        add_distance_constraints(solver, m, n, y, distances, max_distance, D_func)
+        if symmetry_breaking:
+            add_symmetry_breaking_constraints(solver, m, n, l, x)
+        if subtour_elimination:
+            add_subtour_elimination_constraints(solver, m, n, x, y, u)
+        terms = [Select(y[k], t) for k in range(m) for t in range(1, n+1)]
+        decode = lambda values: [[i + 1 for i in values[k*n:(k+1)*n] if i < n] for k in range(m)]
+        return solver, Select(max_distance, 0), terms, decode
+
+    if formulation == "bv":
+        succ, courier, pos, cost, distances, max_distance = define_bv_variables(m, n, l, s, D)
+        add_bv_constraints(solver, m, n, l, s, D, succ, courier, pos, cost, distances, max_distance)
+        if symmetry_breaking:
+            add_bv_symmetry_breaking_constraints(solver, m, n, l, succ)
+    else:
+        succ, courier, pos, cost, distances, max_distance = define_flat_variables(m, n)
+        add_flat_constraints(solver, m, n, l, s, D, succ, courier, pos, cost, distances, max_distance)
+        if symmetry_breaking:
+            add_flat_symmetry_breaking_constraints(solver, m, n, l, succ)
+
+    def decode(following):
+        return [[i + 1 for i in follow(following, n+k, n)] for k in range(m)]
+    return solver, max_distance, succ, decode
+
+def bound_assertions(objective: ExprRef, lower: int = None, upper: int = None) -> List[BoolRef]:
+    bounds = []
+    if lower is not None:
+        bounds.append(UGE(objective, lower) if is_bv(objective) else objective >= lower)
+    if upper is not None:
+        bounds.append(ULE(objective, upper) if is_bv(objective) else objective <= upper)
+    return bounds
+
+def smtlib2_model(solver: Solver, logic: str) -> str:
+    return "\n".join(["(set-option :produce-models true)", f"(set-logic {logic})", solver.sexpr()])
+
+def smtlib2_query(objective: ExprRef, terms: List[ExprRef], lower: int = None, upper: int = None) -> str:
+    lines = [f"(assert {bound.sexpr()})" for bound in bound_assertions(objective, lower, upper)]
+    lines += ["(check-sat)", f"(get-value ({' '.join(term.sexpr() for term in [objective] + terms)}))", "(exit)", ""]
+    return "\n".join(lines)
+
+def to_smtlib2(solver: Solver, objective: ExprRef, terms: List[ExprRef], logic: str, lower: int = None, upper: int = None) -> str:
+    return smtlib2_model(solver, logic) + smtlib2_query(objective, terms, lower, upper)
+
+def export_smtlib2(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], variant: str, path: str,
+                   lower: int = None, upper: int = None):
+    solver, objective, terms, _ = build_variant(m, n, l, s, D, variant)
+    with open(path, "w") as f:
+        f.write(to_smtlib2(solver, objective, terms, LOGICS[FORMULATIONS[variant][0]], lower, upper))
+
 def define_variables(m: int, n: int) -> tuple:
     x = [Array(f'x_{k}', IntSort(), IntSort()) for k in range(m)]
     y = [Array(f'y_{k}', IntSort(), IntSort()) for k in range(m)]
@@ -306,18 +606,6 @@ def add_subtour_elimination_constraints(optimizer: Optimize, m: int, n: int, x:
         optimizer.add(Distinct([If(Select(x[k], i) > 0, Select(u[k], i), - i) for i in range(n+1)]))
 
 def extract_solution(model: ModelRef, m: int, n: int, x: List[ArrayRef], y: List[ArrayRef], distances: ArrayRef, max_distance: ArrayRef) -> Dict[str, Any]:
-    result = {
-        "time": -1,
-        "optimal": True,
-        "obj": int(model.evaluate(Select(max_distance, 0)).as_string()),
-        "sol": [], 
-            }
-    
-    for k in range(m):
-        delivery_sequence = []
-        for t in range(1, n+1):
-            delivery_point = model.evaluate(y[k][t]).as_long()
-            if delivery_point < n:  # Ignore depot which is represented as n
-                delivery_sequence.append(delivery_point + 1)  # Adjust index to 1-based
-        result["sol"].append(delivery_sequence)
-    return result
+    # the interpretation of every y[k] is read once instead of one evaluation per position, the depot is n
+    sol = [[point + 1 for point in z3_array_values(model, y[k], range(1, n+1)) if point < n] for k in range(m)]
+    return {"time": -1, "optimal": True, "obj": model.evaluate(Select(max_distance, 0)).as_long(), "sol": sol}
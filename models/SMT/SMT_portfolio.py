@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tracing import Trace
+from solutions import route_distances
+from instance_loader import load_instance
+from bounds import lower_bound
+from profiling import phase
+from SMT_models import FORMULATIONS, LOGICS, build_variant, smtlib2_model, smtlib2_query, export_smtlib2
+
+'''
+Portfolio of external SMT-LIB2 solvers bisecting the objective of one SMT variant.
+
+Every query is the exported model with the assertion max_distance <= b, solved by one of the solver binaries on
+PATH in its own subprocess. The open interval of the optimum is [lo, best): lo is the least bound not refuted yet
+(starting from the lower bound of models/bounds.py) and best the incumbent. A sat answer gives a solution of value
+<= b which becomes the incumbent, an unsat answer moves lo to b + 1, and the search stops as soon as lo reaches the
+incumbent. The workers always bisect the largest gap between lo, the bounds already being tried and best; queries
+made useless by an answer (b >= best or b < lo) are killed and their worker gets a new bound. When the interval
+has fewer integers than workers, the same bound is tried by different solvers.
+'''
+
+# SMT-LIB2 solvers raced by the portfolio (command, the file is the last argument), the ones not on PATH are skipped
+PORTFOLIO_SOLVERS = {
+    "z3": ["z3", "-smt2"],
+    "cvc5": ["cvc5", "--lang=smt2"],
+    "yices": ["yices-smt2"],
+}
+
+def available_solvers(solvers=PORTFOLIO_SOLVERS):
+    available = {name: command for name, command in solvers.items() if shutil.which(command[0])}
+    for name in solvers:
+        if name not in available:
+            print(f"Solver {name} not available, skipped")
+    return available
+
+############################# OUTPUT PARSING #############################
+
+def parse_sexpr(text: str):
+    tokens = re.findall(r'\(|\)|[^\s()]+', text)
+    stack = [[]]
+    for token in tokens:
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            closed = stack.pop()
+            stack[-1].append(closed)
+        else:
+            stack[-1].append(token)
+    return stack[0]
+
+def parse_value(value) -> int:
+    # 5, (- 5), #b0101, #x1f, (_ bv5 8)
+    if isinstance(value, list):
+        if value[0] == "-":
+            return -parse_value(value[1])
+        return int(value[1][2:]) # (_ bvN width)
+    if value.startswith("#b"):
+        return int(value[2:], 2)
+    if value.startswith("#x"):
+        return int(value[2:], 16)
+    return int(value)
+
+def parse_output(output: str):
+    '''
+    ("sat", values of the get-value terms), ("unsat", None) or ("unknown", None)
+    '''
+    parsed = parse_sexpr(output)
+    if not parsed or parsed[0] not in ("sat", "unsat"):
+        return "unknown", None
+    if parsed[0] == "unsat":
+        return "unsat", None
+    return "sat", [parse_value(pair[-1]) for pair in parsed[1]]
+
+############################# BISECTION #############################
+
+def next_bound(lo: int, best: int, running: List[int]) -> int:
+    '''
+    middle of the largest gap between lo - 1, the bounds being tried and best, None if every bound is taken
+    '''
+    points = sorted(set([lo - 1, best] + [b for b in running if lo <= b < best]))
+    gap, left = max((right - left, left) for left, right in zip(points, points[1:]))
+    if gap < 2:
+        return None
+    return left + gap // 2
+
+async def bisect(solvers: Dict[str, List[str]], model_text: str, query_text, decode, folder: str,
+                 lo: int, hi: int, time_limit: float, workers: int, trace: Trace) -> Dict[str, Any]:
+    # hi is an upper bound on the value of any solution: a query at hi is a plain feasibility check,
+    # query_text(b) is the tail of the file which bounds the objective by b and reads the solution
+    deadline = time.time() + time_limit
+    best = {"obj": None, "sol": None, "optimal": False, "infeasible": False, "lo": lo}
+    running = {} # task -> (bound, solver name, process holder)
+    names = list(solvers)
+    turn = 0
+    killed = [] # awaited at the end, so that their processes are reaped before the loop closes
+
+    def upper():
+        return best["obj"] if best["obj"] is not None else hi + 1
+
+    async def query(bound, name, holder):
+        path = os.path.join(folder, f"{name}_{bound}.smt2")
+        with open(path, "w") as f:
+            f.write(model_text + query_text(bound))
+        process = await asyncio.create_subprocess_exec(*solvers[name], path, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL)
+        holder["process"] = process
+        output, _ = await process.communicate()
+        os.remove(path)
+        return parse_output(output.decode())
+
+    def kill(task):
+        process = running[task][2].get("process")
+        # a killed solver makes communicate return, cancelling the task instead would leave the process unreaped
+        if process is None:
+            task.cancel()
+        elif process.returncode is None:
+            process.kill()
+        killed.append(task)
+
+    while not (best["optimal"] or best["infeasible"]) and time.time() < deadline:
+        # fill the free workers: feasibility first, then bisection, then the same bound with another solver
+        while len(running) < workers and names:
+            bounds = [b for b, _, _ in running.values()]
+            if best["obj"] is None and hi not in bounds:
+                bound = hi
+            else:
+                bound = next_bound(best["lo"], upper(), bounds)
+            if bound is None:
+                taken = {(b, name) for b, name, _ in running.values()}
+                free = [(b, name) for b in sorted(set(bounds)) for name in names if (b, name) not in taken]
+                if not free:
+                    break
+                bound, name = free[0]
+            else:
+                name = names[turn % len(names)]
+                turn += 1
+            holder = {}
+            task = asyncio.create_task(query(bound, name, holder))
+            running[task] = (bound, name, holder)
+            print(f"Starting {name} with max_distance <= {bound}")
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(list(running), timeout=max(0, deadline - time.time()),
+                                     return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            bound, name, _ = running.pop(task)
+            status, values = task.result()
+            print(f"{name} with max_distance <= {bound}: {status}")
+            if status == "sat":
+                if best["obj"] is None or values[0] < best["obj"]:
+                    with phase("decode"):
+                        best.update(obj=values[0], sol=decode(values[1:]))
+                    trace.incumbent(values[0])
+            elif status == "unsat":
+                if bound == hi:
+                    best["infeasible"] = True
+                best["lo"] = max(best["lo"], bound + 1)
+                trace.bound(best["lo"])
+            elif name in names:
+                names.remove(name) # the solver failed on this logic, drop it
+            if best["obj"] is not None and best["lo"] >= best["obj"]:
+                best["optimal"] = True
+
+        # kill the queries whose answer is already known
+        for task, (bound, name, _) in list(running.items()):
+            if best["optimal"] or best["infeasible"] or bound < best["lo"] or \
+                    (best["obj"] is not None and bound >= best["obj"]):
+                kill(task)
+                del running[task]
+
+    for task in list(running):
+        kill(task)
+    await asyncio.gather(*killed, return_exceptions=True)
+    if best["optimal"]:
+        trace.optimal()
+    return best
+
+def solve_portfolio(m: int, n: int, l: List[int], s: List[int], D: List[List[int]], variant: str = "flat_sym",
+                    time_limit: int = 300, workers: int = None, trace: Trace = None, lower_bound: int = 0) -> Dict[str, Any]:
+    trace = trace or Trace()
+    start_time = time.time()
+    solvers = available_solvers()
+    workers = workers or os.cpu_count()
+    if not solvers:
+        return {"time": time_limit, "optimal": False, "obj": None, "sol": None}
+
+    with phase("build"):
+        solver, objective, terms, decode = build_variant(m, n, l, s, D, variant)
+    with phase("flatten"):
+        model_text = smtlib2_model(solver, LOGICS[FORMULATIONS[variant][0]])
+    query_text = lambda bound: smtlib2_query(objective, terms, lower_bound, bound)
+    hi = sum(max(row) for row in D) # no route is longer than the sum of the row maxima of D
+    print(f"Bisecting [{lower_bound}, {hi}] with {', '.join(solvers)} on {workers} workers")
+
+    with tempfile.TemporaryDirectory() as folder, phase("search"):
+        best = asyncio.run(bisect(solvers, model_text, query_text, decode, folder, lower_bound, hi,
+                                  time_limit - (time.time() - start_time), workers, trace))
+    runtime = time.time() - start_time
+    proven = best["optimal"] or best["infeasible"]
+    if best["sol"] is not None:
+        # the objective of the flat variants is only an upper bound on the routes
+        best["obj"] = int(route_distances(best["sol"], D).max())
+    return {"time": min(math.floor(runtime), time_limit) if proven else time_limit, "optimal": proven,
+            "obj": best["obj"], "sol": best["sol"]}
+
+def main():
+    parser = argparse.ArgumentParser(description="export an SMT variant of an instance as an SMT-LIB2 file")
+    parser.add_argument("instance", help=".dat or .dzn instance")
+    parser.add_argument("variant", choices=list(FORMULATIONS))
+    parser.add_argument("output", help="path of the .smt2 file")
+    parser.add_argument("--lower", type=int, default=None, help="assert max_distance >= lower, the lower bound of bounds.py by default")
+    parser.add_argument("--upper", type=int, default=None, help="assert max_distance <= upper")
+    args = parser.parse_args()
+
+    m, n, l, s, D = load_instance(args.instance).as_lists()
+    lower = args.lower if args.lower is not None else lower_bound(m, n, l, s, D)
+    export_smtlib2(m, n, l, s, D, args.variant, args.output, lower, args.upper)
+    print(f"{args.variant} model of {args.instance} saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
+
+'''
+
+from command line, for example to write the bit-vector model of instance 7 with the objective bounded by 250:
+
+    python models/SMT/SMT_portfolio.py Instances/inst07.dat bv_sym inst07_bv.smt2 --upper 250
+
+'''
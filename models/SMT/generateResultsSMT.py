@@ -1,28 +1,85 @@
-import re
 import os
+import sys
 from SMT_models import *
+from SMT_portfolio import solve_portfolio
 import json 
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instance_loader import load_instance
+from tracing import Trace, open_trace
+from bounds import lower_bound
+from solutions import validate_result
+from profiling import phase
+
 def parse_dzn_file(filename):
-    with open(filename, 'r') as file:
-        content = file.read()
-    
-    # Extracting m and n
-    m = int(re.search(r'm = (\d+);', content).group(1))
-    n = int(re.search(r'n = (\d+);', content).group(1))
-    
-    # Extracting l
-    l = list(map(int, re.search(r'l = \[(.+?)\];', content).group(1).split(',')))
-    
-    # Extracting s
-    s = list(map(int, re.search(r's = \[(.+?)\];', content).group(1).split(',')))
-    
-    # Extracting D
-    D_match = re.search(r'D = \[\|(.+?)\|\];', content, re.DOTALL).group(1)
-    D_lines = D_match.strip().split('\n')
-    D = [list(map(int, re.split(r'\s*,\s*', line.strip().strip('|').strip()))) for line in D_lines]
-    
-    return m, n, l, s, D
+    return load_instance(filename).as_lists()
+
+approaches = {
+    "no_ysm": solve_mcp_no_sym,
+    "sym": solve_mcp_sym,
+    "sym_subtour_elim": solve_mcp_sym_subtour_elim,
+    # plain Int/Bool successor model, without arrays and uninterpreted functions
+    "flat": solve_mcp_flat,
+    "flat_sym": solve_mcp_flat_sym,
+    # the same successor model on bit-vectors sized from the instance, bit-blasted by z3
+    "bv": solve_mcp_bv,
+    "bv_sym": solve_mcp_bv_sym,
+    # SMT-LIB2 export of a variant bisected by the solver binaries on PATH (z3, cvc5, yices)
+    "portfolio": "flat_sym",
+    "portfolio_bv": "bv_sym",
+}
+# variants whose threads are the solver processes of the bisection (run_all gives them their own width)
+portfolio_variants = [name for name, variant in approaches.items() if isinstance(variant, str)]
+
+def solve_instance(approach: str, instance_path: str, time_limit: int = 300, threads: int = 1, trace: Trace = None) -> Dict[str, Any]:
+    # run a single approach on a single instance, z3 is single threaded so threads is only the number of
+    # solver processes of the portfolios
+    with phase("parse"):
+        m, n, l, s, D = parse_dzn_file(instance_path)
+    trace = trace or Trace()
+    with phase("presolve"):
+        bound = lower_bound(m, n, l, s, D)
+    trace.bound(bound)
+    if isinstance(approaches[approach], str):
+        result = solve_portfolio(m, n, l, s, D, variant=approaches[approach], time_limit=time_limit, workers=threads,
+                                 trace=trace, lower_bound=bound)
+    else:
+        result = approaches[approach](m, n, l, s, D, timeout=time_limit * 1000, trace=trace, lower_bound=bound)
+    with phase("decode"):
+        return validate_result(result, l, s, D)
+
+# array variants sharing the core of ArrayModel: name -> constraint groups layered on it by ArrayModel.solve
+incremental = {
+    "no_ysm": {},
+    "sym": {"symmetry_breaking": True},
+    "sym_subtour_elim": {"symmetry_breaking": True, "subtour_elimination": True},
+}
+
+def solve_instance_incremental(names: List[str], instance_path: str, time_limit: int = 300, traces: Dict[str, Trace] = None) -> Dict[str, Dict[str, Any]]:
+    # build the array core once and solve the variants in order, each one bounded by the best objective found so far
+    with phase("parse"):
+        m, n, l, s, D = parse_dzn_file(instance_path)
+    traces = traces or {}
+    with phase("presolve"):
+        bound = lower_bound(m, n, l, s, D)
+    model = ArrayModel(m, n, l, s, D, lower_bound=bound)
+    results, timings = {}, {}
+    for name in names:
+        trace = traces.get(name) or Trace()
+        trace.bound(bound)
+        result = model.solve(timeout=time_limit * 1000, trace=trace, name=name, **incremental[name])
+        with phase("decode"):
+            results[name] = validate_result(result, l, s, D)
+        timings[name] = model.solve_time
+    print(f"build {model.build_time:.2f} s, " + ", ".join(f"{name} {t:.2f} s" for name, t in timings.items()))
+    return results
+
+# the array variants are solved together by a single run_all job (models/run_all.py), on the core built once
+variant_groups = {"arrays": list(incremental)}
+
+def solve_group(names: List[str], instance_path: str, time_limit: int = 300, threads: int = 1, traces: Dict[str, Trace] = None) -> Dict[str, Dict[str, Any]]:
+    # run_all entry point of a variant group, z3 is single threaded so threads is not used
+    return solve_instance_incremental(names, instance_path, time_limit=time_limit, traces=traces)
 
 def main(input_folder: str, output_folder: str, approach: str):
     output_approach_folder = os.path.join(output_folder, approach)
@@ -31,26 +88,25 @@ def main(input_folder: str, output_folder: str, approach: str):
     for file_name in os.listdir(input_folder):
         if file_name.endswith(".dzn"):
             file_path = os.path.join(input_folder, file_name)
-            m, n, l, s, D = parse_dzn_file(file_path)
-            
-            results = {}
-            
-            # Solve using solve_mcp
-            result_mcp = solve_mcp_no_sym(m, n, l, s, D)
-            if result_mcp:
-                results["no_ysm"] = result_mcp
-            
-            # Solve using solve_mcp_dfs
-            result_dfs = solve_mcp_sym(m, n, l, s, D)
-            if result_dfs:
-                results["sym"] = result_dfs
+            instance_number = os.path.splitext(file_name)[0].split("inst")[-1]
             
-            # Solve using solve_mcp_bfs
-            result_bfs = solve_mcp_sym_subtour_elim(m, n, l, s, D)
-            if result_bfs:
-                results["sym_subtour_elim"] = result_bfs
+            # the array variants share one model, the others are built from scratch
+            names = [name for name in approaches if name in incremental]
+            traces = {name: open_trace(approach, instance_number, name) for name in names}
+            results = solve_instance_incremental(names, file_path, traces=traces)
+            for trace in traces.values():
+                trace.close()
+
+            for name in approaches:
+                if name in incremental:
+                    continue
+                trace = open_trace(approach, instance_number, name)
+                result = solve_instance(name, file_path, trace=trace)
+                trace.close()
+                if result:
+                    results[name] = result
+            results = {name: results[name] for name in approaches if name in results}
             
-            instance_number = os.path.splitext(file_name)[0].split("inst")[-1]
             output_file_name = f"{instance_number}.json"
             output_file_path = os.path.join(output_approach_folder, output_file_name)
             
@@ -63,5 +119,6 @@ def main(input_folder: str, output_folder: str, approach: str):
 input_folder = r"./models/CP/InstancesDZN"  # Replace with the path to your input folder containing .dzn files
 output_folder = r"./res"  # Replace with the path to your output folder for saving .json files
 
-# Run the main function
-main(input_folder, output_folder, approach="SMT")
+if __name__ == "__main__":
+    # Run the main function
+    main(input_folder, output_folder, approach="SMT")
\ No newline at end of file
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import sys
+
+from run_all import ROOT, expand_jobs, parse_instances, resolve_script, run_jobs
+
+'''
+Side by side comparison of some variants of one approach: the jobs run through run_all (same worker pool, time
+limit and process isolation) but write their results in a separate folder, so that res/ is left untouched, and
+the table reports for every instance the objective (* when proven optimal) and the time of every variant.
+'''
+
+def load_results(folder, approach):
+    results = {}
+    approach_folder = os.path.join(folder, approach)
+    if not os.path.isdir(approach_folder):
+        return results
+    for file_name in sorted(os.listdir(approach_folder)):
+        if file_name.endswith(".json"):
+            with open(os.path.join(approach_folder, file_name)) as f:
+                results[file_name[:-len(".json")]] = json.load(f)
+    return results
+
+
+def solved(entry):
+    # the array SMT models report obj = False when they time out without a solution
+    return entry is not None and entry.get("obj") not in (None, False)
+
+
+def format_entry(entry):
+    if entry is None:
+        return "-"
+    if not solved(entry):
+        return f"N/A ({entry.get('time')}s)"
+    return f"{entry['obj']}{'*' if entry.get('optimal') else ''} ({entry.get('time')}s)"
+
+
+def report(results, variants):
+    width = max([len(v) for v in variants] + [14]) + 2
+    print("inst  " + "".join(v.ljust(width) for v in variants))
+    for number, entries in sorted(results.items()):
+        print(f"{number:<6}" + "".join(format_entry(entries.get(v)).ljust(width) for v in variants))
+
+    # per variant: instances solved, proven optimal, wins on the objective and total time
+    print()
+    print("variant".ljust(width) + "solved  optimal  best  time")
+    for v in variants:
+        entries = [e[v] for e in results.values() if v in e]
+        best = 0
+        for e in results.values():
+            objs = [e[w]["obj"] for w in variants if solved(e.get(w))]
+            if solved(e.get(v)) and e[v]["obj"] == min(objs):
+                best += 1
+        print(v.ljust(width) + f"{sum(map(solved, entries)):<8}{sum(bool(e.get('optimal')) for e in entries):<9}{best:<6}"
+              f"{sum(e.get('time') or 0 for e in entries)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="compare variants of one approach on the same instances")
+    parser.add_argument("script", help="approach name (CP, HEUR, MIP, SAT, SMT) or runner script")
+    parser.add_argument("--variants", nargs="*", default=None, help="variants to compare, all of them by default")
+    parser.add_argument("--instances", default=None, help="instance numbers to run, e.g. 1-10,13")
+    parser.add_argument("--time-limit", type=int, default=300, help="seconds per job")
+    parser.add_argument("--workers", type=int, default=None, help="parallel jobs, default is the number of cores")
+    parser.add_argument("--threads", type=int, default=1, help="solver threads given to every job")
+    parser.add_argument("--portfolio-workers", type=int, default=None, help="solver processes of every portfolio job")
+    parser.add_argument("--output", default="./benchmarks", help="result folder, one subfolder per approach")
+    parser.add_argument("--report-only", action="store_true", help="only print the table of the results already in --output")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "models"))
+
+    approach, _ = resolve_script(args.script)
+    jobs = expand_jobs([args.script], args.variants, parse_instances(args.instances))
+    variants = list(dict.fromkeys(job.variant for job in jobs))
+    if not args.report_only:
+        workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+        print(f"Running {len(jobs)} jobs on {workers} workers with {args.threads} threads each")
+        run_jobs(jobs, workers, args.threads, args.time_limit, args.output,
+                 os.path.join(args.output, "logs"), os.path.join(args.output, "traces"),
+                 profile_dir=os.path.join(args.output, "profiles"), portfolio_workers=args.portfolio_workers)
+        print()
+
+    instances = {job.instance_num for job in jobs}
+    results = {k: v for k, v in load_results(args.output, approach).items() if k in instances}
+    report(results, variants)
+
+
+if __name__ == "__main__":
+    main()
+
+'''
+
+from command line, for example to compare the array and the flat SMT encodings on every instance:
+
+    python models/benchmark.py SMT --variants sym flat flat_sym --time-limit 300
+
+'''
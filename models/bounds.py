@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+
+'''
+Valid lower bounds on the objective (the longest route), cheap enough to be computed before every run:
+
+    round_trip     every item is visited by some courier, whose route contains a path depot -> item -> depot:
+                   max over the items of sp(o, i) + sp(i, o), with sp the shortest path distance (equal to D
+                   when D satisfies the triangle inequality, and still valid when it does not)
+    in_degree      every item is entered exactly once and every used courier enters the depot once: the total
+                   distance is at least sum_i min_j D[j][i] + k_min * min_i D[i][o], and the longest of the m
+                   routes at least its m-th part
+    out_degree     the same bound on the edges leaving the items and the depot
+    min_couriers   k_min, the least number of couriers which can carry all the items (their largest capacities
+                   must cover the total size), None if even all of them cannot
+
+The bound is given to every model as a constraint on its objective, and a run whose incumbent reaches it stops
+and reports the result as optimal.
+'''
+
+def shortest_paths_from(W: np.ndarray, source: int) -> np.ndarray:
+    '''
+    dense Dijkstra on the non-negative matrix W, O(n^2)
+    '''
+    n = len(W)
+    dist = np.full(n, np.inf)
+    dist[source] = 0
+    done = np.zeros(n, dtype=bool)
+    for _ in range(n):
+        u = int(np.where(done, np.inf, dist).argmin())
+        if done[u] or not np.isfinite(dist[u]):
+            break
+        done[u] = True
+        dist = np.minimum(dist, dist[u] + W[u])
+    return dist
+
+def min_couriers(l, s):
+    capacities = np.sort(np.asarray(l, dtype=np.int64))[::-1]
+    covered = np.cumsum(capacities) >= int(np.sum(s))
+    if not covered.any():
+        return None
+    return int(covered.argmax()) + 1
+
+def lower_bounds(m: int, n: int, l, s, D) -> dict:
+    D = np.asarray(D, dtype=np.float64)
+    depot = n
+    k_min = min_couriers(l, s) or m
+    bounds = {"min_couriers": min_couriers(l, s)}
+
+    from_depot = shortest_paths_from(D, depot)
+    to_depot = shortest_paths_from(D.T, depot)
+    bounds["round_trip"] = int((from_depot[:n] + to_depot[:n]).max()) if n > 0 else 0
+
+    off_diagonal = D + np.diag(np.full(n + 1, np.inf))
+    entering = off_diagonal[:, :n].min(axis=0).sum() + k_min * off_diagonal[:n, depot].min()
+    leaving = off_diagonal[:n, :].min(axis=1).sum() + k_min * off_diagonal[depot, :n].min()
+    bounds["in_degree"] = math.ceil(entering / m)
+    bounds["out_degree"] = math.ceil(leaving / m)
+    return bounds
+
+def lower_bound(m: int, n: int, l, s, D) -> int:
+    bounds = lower_bounds(m, n, l, s, D)
+    return max(bounds["round_trip"], bounds["in_degree"], bounds["out_degree"])
@@ -0,0 +1,138 @@
+import argparse
+import math
+import os
+
+import numpy as np
+
+from instance_loader import Instance
+
+'''
+Seeded generator of synthetic MCP instances, written in the .dat format of Instances/ (and optionally in the .dzn
+format of models/CP/InstancesDZN), to see how the approaches scale well beyond the 21 fixed instances.
+
+Distance matrices (the depot is the last row/column, as in the original instances):
+
+    euclidean   rounded distances between points uniform in a square whose side grows with sqrt(n)
+    clustered   the same with the items grouped around n // 25 centres
+    asymmetric  euclidean distances stretched by an independent random factor in each direction
+
+Capacities are feasible by construction: the items are dealt to the couriers at random (with uneven shares) and
+every capacity is the load the courier received times the slack of the capacity kind, at least the largest item.
+
+    tight       slack 1.05, close to a perfect packing
+    loose       slack 1.5
+
+The same (n, m, seed) always gives the same instance, and the same points and sizes whatever the kinds.
+'''
+
+KINDS = ("euclidean", "clustered", "asymmetric")
+CAPACITIES = {"tight": 1.05, "loose": 1.5}
+
+SIDE = 100          # side of the square of the points for n = 1, scaled by sqrt(n)
+CLUSTER_SIZE = 25   # average number of items around each centre of the clustered instances
+MAX_SIZE = 50       # item sizes are uniform in 1..MAX_SIZE
+
+
+def _points(rng, n, kind):
+    side = SIDE * math.sqrt(n)
+    points = rng.uniform(0, side, size=(n + 1, 2))
+    if kind == "clustered":
+        centres = rng.uniform(0, side, size=(max(1, n // CLUSTER_SIZE), 2))
+        spread = side / (4 * math.sqrt(len(centres)))
+        members = rng.integers(0, len(centres), size=n)
+        points[:n] = np.clip(centres[members] + rng.normal(0, spread, size=(n, 2)), 0, side)
+    return points
+
+
+def generate(n: int, m: int, kind: str = "euclidean", capacity: str = "loose", seed: int = 0) -> Instance:
+    if kind not in KINDS:
+        raise ValueError(f"unknown distance kind {kind}, expected one of {KINDS}")
+    if capacity not in CAPACITIES:
+        raise ValueError(f"unknown capacity kind {capacity}, expected one of {tuple(CAPACITIES)}")
+    if not 1 <= m <= n:
+        raise ValueError(f"expected 1 <= m <= n, got m={m}, n={n}")
+
+    rng = np.random.default_rng([seed, n, m])
+    s = rng.integers(1, MAX_SIZE + 1, size=n)
+    share = rng.dirichlet(np.full(m, 2.0))
+    courier = rng.choice(m, size=n, p=share)
+    courier[rng.permutation(n)[:m]] = np.arange(m) # every courier gets at least one item
+    loads = np.bincount(courier, weights=s, minlength=m)
+    l = np.maximum(np.ceil(loads * CAPACITIES[capacity]), s.max()).astype(np.int64)
+
+    points = _points(rng, n, kind)
+    D = np.rint(np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2))
+    if kind == "asymmetric":
+        D = np.rint(D * rng.uniform(1, 1.5, size=D.shape))
+    np.fill_diagonal(D, 0)
+    return Instance(m, n, l, s.astype(np.int64), D.astype(np.int64))
+
+
+def instance_name(n: int, m: int, kind: str, capacity: str, seed: int) -> str:
+    return f"inst_{kind}_{capacity}_n{n}_m{m}_s{seed}"
+
+
+def write_dat(instance: Instance, path: str):
+    m, n, l, s, D = instance
+    with open(path, "w") as f:
+        f.write(f"{m}\n{n}\n{' '.join(map(str, l.tolist()))}\n{' '.join(map(str, s.tolist()))}\n")
+        np.savetxt(f, D, fmt="%d")
+
+
+def write_dzn(instance: Instance, path: str):
+    m, n, l, s, D = instance
+    with open(path, "w") as f:
+        f.write(f"m = {m};\nn = {n};\nl = {l.tolist()};\ns = {s.tolist()};\nD = [|\n")
+        rows = [" " + ", ".join(map(str, row)) for row in D.tolist()]
+        f.write(" |\n".join(rows) + " |];\n")
+
+
+def generate_files(sizes, couriers, kinds, capacities, seeds, folder, dzn=False):
+    '''
+    write every combination not written yet, returns name -> path of the .dat (and .dzn) files
+    '''
+    os.makedirs(folder, exist_ok=True)
+    files = {}
+    for n in sizes:
+        for m in couriers:
+            if m > n:
+                continue
+            for kind in kinds:
+                for capacity in capacities:
+                    for seed in seeds:
+                        name = instance_name(n, m, kind, capacity, seed)
+                        paths = [os.path.join(folder, f"{name}.dat")] + ([os.path.join(folder, f"{name}.dzn")] if dzn else [])
+                        if not all(os.path.exists(path) for path in paths):
+                            instance = generate(n, m, kind, capacity, seed)
+                            write_dat(instance, paths[0])
+                            if dzn:
+                                write_dzn(instance, paths[1])
+                        files[name] = paths
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="generate synthetic MCP instances in the .dat format")
+    parser.add_argument("--n", type=int, nargs="+", required=True, help="numbers of items")
+    parser.add_argument("--m", type=int, nargs="+", required=True, help="numbers of couriers")
+    parser.add_argument("--kinds", nargs="+", default=["euclidean"], choices=KINDS)
+    parser.add_argument("--capacities", nargs="+", default=["loose"], choices=list(CAPACITIES))
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--output", default="./Instances_synthetic")
+    parser.add_argument("--dzn", action="store_true", help="also write the .dzn version, for the MiniZinc models")
+    args = parser.parse_args(argv)
+
+    files = generate_files(args.n, args.m, args.kinds, args.capacities, args.seeds, args.output, args.dzn)
+    print(f"{len(files)} instances in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
+
+'''
+
+from the repository root, for example tight clustered instances from 10 to 2000 items:
+
+    python models/instance_generator.py --n 10 100 500 2000 --m 5 20 --kinds clustered --capacities tight --seeds 0 1
+
+'''
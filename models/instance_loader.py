@@ -0,0 +1,148 @@
+import hashlib
+import os
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+'''
+Single entry point for reading MCP instances, in either the original .dat format
+(Instances/, checker/InputFolder/) or the MiniZinc .dzn format (models/CP/InstancesDZN/).
+
+The first time an instance is read it is parsed and stored in a binary cache as one flat
+int32 .npy array laid out as [m, n, l..., s..., D...]. The cache file is named after the
+hash of the instance file content, so an edited instance never hits a stale entry, and
+every later load is a memory map of that file: l, s and D are zero-copy views into it.
+
+The cache lives in ./.instance_cache by default, set CDMO_INSTANCE_CACHE to move it.
+
+    from instance_loader import load_instance
+    m, n, l, s, D = load_instance("Instances/inst07.dat")
+
+'''
+
+CACHE_DIR = os.environ.get("CDMO_INSTANCE_CACHE", os.path.join(".", ".instance_cache"))
+CACHE_VERSION = 1
+
+# every byte which is not part of an integer becomes a separator for np.fromstring
+_NON_NUMERIC = bytes(c if chr(c) in "0123456789-" else ord(" ") for c in range(256))
+
+
+class Instance(NamedTuple):
+    m: int              # number of couriers
+    n: int              # number of items
+    l: np.ndarray       # (m,) maximum load of each courier
+    s: np.ndarray       # (n,) size of each item
+    D: np.ndarray       # (n+1, n+1) distance matrix, the origin is the last row/column
+
+    def as_lists(self):
+        '''
+        plain python version (m, n, l, s, D) for the z3 models, which do not accept numpy integers
+        '''
+        return self.m, self.n, self.l.tolist(), self.s.tolist(), self.D.tolist()
+
+
+def _to_ints(content: bytes) -> np.ndarray:
+    return np.fromstring(content.translate(_NON_NUMERIC), dtype=np.int32, sep=" ")
+
+
+def _pack(m: int, n: int, l, s, D) -> np.ndarray:
+    l = np.asarray(l, dtype=np.int32).ravel()
+    s = np.asarray(s, dtype=np.int32).ravel()
+    D = np.asarray(D, dtype=np.int32).ravel()
+    if len(l) != m or len(s) != n or len(D) != (n + 1) ** 2:
+        raise ValueError(f"inconsistent instance: m={m}, n={n}, |l|={len(l)}, |s|={len(s)}, |D|={len(D)}")
+    return np.concatenate([np.array([m, n], dtype=np.int32), l, s, D])
+
+
+def _unpack(flat: np.ndarray) -> Instance:
+    m, n = int(flat[0]), int(flat[1])
+    l = flat[2:2 + m]
+    s = flat[2 + m:2 + m + n]
+    D = flat[2 + m + n:].reshape(n + 1, n + 1)
+    return Instance(m, n, l, s, D)
+
+
+def parse_dat(content: bytes) -> np.ndarray:
+    '''
+    .dat layout: m, n, the m loads, the n sizes and then the (n+1)x(n+1) distance matrix,
+    whitespace separated. Returns the flat packed array.
+    '''
+    values = _to_ints(content)
+    m, n = int(values[0]), int(values[1])
+    expected = 2 + m + n + (n + 1) ** 2
+    if len(values) != expected:
+        raise ValueError(f"expected {expected} integers in .dat file, found {len(values)}")
+    return values
+
+
+def parse_dzn(content: bytes) -> np.ndarray:
+    '''
+    .dzn layout: the assignments m, n, l, s and D (as a 2d array literal) in any order.
+    Returns the flat packed array.
+    '''
+    fields = {}
+    for statement in content.split(b";"):
+        name, sep, value = statement.partition(b"=")
+        if not sep:
+            continue
+        name = name.strip().decode()
+        if name in ("m", "n", "l", "s", "D"):
+            fields[name] = _to_ints(value)
+    missing = {"m", "n", "l", "s", "D"} - fields.keys()
+    if missing:
+        raise ValueError(f"missing {sorted(missing)} in .dzn file")
+    return _pack(int(fields["m"][0]), int(fields["n"][0]), fields["l"], fields["s"], fields["D"])
+
+
+def content_digest(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def instance_digest(path: str) -> str:
+    '''
+    content hash of an instance file, also usable as a stable instance key by other tools
+    '''
+    with open(path, "rb") as f:
+        return content_digest(f.read())
+
+
+def _parse(path: str, content: bytes) -> np.ndarray:
+    if path.endswith(".dzn"):
+        return parse_dzn(content)
+    return parse_dat(content)
+
+
+def load_instance(path: str, cache_dir: str = CACHE_DIR) -> Instance:
+    '''
+    load an instance from a .dat or .dzn file, going through the binary cache.
+    Pass cache_dir=None to parse without touching the cache.
+    '''
+    with open(path, "rb") as f:
+        content = f.read()
+
+    if cache_dir is None:
+        return _unpack(_parse(path, content))
+
+    cache_path = os.path.join(cache_dir, f"{content_digest(content)}.v{CACHE_VERSION}.npy")
+    try:
+        return _unpack(np.load(cache_path, mmap_mode="r"))
+    except (FileNotFoundError, ValueError):
+        pass
+
+    flat = _parse(path, content)
+
+    # write to a private file first and rename, so concurrent workers never read a partial cache entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path[:-len('.npy')]}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, flat)
+    os.replace(tmp_path, cache_path)
+    return _unpack(np.load(cache_path, mmap_mode="r"))
+
+
+def instance_number(path: str) -> str:
+    '''
+    two digit instance number from a file name such as inst7.dat, inst07.dzn or 07.json
+    '''
+    number = re.search(r"\d+", os.path.basename(path)).group()
+    return f"{int(number):02d}"
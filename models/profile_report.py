@@ -0,0 +1,106 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+
+from profiling import PHASES, PROFILE_DIR, STATISTICS, read_profile
+
+'''
+Where the time of the runs goes, from their profiles (see models/profiling.py): for every approach variant the mean
+time of every phase over its runs and its share of the total, then the mean of the shared solver statistics.
+With --by-instance every run is shown on its own line.
+
+from command line:
+
+    python models/profile_report.py --profile-dir ./profiles --csv profile_report.csv
+    python models/profile_report.py --approaches CP MIP --by-instance
+'''
+
+
+def collect(profile_dir, approaches=None):
+    runs = []
+    for path in sorted(glob.glob(os.path.join(profile_dir, "*", "*.json"))):
+        run = read_profile(path)
+        if approaches is None or run.get("approach") in approaches:
+            runs.append(run)
+    return runs
+
+
+def row(runs):
+    # mean phases, other, total and statistics of some runs
+    count = len(runs)
+    mean = lambda values: sum(values) / count
+    result = {"runs": count, "total": mean([r.get("total", 0) for r in runs])}
+    for phase in PHASES + ("other",):
+        result[phase] = mean([r.get("phases", {}).get(phase, 0) if phase != "other" else r.get("other", 0) for r in runs])
+    for name in STATISTICS:
+        values = [r["statistics"][name] for r in runs if name in r.get("statistics", {})]
+        result[name] = sum(values) / len(values) if values else None
+    return result
+
+
+def report(runs, by_instance=False):
+    groups = {}
+    for run in runs:
+        key = (run.get("approach"), run.get("variant")) + ((run.get("instance"),) if by_instance else ())
+        groups.setdefault(key, []).append(run)
+    rows = []
+    for key, group in sorted(groups.items()):
+        names = {"approach": key[0], "variant": key[1]}
+        if by_instance:
+            names["instance"] = key[2]
+        rows.append({**names, **row(group)})
+    return rows
+
+
+def _show(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}" if value < 1e5 else f"{value:.3g}"
+    return str(value)
+
+
+def print_table(rows, by_instance=False):
+    keys = ["approach", "variant"] + (["instance"] if by_instance else []) + ["runs", "total"]
+    phases = [p for p in PHASES + ("other",) if any(r[p] for r in rows)]
+    statistics = [s for s in STATISTICS if any(r[s] is not None for r in rows)]
+
+    print("mean time per phase (s) and share of the total")
+    table = [[_show(r[k]) for k in keys] + [f"{r[p]:.2f} ({r[p] / r['total']:.0%})" if r["total"] else "-" for p in phases]
+             for r in rows]
+    _print(keys + phases, table)
+    if statistics:
+        print("\nmean solver statistics")
+        _print(keys[:-1] + statistics, [[_show(r[k]) for k in keys[:-1] + statistics] for r in rows])
+
+
+def _print(columns, table):
+    widths = [max(len(str(c)) for c in column) for column in zip(columns, *table)]
+    for line in [columns] + table:
+        print("  ".join(str(c).ljust(w) for c, w in zip(line, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="time per phase and solver statistics from the run profiles")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR)
+    parser.add_argument("--approaches", nargs="*", default=None, help="report only these approaches")
+    parser.add_argument("--by-instance", action="store_true", help="one line per run instead of per variant")
+    parser.add_argument("--csv", default=None, help="also write the rows to this csv file")
+    args = parser.parse_args(argv)
+
+    rows = report(collect(args.profile_dir, args.approaches), args.by_instance)
+    if not rows:
+        print(f"No profiles found in {args.profile_dir}")
+        return
+    print_table(rows, args.by_instance)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
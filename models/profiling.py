@@ -0,0 +1,158 @@
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+
+'''
+Per-phase timing and solver statistics of a run, with the same schema for every approach, so that the time of a
+job can be split into where it actually goes. The phases are
+
+    parse       reading the instance
+    build       building the model (variables, constraints, clauses, matrix)
+    flatten     compiling the model for the solver: MiniZinc flattening, MPS or SMT-LIB2 export
+    presolve    work before the search: lower bound, warm start, solver initialization or presolve
+    search      the solver itself
+    decode      reading the solution from the solver and checking it
+    write       writing the result json (timed by run_all)
+
+Phases nest: the time spent in a phase opened inside another one is counted only in the inner one, so the phases
+never overlap and "other" is the time of the run outside all of them. The statistics of the solvers are reported
+under the shared names of STATISTICS (when the solver has them) and with their own names under "solver".
+
+Every runner records into the profile of the current process, which run_all replaces at the start of every job
+and writes to profiles/<approach>/<instance>_<variant>.json; models/profile_report.py aggregates them.
+
+    from profiling import phase, solver_statistics
+    with phase("build"):
+        ...
+'''
+
+PROFILE_DIR = os.path.join(".", "profiles")
+
+PHASES = ("parse", "build", "flatten", "presolve", "search", "decode", "write")
+STATISTICS = ("nodes", "conflicts", "decisions", "propagations", "restarts", "iterations", "solutions")
+
+# shared statistic -> names of the same counter in the statistics of each solver family, first found wins
+SOLVER_STATISTICS = {
+    "minizinc": {"nodes": ["nodes"], "conflicts": ["failures"], "propagations": ["propagations"],
+                 "restarts": ["restarts"], "solutions": ["nSolutions", "solutions"]},
+    "z3": {"conflicts": ["conflicts", "sat conflicts"], "decisions": ["decisions", "sat decisions"],
+           "propagations": ["propagations", "sat propagations 2ary"], "restarts": ["restarts", "sat restarts"]},
+    "pysat": {"conflicts": ["conflicts"], "decisions": ["decisions"], "propagations": ["propagations"],
+              "restarts": ["restarts"]},
+    "gurobi": {"nodes": ["NodeCount"], "iterations": ["IterCount"], "solutions": ["SolCount"]},
+    "highs": {"nodes": ["mip_node_count"], "iterations": ["simplex_iteration_count"]},
+    "cbc": {"nodes": ["Enumerated nodes"], "iterations": ["Total iterations"]},
+}
+
+
+class Profile:
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}
+        self.statistics = {}
+        self.solver = {}
+        self._open = [] # [name, start, time of the inner phases] of the phases being timed
+
+    @contextmanager
+    def phase(self, name):
+        entry = [name, time.perf_counter(), 0.0]
+        self._open.append(entry)
+        try:
+            yield
+        finally:
+            self._open.pop()
+            elapsed = time.perf_counter() - entry[1]
+            self.add(name, elapsed - entry[2])
+            if self._open:
+                self._open[-1][2] += elapsed
+
+    def add(self, name, seconds):
+        if name not in PHASES:
+            raise ValueError(f"unknown phase {name}, expected one of {PHASES}")
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def move(self, source, target, seconds):
+        '''
+        move seconds (as reported by the solver, at most the time of source) from phase source to phase target,
+        e.g. the flattening time out of the wall time of a MiniZinc call
+        '''
+        seconds = min(max(0.0, _number(seconds) or 0.0), self.phases.get(source, 0.0))
+        self.phases[source] = self.phases.get(source, 0.0) - seconds
+        self.add(target, seconds)
+
+    def solver_statistics(self, family, raw, accumulate=False):
+        '''
+        record the statistics of a solver of family (a key of SOLVER_STATISTICS), summed with the ones already
+        recorded when accumulate (several solver calls) and replacing them otherwise (cumulative counters)
+        '''
+        if hasattr(raw, "get_key_value"): # z3 Statistics
+            raw = {key: raw.get_key_value(key) for key in raw.keys()}
+        raw = {str(k): _number(v) for k, v in dict(raw).items() if _number(v) is not None}
+        shared = {}
+        for name, keys in SOLVER_STATISTICS[family].items():
+            key = next((k for k in keys if k in raw), None)
+            if key is not None:
+                shared[name] = raw[key]
+        for target, values in ((self.statistics, shared), (self.solver, raw)):
+            for key, value in values.items():
+                target[key] = target.get(key, 0) + value if accumulate else value
+
+    def as_dict(self):
+        total = time.time() - self.start
+        phases = {name: round(self.phases[name], 4) for name in PHASES if name in self.phases}
+        return {
+            "total": round(total, 4),
+            "phases": phases,
+            "other": round(max(0.0, total - sum(phases.values())), 4),
+            "statistics": self.statistics,
+            "solver": self.solver,
+        }
+
+
+def _number(value):
+    # statistics come as numbers, numeric strings or timedeltas (minizinc)
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value if math.isfinite(value) else None
+    try:
+        return float(value) if "." in str(value) else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+_current = Profile()
+
+def current():
+    return _current
+
+def start_profile():
+    # a fresh profile for the run starting now, recorded into by phase() and solver_statistics()
+    global _current
+    _current = Profile()
+    return _current
+
+def phase(name):
+    return _current.phase(name)
+
+def solver_statistics(family, raw, accumulate=False):
+    _current.solver_statistics(family, raw, accumulate)
+
+
+def profile_path(approach, instance_num, variant, profile_dir=PROFILE_DIR):
+    return os.path.join(profile_dir, approach, f"{instance_num}_{variant}.json")
+
+
+def write_profile(path, record):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(record, f, indent=2)
+
+
+def read_profile(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,231 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from instance_loader import instance_digest
+
+'''
+Local SQLite store of every job run by run_all, so that an interrupted sweep resumes where it stopped and a sweep
+run again only runs the jobs whose inputs changed.
+
+A job is keyed by the hash of
+
+    model       the sources (.py, .mzn) of the approach folder and of every project module the runner imports (the
+                shared modules of models/ and the modules of the other approaches, e.g. the heuristic), recursively
+    instance    the content of the instance file
+    solver      the approach and the variant (key of the runner's approaches dict)
+    params      time limit and threads of the job (solver processes for the portfolios)
+
+and its record holds the time, objective, best lower bound (from its trace), status (done, failed, crashed, killed)
+and the result entry itself. Each record is committed as soon as its job ends; a job with a record in
+FINAL_STATUSES is skipped by the next sweep, the others (a solver error, a crash of the worker) run again.
+
+The result jsons the checker expects are exported from the store on demand, the latest record of every
+(approach, variant, instance) wins:
+
+    python models/results_store.py export ./checker/ResultFolder
+'''
+
+DB_PATH = os.path.join(".", "results.db")
+
+MODEL_EXTENSIONS = (".py", ".mzn")
+
+FINAL_STATUSES = ("done", "killed")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    approach TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    instance TEXT NOT NULL,
+    model_digest TEXT NOT NULL,
+    instance_digest TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    time REAL,
+    optimal INTEGER,
+    obj INTEGER,
+    bound REAL,
+    result TEXT NOT NULL,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_entry ON results (approach, variant, instance, finished);
+'''
+
+############################# KEYS #############################
+
+def project_modules(paths, models: str) -> list:
+    '''
+    the modules of models/ and of its approach folders imported by the python files of paths, and by the modules they
+    import in turn (runners import them by bare name, from the folders they add to sys.path)
+    '''
+    index = {}
+    for directory in [models] + sorted(os.path.join(models, d) for d in os.listdir(models)):
+        if os.path.isdir(directory) and not os.path.basename(directory).startswith(('.', '__')):
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".py"):
+                    index.setdefault(name[:-3], os.path.join(directory, name))
+    found, queue = [], [path for path in paths if path.endswith(".py")]
+    seen = set(queue)
+    while queue:
+        with open(queue.pop(), "rb") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = index.get(name.split(".")[0])
+                if path is not None and path not in seen:
+                    seen.add(path)
+                    found.append(path)
+                    queue.append(path)
+    return sorted(found)
+
+
+def source_digest(script: str) -> str:
+    '''
+    hash of the model and solver sources of a runner: every .py and .mzn file of its folder (recursively) and every
+    project module the runner imports
+    '''
+    script = os.path.abspath(script)
+    folder = os.path.dirname(script)
+    models = os.path.dirname(folder)
+    paths = []
+    for directory, subfolders, files in os.walk(folder):
+        subfolders[:] = sorted(d for d in subfolders if not d.startswith(('.', '__')))
+        paths += [os.path.join(directory, name) for name in sorted(files) if name.endswith(MODEL_EXTENSIONS)]
+    paths += [path for path in project_modules([script], models) if path not in paths]
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        if os.path.exists(path):
+            digest.update(os.path.relpath(path, models).encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(f.read() + b"\0")
+    return digest.hexdigest()
+
+
+def job_key(approach: str, variant: str, model_digest: str, inst_digest: str, params: dict) -> str:
+    fields = json.dumps([approach, variant, model_digest, inst_digest, params], sort_keys=True)
+    return hashlib.blake2b(fields.encode(), digest_size=16).hexdigest()
+
+############################# STORE #############################
+
+class ResultsStore:
+    def __init__(self, path=DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        # readers (an export during a sweep) do not block the writer
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self._sources = {}
+
+    def keys(self, jobs, time_limit: int, threads: dict) -> dict:
+        '''
+        job -> (key, model digest, instance digest, params), every source folder and instance hashed once;
+        threads is job -> threads of the job
+        '''
+        instances = {}
+        keys = {}
+        for job in jobs:
+            if job.script not in self._sources:
+                self._sources[job.script] = source_digest(job.script)
+            if job.instance_path not in instances:
+                instances[job.instance_path] = instance_digest(job.instance_path)
+            model, inst = self._sources[job.script], instances[job.instance_path]
+            params = {"time_limit": time_limit, "threads": threads[job]}
+            keys[job] = (job_key(job.approach, job.variant, model, inst, params), model, inst, params)
+        return keys
+
+    def finished(self, keys) -> set:
+        # the keys among keys which already have a final record
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), 500): # below the host parameter limit of sqlite
+            chunk = keys[i:i + 500]
+            rows = self.connection.execute(
+                f"SELECT key FROM results WHERE status IN ({','.join('?' * len(FINAL_STATUSES))}) "
+                f"AND key IN ({','.join('?' * len(chunk))})", FINAL_STATUSES + tuple(chunk))
+            found.update(key for key, in rows)
+        return found
+
+    def put(self, job, key, status: str, result: dict, bound=None):
+        key, model, inst, params = key
+        obj = result.get("obj")
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, job.approach, job.variant, job.instance_num, model, inst, json.dumps(params, sort_keys=True),
+             status, result.get("time"), int(bool(result.get("optimal"))),
+             obj if isinstance(obj, int) and not isinstance(obj, bool) else None, bound, json.dumps(result),
+             time.time()))
+        self.connection.commit()
+
+    def latest(self, approaches=None) -> dict:
+        '''
+        approach -> instance -> variant -> result entry of the latest record, variants in the order they were first run
+        '''
+        rows = self.connection.execute(
+            "SELECT approach, variant, instance, result FROM results ORDER BY finished")
+        latest, first_seen = {}, {}
+        for approach, variant, instance, result in rows:
+            if approaches is not None and approach not in approaches:
+                continue
+            first_seen.setdefault(approach, {}).setdefault(variant, len(first_seen[approach]))
+            latest.setdefault(approach, {}).setdefault(instance, {})[variant] = json.loads(result)
+        return {approach: {instance: dict(sorted(entries.items(), key=lambda item: first_seen[approach][item[0]]))
+                           for instance, entries in sorted(instances.items())}
+                for approach, instances in latest.items()}
+
+    def export(self, folder: str, approaches=None) -> int:
+        '''
+        write <folder>/<approach>/<instance>.json from the store, returns the number of files written
+        '''
+        written = 0
+        for approach, instances in self.latest(approaches).items():
+            os.makedirs(os.path.join(folder, approach), exist_ok=True)
+            for instance, entries in instances.items():
+                path = os.path.join(folder, approach, f"{instance}.json")
+                with open(path + ".tmp", "w") as f:
+                    json.dump(entries, f, indent=2)
+                os.replace(path + ".tmp", path)
+                written += 1
+        return written
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="export the result jsons of the checker from the results store")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("folder", help="result folder, one subfolder per approach (e.g. ./checker/ResultFolder)")
+    parser.add_argument("--db", default=DB_PATH, help="results store")
+    parser.add_argument("--approaches", nargs="*", default=None, help="export only these approaches")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"no results store at {args.db}")
+    store = ResultsStore(args.db)
+    written = store.export(args.folder, args.approaches)
+    store.close()
+    print(f"{written} result files exported from {args.db} to {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
+
+'''
+
+from the repository root, after (or during) a sweep of models/run_all.py:
+
+    python models/results_store.py export ./checker/ResultFolder
+    python models/results_store.py export ./checker/ResultFolder --approaches CP MIP
+
+'''
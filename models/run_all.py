@@ -1,24 +1,356 @@
-import subprocess
+import argparse
+import importlib
+import json
+import multiprocessing as mp
+import os
+import resource
+import signal
 import sys
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import wait
+from typing import NamedTuple
 
-# List of scripts you want to run
-scripts = sys.argv[1:]  # Get script names from command-line arguments
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-for script in scripts:
-    print(f"Running {script}...")
-    subprocess.run(['python', script])
-    print(f"Finished running {script}.\n")
-    
-''' 
+# approach name -> runner script, every runner exposes `approaches`, `input_folder` and `solve_instance`, the
+# runners whose variants race several solver processes list them in `portfolio_variants`, and the runners whose
+# variants share their model expose `variant_groups` (group -> variants) and `solve_group`
+RUNNERS = {
+    "CP": "models/CP/generateResultsCP.py",
+    "HEUR": "models/HEUR/generateResultsHEUR.py",
+    "MIP": "models/MIP/generateResultsMIP.py",
+    "SAT": "models/SAT/generateResultsSAT.py",
+    "SMT": "models/SMT/generateResultsSMT.py",
+}
+
+GRACE = 10 # seconds a job may overrun its time limit before its process group is killed
+
+
+class Job(NamedTuple):
+    approach: str       # CP, HEUR, MIP, SAT, SMT
+    script: str         # runner script of the approach
+    variant: str        # key of the runner's approaches dict, also the key in the result json
+    instance_path: str
+    instance_num: str   # two digits, name of the result json
+    members: tuple = () # variants solved in order by one process, variant is then the name of their group
+
+
+def member_jobs(job):
+    # the single variant jobs of a job, one per entry of the result json
+    return [job._replace(variant=variant, members=()) for variant in job.members] if job.members else [job]
+
+
+def load_runner(script):
+    script = os.path.abspath(script)
+    runner_dir = os.path.dirname(script)
+    if runner_dir not in sys.path:
+        sys.path.insert(0, runner_dir)
+    return importlib.import_module(os.path.splitext(os.path.basename(script))[0])
+
+
+def resolve_script(name):
+    # accept both an approach name (CP) and a script path (models/CP/generateResultsCP.py)
+    if name.upper() in RUNNERS:
+        return name.upper(), RUNNERS[name.upper()]
+    return os.path.basename(os.path.dirname(os.path.abspath(name))), name
+
+
+def parse_instances(spec):
+    # "1-5,7,21" -> {1, 2, 3, 4, 5, 7, 21}
+    if not spec:
+        return None
+    numbers = set()
+    for part in spec.split(","):
+        first, _, last = part.partition("-")
+        numbers.update(range(int(first), int(last or first) + 1))
+    return numbers
+
+
+def expand_jobs(scripts, variants=None, instances=None, groups=True):
+    # with groups, the selected variants of every group of the runner are solved by a single job
+    from instance_loader import instance_number
+
+    jobs = []
+    for name in scripts:
+        approach, script = resolve_script(name)
+        runner = load_runner(script)
+        for file_name in sorted(os.listdir(runner.input_folder)):
+            if file_name.startswith('.'):
+                continue
+            number = instance_number(file_name)
+            if instances is not None and int(number) not in instances:
+                continue
+            path = os.path.join(runner.input_folder, file_name)
+            selected = [variant for variant in runner.approaches if variants is None or variant in variants]
+            grouped = set()
+            for group, members in (getattr(runner, "variant_groups", {}) if groups else {}).items():
+                members = tuple(variant for variant in members if variant in selected)
+                if len(members) > 1:
+                    jobs.append(Job(approach, script, group, path, number, members))
+                    grouped.update(members)
+            jobs += [Job(approach, script, variant, path, number) for variant in selected if variant not in grouped]
+    return jobs
+
+
+def job_threads(job, threads, portfolio_workers):
+    # cores used by a job: the portfolio variants run portfolio_workers solver processes, the others threads
+    return portfolio_workers if job.variant in getattr(load_runner(job.script), "portfolio_variants", ()) else threads
+
+
+def _run_job(job, time_limit, threads, log_path, trace_dir, conn, environment=None):
+    os.environ.update(environment or {})
+    # own process group, so that solver subprocesses (minizinc, fzn-gecode, ...) die with the job
+    if hasattr(os, "setsid"):
+        os.setsid()
+    # redirect at the file descriptor level to also capture the output of native solvers
+    with open(log_path, "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    sys.stdout = os.fdopen(1, "w", buffering=1)
+    sys.stderr = os.fdopen(2, "w", buffering=1)
+    from tracing import open_trace
+    from profiling import start_profile
+
+    traces = {member.variant: open_trace(job.approach, job.instance_num, member.variant, trace_dir)
+              for member in member_jobs(job)}
+    profile = start_profile()
+    start_time = time.time()
+    try:
+        runner = load_runner(job.script)
+        # the imports of the runner are not part of the job
+        profile = start_profile()
+        start_time = time.time()
+        if job.members:
+            # variant -> entry of every member
+            result = runner.solve_group(list(job.members), job.instance_path, time_limit=time_limit, threads=threads,
+                                        traces=traces)
+        else:
+            result = runner.solve_instance(job.variant, job.instance_path, time_limit=time_limit, threads=threads,
+                                           trace=traces[job.variant])
+    except Exception:
+        traceback.print_exc()
+        result = None
+    for trace in traces.values():
+        trace.close()
+    conn.send((result, {"wall": time.time() - start_time, "peak_rss": peak_rss(), "profile": profile.as_dict()}))
+    conn.close()
+
+
+def peak_rss():
+    # peak resident memory in MiB of the job and of the largest solver subprocess it waited for (ru_maxrss is in KiB)
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        process.kill()
+    process.join()
+
+
+def write_result(output_folder, job, result, variant_order):
+    # merge the entry of this job into the json of its instance, written as soon as the job ends
+    folder = os.path.join(output_folder, job.approach)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{job.instance_num}.json")
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            results = json.load(f)
+    results[job.variant] = result
+    order = {variant: i for i, variant in enumerate(variant_order)}
+    results = dict(sorted(results.items(), key=lambda item: order.get(item[0], len(order))))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def trace_bound(job, trace_dir):
+    # best lower bound reported in the trace of a job, which survives the job being killed
+    from tracing import read_trace, trace_path
+
+    path = trace_path(job.approach, job.instance_num, job.variant, trace_dir)
+    if not os.path.exists(path):
+        return None
+    bounds = [event["bound"] for event in read_trace(path)[1] if event.get("bound") is not None]
+    return max(bounds) if bounds else None
+
+
+def run_jobs(jobs, workers, threads=1, time_limit=300, output_folder="./res", log_dir="./logs", trace_dir="./traces",
+             store=None, rerun=False, profile_dir=None, portfolio_workers=None, prior_results=True):
+    from profiling import profile_path, write_profile
+
+    # every job takes its width out of a budget of workers * threads cores, so that a portfolio running
+    # portfolio_workers processes is not scheduled next to workers - 1 other jobs
+    portfolio_workers = portfolio_workers or os.cpu_count() or 1
+    widths = {job: job_threads(job, threads, portfolio_workers) for job in jobs}
+    widths.update({member: widths[job] for job in jobs for member in member_jobs(job)})
+    cores = workers * threads
+
+    ctx = mp.get_context("spawn")
+    variant_order = {}
+    for member in (member for job in jobs for member in member_jobs(job)):
+        variant_order.setdefault(member.approach, [])
+        if member.variant not in variant_order[member.approach]:
+            variant_order[member.approach].append(member.variant)
+
+    # with a results store, every job ends with its record committed and the jobs already recorded are skipped,
+    # as are the members of a group already recorded. The keys only cover sources, instance and parameters, so the
+    # jobs do not start from the earlier results in res/ (MIP warm start), nor do the jobs run with prior_results False
+    environment = {"CDMO_PRIOR_RESULTS": ""} if store is not None or not prior_results else {}
+    if store is not None:
+        keys = store.keys([member for job in jobs for member in member_jobs(job)], time_limit, widths)
+        finished = set() if rerun else store.finished(key for key, _, _, _ in keys.values())
+        skipped = [member for job in jobs for member in member_jobs(job) if keys[member][0] in finished]
+        if skipped:
+            print(f"Skipping {len(skipped)} jobs already in the results store")
+        remaining = []
+        for job in jobs:
+            members = tuple(member.variant for member in member_jobs(job) if keys[member][0] not in finished)
+            if members and job.members:
+                remaining.append(job._replace(members=members))
+                widths[remaining[-1]] = widths[job]
+            elif members:
+                remaining.append(job)
+        jobs = remaining
+    total = sum(len(member_jobs(job)) for job in jobs)
+
+    pending = deque(jobs)
+    running = {} # receiving end of the pipe -> (job, process, deadline)
+    used = 0     # cores taken by the running jobs
+    records = [] # (job, status, result, usage) of every job, usage is None for the killed and crashed ones
+    done = 0
+    sweep_start = time.time()
+    while pending or running:
+        # in order, a job wider than the whole budget runs alone
+        while pending and len(running) < workers and (not running or used + widths[pending[0]] <= cores):
+            job = pending.popleft()
+            log_path = os.path.join(log_dir, job.approach, f"{job.instance_num}_{job.variant}.log")
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_run_job, args=(job, time_limit, widths[job], log_path, trace_dir, sender,
+                                                         environment), daemon=True)
+            process.start()
+            sender.close()
+            # the members of a group have a time limit each
+            running[receiver] = (job, process, time.time() + time_limit * len(member_jobs(job)) + GRACE)
+            used += widths[job]
+
+        next_deadline = min(deadline for _, _, deadline in running.values())
+        ready = wait(list(running), timeout=max(0, min(1, next_deadline - time.time())))
+
+        for receiver in list(running):
+            job, process, deadline = running[receiver]
+            status, usage = None, None
+            if receiver in ready:
+                try:
+                    result, usage = receiver.recv()
+                    status = "done" if result is not None else "failed"
+                except EOFError:
+                    result, status = None, "crashed"
+                process.join()
+            elif time.time() > deadline:
+                _kill(process)
+                result, status = None, "killed"
+            if status is None:
+                continue
+
+            receiver.close()
+            del running[receiver]
+            used -= widths[job]
+            # every member of a group gets its own entry, record and trace, the group one profile
+            entries = result if job.members else {job.variant: result}
+            write_start = time.perf_counter()
+            for member in member_jobs(job):
+                entry = (entries or {}).get(member.variant)
+                member_status = status if entry is not None or status != "done" else "failed"
+                if entry is None:
+                    entry = {"time": time_limit, "optimal": False, "obj": None, "sol": None}
+                write_result(output_folder, member, entry, variant_order[member.approach])
+                records.append((member, member_status, entry, usage))
+                if store is not None:
+                    store.put(member, keys[member], member_status, entry, trace_bound(member, trace_dir))
+                done += 1
+                print(f"[{done}/{total}] {member.approach} {member.variant} inst{member.instance_num}: {member_status}, "
+                      f"obj = {entry.get('obj')}, optimal = {entry.get('optimal')}, time = {entry.get('time')}")
+            if usage is not None and profile_dir is not None:
+                usage["profile"]["phases"]["write"] = round(time.perf_counter() - write_start, 4)
+                write_profile(profile_path(job.approach, job.instance_num, job.variant, profile_dir), {
+                    "approach": job.approach, "variant": job.variant, "instance": job.instance_num, "status": status,
+                    "time": entry.get("time"), "obj": entry.get("obj"), "optimal": entry.get("optimal"),
+                    "wall": round(usage["wall"], 4), "peak_rss": round(usage["peak_rss"], 1), **usage["profile"]})
+
+    print(f"\nSweep of {total} jobs finished in {time.time() - sweep_start:.1f} s")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run every (approach, variant, instance) job on a pool of worker processes")
+    parser.add_argument("scripts", nargs="*", default=list(RUNNERS),
+                        help="approach names (CP, HEUR, MIP, SAT, SMT) or runner scripts, all approaches by default")
+    parser.add_argument("--workers", type=int, default=None, help="parallel jobs, default is cores // threads")
+    parser.add_argument("--threads", type=int, default=1, help="solver threads given to every job")
+    parser.add_argument("--portfolio-workers", type=int, default=None,
+                        help="solver processes of every portfolio job, counted against workers * threads cores; default is all cores")
+    parser.add_argument("--time-limit", type=int, default=300, help="seconds per job")
+    parser.add_argument("--instances", default=None, help="instance numbers to run, e.g. 1-10,13")
+    parser.add_argument("--variants", nargs="*", default=None, help="keep only these variants (e.g. sym cdcl_seq)")
+    parser.add_argument("--output", default="./res", help="result folder, one subfolder per approach")
+    parser.add_argument("--log-dir", default="./logs", help="solver output of every job")
+    parser.add_argument("--trace-dir", default="./traces", help="anytime incumbent trace of every job")
+    parser.add_argument("--profile-dir", default="./profiles", help="time of every phase and solver statistics of every job")
+    parser.add_argument("--db", default="./results.db", help="results store, the jobs already recorded there are skipped")
+    parser.add_argument("--rerun", action="store_true", help="run every job again, even if already in the results store")
+    parser.add_argument("--no-groups", action="store_true",
+                        help="run every variant on its own process, also the ones the runner solves together (SMT arrays)")
+    args = parser.parse_args(argv)
+
+    # runners use paths relative to the repository root
+    os.chdir(ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "models"))
+
+    from results_store import ResultsStore
+
+    workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+    jobs = expand_jobs(args.scripts, args.variants, parse_instances(args.instances), groups=not args.no_groups)
+    print(f"Running {len(jobs)} jobs on {workers} workers with {args.threads} threads each "
+          f"({args.portfolio_workers or os.cpu_count()} processes for the portfolios)")
+    store = ResultsStore(args.db)
+    run_jobs(jobs, workers, args.threads, args.time_limit, args.output, args.log_dir, args.trace_dir, store, args.rerun,
+             args.profile_dir, args.portfolio_workers)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
+
+'''
 
 from commmand line perform the following instruction in order to run this script properly:
 
     python models/run_all.py models/CP/generateResultsCP.py models/MIP/generateResultsMIP.py  models/SAT/generateResultsSAT.py  models/SMT/generateResultsSMT.py
 
+or equivalently, since all the approaches run by default:
+
+    python models/run_all.py
+
 you can olso select the specific model you want to run, for example:
 
     python models/run_all.py models/CP/generateResultsCP.py
 
-runs only the CP model.
+runs only the CP model. Jobs run in parallel, each on its own process which is killed if it overruns
+the time limit, and every result is merged in res/<approach>/<instance>.json as soon as the job ends:
+
+    python models/run_all.py CP SMT --workers 8 --threads 2 --instances 1-10 --variants sym no_ysm
+
+every result is also recorded in the results store (results.db, see models/results_store.py): running the same
+command again after an interruption only runs the jobs not recorded yet, or whose sources, instance or parameters
+changed since; --rerun runs everything again.
 
 '''
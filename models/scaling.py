@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+from run_all import ROOT, Job, load_runner, resolve_script, run_jobs
+
+'''
+Size scaling benchmark: the approaches run through run_all (same worker pool, time limit and process isolation) on
+synthetic instances of models/instance_generator.py swept over the number of items n and of couriers m, and every
+job is recorded in <output>/scaling.jsonl with
+
+    build_time  parse, build and flatten phases of the job (see models/profiling.py)
+    search_time search phase of the job
+    solve_time  time reported by the runner
+    obj         objective, optimal when proven
+    peak_mb     peak resident memory of the job or of its largest solver subprocess
+
+The plots are the curves of images/plot_times.py with n on the x-axis, one line per (variant, m) averaged over the
+seeds, one figure per approach, metric, distance kind and capacity kind, saved in <output>/plots.
+'''
+
+METRICS = {
+    "solve_time": "Solve time (s)",
+    "build_time": "Build time (s)",
+    "search_time": "Search time (s)",
+    "peak_mb": "Peak memory (MiB)",
+    "obj": "Objective",
+}
+
+
+def scaling_jobs(scripts, variants, files):
+    # every (approach, variant, instance), in the format read by the runner of the approach (.dzn for MiniZinc)
+    jobs = []
+    for name in scripts:
+        approach, script = resolve_script(name)
+        runner = load_runner(script)
+        extension = ".dzn" if any(f.endswith(".dzn") for f in os.listdir(runner.input_folder)) else ".dat"
+        for instance, paths in files.items():
+            path = next(p for p in paths if p.endswith(extension))
+            for variant in runner.approaches:
+                if variants is None or variant in variants:
+                    jobs.append(Job(approach, script, variant, path, instance))
+    return jobs
+
+
+BUILD_PHASES = ("parse", "build", "flatten")
+
+def record(job, status, result, usage, params):
+    phases = usage["profile"]["phases"] if usage else {}
+    return {
+        "approach": job.approach, "variant": job.variant, "instance": job.instance_num, **params[job.instance_num],
+        "status": status, "solve_time": result.get("time"),
+        "build_time": round(sum(phases.get(p, 0) for p in BUILD_PHASES), 3) if usage else None,
+        "search_time": round(phases.get("search", 0), 3) if usage else None,
+        "obj": result.get("obj") if result.get("obj") not in (None, False) else None,
+        "optimal": bool(result.get("optimal")),
+        "peak_mb": round(usage["peak_rss"], 1) if usage else None,
+    }
+
+
+def load_records(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def curves(records, metric):
+    # (approach, kind, capacity) -> (variant, m) -> sorted [(n, mean of metric over the seeds)]
+    values = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    for r in records:
+        if r.get(metric) is not None:
+            values[r["approach"], r["kind"], r["capacity"]][r["variant"], r["m"]][r["n"]].append(r[metric])
+    return {key: {line: sorted((n, sum(v) / len(v)) for n, v in points.items()) for line, points in lines.items()}
+            for key, lines in values.items()}
+
+
+def plot_scaling(records, folder):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    os.makedirs(folder, exist_ok=True)
+    for metric, label in METRICS.items():
+        for (approach, kind, capacity), lines in curves(records, metric).items():
+            plt.figure(figsize=(12, 8))
+            for (variant, m), points in sorted(lines.items()):
+                plt.plot([n for n, _ in points], [v for _, v in points], marker='o', label=f"{variant} (m={m})")
+            plt.title(f"{approach} {label.split(' (')[0]} vs size, {kind} distances, {capacity} capacities", fontsize=16)
+            plt.xlabel('Items (n)', fontsize=14)
+            plt.ylabel(label, fontsize=14)
+            plt.xscale('log')
+            if metric != "obj" and all(v > 0 for points in lines.values() for _, v in points):
+                plt.yscale('log')
+            plt.legend(fontsize=12)
+            plt.grid(True, which='both')
+            plt.savefig(os.path.join(folder, f"{approach}_{metric}_{kind}_{capacity}.png"))
+            plt.close()
+
+
+def summary(records):
+    print(f"{'approach':<10}{'variant':<18}{'n':>6}{'m':>5}  {'status':<8}{'obj':>10}{'build (s)':>11}{'solve (s)':>11}{'peak (MiB)':>12}")
+    for r in sorted(records, key=lambda r: (r["approach"], r["variant"], r["n"], r["m"], r["kind"], r["capacity"], r["seed"])):
+        obj = "-" if r["obj"] is None else f"{r['obj']}{'*' if r['optimal'] else ''}"
+        print(f"{r['approach']:<10}{r['variant']:<18}{r['n']:>6}{r['m']:>5}  {r['status']:<8}{obj:>10}"
+              f"{r['build_time'] if r['build_time'] is not None else '-':>11}{r['solve_time']:>11}"
+              f"{r['peak_mb'] if r['peak_mb'] is not None else '-':>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="sweep the approaches over synthetic instances of growing size")
+    parser.add_argument("scripts", nargs="+", help="approach names (CP, HEUR, MIP, SAT, SMT) or runner scripts")
+    parser.add_argument("--variants", nargs="*", default=None, help="keep only these variants")
+    parser.add_argument("--n", type=int, nargs="+", default=[10, 20, 50, 100, 200, 500, 1000, 2000])
+    parser.add_argument("--m", type=int, nargs="+", default=[3, 10])
+    parser.add_argument("--kinds", nargs="+", default=["euclidean"])
+    parser.add_argument("--capacities", nargs="+", default=["loose"])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--time-limit", type=int, default=300, help="seconds per job")
+    parser.add_argument("--workers", type=int, default=None, help="parallel jobs, default is cores // threads")
+    parser.add_argument("--threads", type=int, default=1, help="solver threads given to every job")
+    parser.add_argument("--portfolio-workers", type=int, default=None, help="solver processes of every portfolio job")
+    parser.add_argument("--output", default="./benchmarks/scaling", help="instances, results, records and plots")
+    parser.add_argument("--report-only", action="store_true", help="only summarize and plot the records already in --output")
+    parser.add_argument("--no-plots", action="store_true")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "models"))
+    from instance_generator import KINDS, CAPACITIES, generate_files, instance_name
+
+    records_path = os.path.join(args.output, "scaling.jsonl")
+    if not args.report_only:
+        for kind in args.kinds:
+            if kind not in KINDS:
+                parser.error(f"unknown kind {kind}, expected one of {KINDS}")
+        for capacity in args.capacities:
+            if capacity not in CAPACITIES:
+                parser.error(f"unknown capacity {capacity}, expected one of {tuple(CAPACITIES)}")
+        files = generate_files(args.n, args.m, args.kinds, args.capacities, args.seeds,
+                               os.path.join(args.output, "instances"), dzn=True)
+        params = {}
+        for n in args.n:
+            for m in args.m:
+                for kind in args.kinds:
+                    for capacity in args.capacities:
+                        for seed in args.seeds:
+                            params[instance_name(n, m, kind, capacity, seed)] = \
+                                {"n": n, "m": m, "kind": kind, "capacity": capacity, "seed": seed}
+
+        jobs = scaling_jobs(args.scripts, args.variants, files)
+        workers = args.workers or max(1, (os.cpu_count() or 1) // args.threads)
+        print(f"Running {len(jobs)} jobs on {workers} workers with {args.threads} threads each")
+        # the synthetic instances have no results in res/, whose NN.json belong to the instances of the course
+        results = run_jobs(jobs, workers, args.threads, args.time_limit, os.path.join(args.output, "results"),
+                           os.path.join(args.output, "logs"), os.path.join(args.output, "traces"),
+                           profile_dir=os.path.join(args.output, "profiles"), portfolio_workers=args.portfolio_workers,
+                           prior_results=False)
+        with open(records_path, "a") as f:
+            for job, status, result, usage in results:
+                f.write(json.dumps(record(job, status, result, usage, params)) + "\n")
+        print()
+
+    records = load_records(records_path)
+    summary(records)
+    if not args.no_plots:
+        plot_scaling(records, os.path.join(args.output, "plots"))
+        print(f"\nPlots saved in {os.path.join(args.output, 'plots')}")
+
+
+if __name__ == "__main__":
+    main()
+
+'''
+
+from command line, for example the heuristic and the HiGHS model on euclidean and clustered instances:
+
+    python models/scaling.py HEUR MIP --variants regret_ls HiGHS --n 10 50 100 500 1000 --m 3 10 --kinds euclidean clustered --time-limit 60
+
+re-plot the records already collected (the jobs of every run are appended to the same scaling.jsonl):
+
+    python models/scaling.py HEUR MIP --report-only
+
+'''
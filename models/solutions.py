@@ -0,0 +1,145 @@
+import re
+from typing import List, Optional
+
+import numpy as np
+
+'''
+Decoding and validation of the solutions, shared by all the approaches.
+
+The values of a solver model are read in one bulk call (getAttr for Gurobi, the assignment vector of PySAT, one
+pass over the interpretations of a z3 model) into numpy arrays, the routes are rebuilt from the successor of every
+node, and every result is checked against the instance before it reaches a result file:
+
+    coverage    every item is delivered exactly once
+    capacity    the load of every courier is within its capacity
+    objective   the reported obj is the length of the longest route
+
+Nodes are the 0-based items and the depot n, routes in the results are lists of 1-based items.
+'''
+
+############################# BULK VALUES #############################
+
+def z3_array_values(model, array, indices) -> List[int]:
+    '''
+    values of array at indices in a z3 model, read from its interpretation when it is a chain of stores over a
+    constant array, evaluated index by index otherwise
+    '''
+    from z3 import is_store, is_const_array
+
+    value = model[array]
+    stored = {}
+    while value is not None and is_store(value):
+        stored.setdefault(value.arg(1).as_long(), value.arg(2))
+        value = value.arg(0)
+    if value is None or not is_const_array(value):
+        return [model.evaluate(array[i], model_completion=True).as_long() for i in indices]
+    return [(stored[i] if i in stored else value.arg(0)).as_long() for i in indices]
+
+Z3_CONSTANT = re.compile(r"\(define-fun (\S+) \(\) (?:Bool|Int|\(_ BitVec \d+\))\s+(true|false|\d+|\(- \d+\)|#x[0-9a-f]+|#b[01]+)\)")
+
+def z3_value(text: str):
+    if text in ("true", "false"):
+        return text == "true"
+    if text.startswith("(- "):
+        return -int(text[3:-1])
+    if text.startswith("#x"):
+        return int(text[2:], 16)
+    if text.startswith("#b"):
+        return int(text[2:], 2)
+    return int(text)
+
+def z3_constants(model) -> dict:
+    # name -> python value of every Bool, Int and bit-vector constant of a z3 model, parsed from a single dump of
+    # the model instead of one API call per variable
+    return {name: z3_value(text) for name, text in Z3_CONSTANT.findall(model.sexpr())}
+
+def z3_names(variables) -> np.ndarray:
+    # names of an array of z3 constants, computed once and reused to decode every model
+    return np.vectorize(str, otypes=[object])(np.asarray(variables, dtype=object))
+
+def z3_values(model, names: np.ndarray, default=0) -> np.ndarray:
+    # values of the constants named in names, default for the ones left free by the model
+    values = z3_constants(model)
+    return np.array([values.get(name, default) for name in names.ravel()]).reshape(names.shape)
+
+############################# ROUTES #############################
+
+def follow(successor, start: int, n: int) -> Optional[List[int]]:
+    '''
+    0-based items visited from start until the first node >= n (a depot), None if the walk does not end in n steps
+    '''
+    route, node = [], int(successor[start])
+    while node < n:
+        if len(route) == n:
+            return None
+        route.append(node)
+        node = int(successor[node])
+    return route
+
+def routes_from_arcs(arcs: np.ndarray) -> Optional[List[List[int]]]:
+    '''
+    1-based routes of the boolean arcs[k, i, j] (courier k goes from i to j, depot n), None if some route does not
+    close at the depot or goes through a node without successor
+    '''
+    m, depot = len(arcs), arcs.shape[1] - 1
+    successor = np.where(arcs.any(axis=2), arcs.argmax(axis=2), -1)
+    routes = []
+    for k in range(m):
+        if successor[k, depot] < 0:
+            return None
+        route = follow(successor[k], depot, depot)
+        if route is None or (successor[k, route] < 0).any():
+            return None
+        routes.append([i + 1 for i in route])
+    return routes
+
+############################# VALIDATION #############################
+
+def route_distances(sol: List[List[int]], D) -> np.ndarray:
+    # length of every route of a solution, the arcs of all the routes gathered from D at once
+    D = np.asarray(D)
+    depot = len(D) - 1
+    tails = np.concatenate([[depot] + [i - 1 for i in route] for route in sol]).astype(np.int64)
+    heads = np.concatenate([[i - 1 for i in route] + [depot] for route in sol]).astype(np.int64)
+    courier = np.repeat(np.arange(len(sol)), [len(route) + 1 for route in sol])
+    return np.bincount(courier, weights=D[tails, heads], minlength=len(sol)).astype(np.int64)
+
+def check_solution(sol, l, s, D, obj=None) -> List[str]:
+    '''
+    violated conditions of a solution, empty when it is valid; obj is checked only when given
+    '''
+    m, n = len(l), len(s)
+    if not isinstance(sol, list) or len(sol) != m or not all(isinstance(route, list) for route in sol):
+        return [f"not a list of {m} routes"]
+    items = np.array([i for route in sol for i in route], dtype=np.int64)
+    if ((items < 1) | (items > n)).any():
+        return [f"items out of range: {sorted(set(items[(items < 1) | (items > n)].tolist()))}"]
+    errors = []
+    counts = np.bincount(items - 1, minlength=n)
+    if (counts == 0).any():
+        errors.append(f"items not delivered: {(np.flatnonzero(counts == 0) + 1).tolist()}")
+    if (counts > 1).any():
+        errors.append(f"items delivered more than once: {(np.flatnonzero(counts > 1) + 1).tolist()}")
+    courier = np.repeat(np.arange(m), [len(route) for route in sol])
+    loads = np.bincount(courier, weights=np.asarray(s)[items - 1], minlength=m)
+    over = np.flatnonzero(loads > np.asarray(l))
+    if len(over):
+        errors.append(f"couriers over capacity: {(over + 1).tolist()}")
+    if obj is not None:
+        longest = int(route_distances(sol, D).max())
+        if obj != longest:
+            errors.append(f"objective {obj} differs from the longest route {longest}")
+    return errors
+
+def validate_result(result: dict, l, s, D) -> dict:
+    '''
+    the result of a run, or the same result without its solution (and not optimal) if the solution is not valid
+    '''
+    if not result or not result.get("sol"):
+        return result
+    errors = check_solution(result["sol"], l, s, D, result.get("obj"))
+    if not errors:
+        return result
+    for error in errors:
+        print(f"Invalid solution: {error}")
+    return {**result, "optimal": False, "obj": None, "sol": None}
@@ -0,0 +1,134 @@
+import argparse
+import csv
+import glob
+import os
+import sys
+
+from tracing import TRACE_DIR, read_trace
+
+'''
+Anytime performance of every run from its trace (see models/tracing.py):
+
+    ttf        time to the first solution
+    ttt        time to target, the first time the incumbent is within --gap of the reference value
+    integral   primal integral, the integral over [0, time limit] of the primal gap
+               gap(t) = |obj(t) - ref| / max(|obj(t)|, |ref|), with gap = 1 while there is no solution
+               (0 is a run that starts at the reference value, the time limit one that never finds a solution)
+    final      best objective of the run, marked with * when proven optimal
+
+The reference value of an instance is the best objective found by any of the traced runs.
+
+from command line:
+
+    python models/trace_report.py --trace-dir ./traces --time-limit 300 --gap 0.05 --csv trace_report.csv
+'''
+
+
+def primal_gap(obj, ref):
+    if obj is None:
+        return 1.0
+    if obj == ref:
+        return 0.0
+    if obj * ref < 0:
+        return 1.0
+    return abs(obj - ref) / max(abs(obj), abs(ref))
+
+
+def primal_integral(events, ref, time_limit):
+    integral = 0.0
+    last_time, last_gap = 0.0, 1.0
+    for event in events:
+        if event["obj"] is None:
+            continue
+        now = min(event["time"], time_limit)
+        integral += last_gap * (now - last_time)
+        last_time, last_gap = now, primal_gap(event["obj"], ref)
+    return integral + last_gap * (time_limit - last_time)
+
+
+def summarize(header, events, ref, time_limit, gap):
+    solutions = [e for e in events if e["obj"] is not None]
+    best = min((e["obj"] for e in solutions), default=None)
+    target = None if ref is None else ref + gap * abs(ref)
+    bounds = [e["bound"] for e in events if e["bound"] is not None]
+    return {
+        "approach": header.get("approach"),
+        "variant": header.get("variant"),
+        "instance": header.get("instance"),
+        "ttf": solutions[0]["time"] if solutions else None,
+        "ttt": next((e["time"] for e in solutions if target is not None and e["obj"] <= target), None),
+        "integral": primal_integral(events, ref, time_limit) if ref is not None else float(time_limit),
+        "final": best,
+        "bound": max(bounds) if bounds else None,
+        "optimal": best is not None and bool(bounds) and max(bounds) >= best,
+    }
+
+
+def collect(trace_dir):
+    runs = []
+    for path in sorted(glob.glob(os.path.join(trace_dir, "*", "*.jsonl"))):
+        header, events = read_trace(path)
+        if header:
+            runs.append((header, events))
+    return runs
+
+
+def report(trace_dir=TRACE_DIR, time_limit=300, gap=0.05):
+    runs = collect(trace_dir)
+    references = {}
+    for header, events in runs:
+        for event in events:
+            if event["obj"] is not None:
+                instance = header.get("instance")
+                references[instance] = min(references.get(instance, event["obj"]), event["obj"])
+    rows = [summarize(header, events, references.get(header.get("instance")), time_limit, gap) for header, events in runs]
+    return sorted(rows, key=lambda r: (r["instance"] or "", r["approach"] or "", r["variant"] or ""))
+
+
+def _show(value, digits=2):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def print_table(rows, gap):
+    columns = ["instance", "approach", "variant", "ttf", f"ttt({gap:.0%})", "integral", "final"]
+    table = [[r["instance"], r["approach"], r["variant"], _show(r["ttf"]), _show(r["ttt"]), _show(r["integral"], 1),
+              _show(r["final"]) + ("*" if r["optimal"] else "")] for r in rows]
+    widths = [max(len(str(c)) for c in column) for column in zip(columns, *table)]
+    for line in [columns] + table:
+        print("  ".join(str(c).ljust(w) for c, w in zip(line, widths)))
+
+    # mean primal integral per approach variant, the lower the better
+    print()
+    totals = {}
+    for r in rows:
+        totals.setdefault((r["approach"], r["variant"]), []).append(r["integral"])
+    for (approach, variant), values in sorted(totals.items(), key=lambda item: sum(item[1]) / len(item[1])):
+        print(f"{approach} {variant}: mean primal integral {sum(values) / len(values):.1f} over {len(values)} instances")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="anytime performance report from the incumbent traces")
+    parser.add_argument("--trace-dir", default=TRACE_DIR)
+    parser.add_argument("--time-limit", type=float, default=300)
+    parser.add_argument("--gap", type=float, default=0.05, help="relative distance from the reference value for the time to target")
+    parser.add_argument("--csv", default=None, help="also write the rows to this csv file")
+    args = parser.parse_args(argv)
+
+    rows = report(args.trace_dir, args.time_limit, args.gap)
+    if not rows:
+        print(f"No traces found in {args.trace_dir}")
+        return
+    print_table(rows, args.gap)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+import json
+import math
+import os
+import time
+
+'''
+Anytime trace of a solver run: every approach reports each new incumbent (and, when the solver
+knows one, the current lower bound) as it happens, so that runs can be compared on how fast they
+get good and not only on their final objective.
+
+A trace is a json lines file, traces/<approach>/<instance>_<variant>.jsonl by default: a header
+line with the run metadata followed by one line per event
+
+    {"time": 1.84, "obj": 226, "bound": 190}
+
+where time is in seconds from the creation of the trace (the start of the job), obj the
+incumbent objective (null for a bound-only event) and bound the best lower bound known (null if
+the solver has none). An event with obj == bound closes the trace as proven optimal.
+Every event is flushed immediately, so the trace survives a job killed at the time limit.
+
+Summary metrics are computed by models/trace_report.py.
+'''
+
+TRACE_DIR = os.path.join(".", "traces")
+
+
+class Trace:
+    def __init__(self, path=None, **meta):
+        # without a path the events are only kept in memory
+        self.start = time.time()
+        self.events = []
+        self.best_obj = None
+        self.best_bound = None
+        self.file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.file = open(path, "w")
+            self._write({"start": self.start, **meta})
+
+    def _write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+    def _event(self, obj, bound):
+        event = {"time": round(time.time() - self.start, 4), "obj": obj, "bound": bound}
+        self.events.append(event)
+        self._write(event)
+
+    def incumbent(self, obj, bound=None):
+        '''
+        record a new solution of value obj, ignored if it does not improve the best one
+        '''
+        if obj is None:
+            return
+        obj = _number(obj)
+        if self.best_obj is not None and obj >= self.best_obj:
+            return
+        self.best_obj = obj
+        if _finite(bound) and (self.best_bound is None or _number(bound) > self.best_bound):
+            self.best_bound = _number(bound)
+        self._event(obj, self.best_bound)
+
+    def bound(self, bound):
+        '''
+        record an improved lower bound on the objective
+        '''
+        if not _finite(bound):
+            return
+        bound = _number(bound)
+        if self.best_bound is not None and bound <= self.best_bound:
+            return
+        self.best_bound = bound
+        self._event(None, bound)
+
+    def optimal(self):
+        '''
+        the best incumbent has been proven optimal
+        '''
+        if self.best_obj is not None:
+            self.bound(self.best_obj)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _finite(value):
+    # solvers report a missing bound as None or as +-infinity
+    return value is not None and math.isfinite(float(value))
+
+
+def _number(value):
+    # solvers report integral objectives as floats (Gurobi) or z3 numerals
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def trace_path(approach, instance_num, variant, trace_dir=TRACE_DIR):
+    return os.path.join(trace_dir, approach, f"{instance_num}_{variant}.jsonl")
+
+
+def open_trace(approach, instance_num, variant, trace_dir=TRACE_DIR):
+    return Trace(trace_path(approach, instance_num, variant, trace_dir),
+                 approach=approach, variant=variant, instance=instance_num)
+
+
+def read_trace(path):
+    '''
+    returns (header, events) of a trace file
+    '''
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        return {}, []
+    return records[0], records[1:]